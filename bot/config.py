@@ -1,6 +1,6 @@
 import os
 from dataclasses import dataclass
-from typing import Set
+from typing import Optional, Set
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -16,6 +16,38 @@ class Config:
     questions_per_day: int
     high_score_threshold: int
     whitelist: Set[int]
+    delivery_concurrency: int
+    telegram_global_rate: float
+    telegram_chat_interval: float
+    selection_batch_size: int
+    catalog_refresh_seconds: int
+    selection_engine: str
+    answered_cache_size: int
+    user_context_cache_size: int
+    ai_async: bool
+    ai_executor_workers: int
+    ai_hedge_percentile: Optional[float]
+    ai_hedge_max_ratio: float
+    ai_request_timeout: Optional[float]
+    update_deadline_seconds: Optional[float]
+    hint_pregen_hour: Optional[int]
+    hint_pregen_concurrency: int
+    ai_jobs_enabled: bool
+    ai_job_workers: int
+    ai_job_max_attempts: int
+    ai_job_poll_interval: float
+    speculative_feedback: bool
+    speculative_feedback_per_user: int
+    speculative_feedback_max_inflight: int
+    speculative_feedback_hourly_budget: int
+    ai_streaming: bool
+    ai_stream_edit_interval: float
+    grading_hour: Optional[int]
+    grading_batch_size: int
+    grading_max_answers: int
+    feedback_cache_ttl_hours: float
+    feedback_cache_max_rows: int
+    feedback_cache_memory_size: int
 
     @classmethod
     def from_env(cls) -> "Config":
@@ -29,6 +61,19 @@ class Config:
                 # Если есть невалидные значения, игнорируем их
                 pass
         
+        # Час ночной догенерации подсказок (пусто - отключено)
+        hint_pregen_hour = os.getenv("HINT_PREGEN_HOUR", "").strip()
+        
+        # Час ночной пакетной оценки ответов без фидбека (пусто - отключено)
+        grading_hour = os.getenv("GRADING_HOUR", "").strip()
+        
+        # Перцентиль задержки модели, после которого запрос дублируется на другую модель (пусто - отключено)
+        ai_hedge_percentile = os.getenv("AI_HEDGE_PERCENTILE", "").strip()
+        
+        # Таймаут одного запроса к ИИ и бюджет времени на обработку апдейта (пусто - без ограничения)
+        ai_request_timeout = os.getenv("AI_REQUEST_TIMEOUT", "60").strip()
+        update_deadline = os.getenv("UPDATE_DEADLINE_SECONDS", "60").strip()
+        
         return cls(
             bot_token=os.getenv("BOT_TOKEN", ""),
             database_url=os.getenv("DATABASE_URL", "postgresql+asyncpg://postgres:postgres@db:5432/devops_mock"),
@@ -38,5 +83,37 @@ class Config:
             questions_per_day=int(os.getenv("QUESTIONS_PER_DAY", "5")),
             high_score_threshold=int(os.getenv("HIGH_SCORE_THRESHOLD", "5")),
             whitelist=whitelist,
+            delivery_concurrency=int(os.getenv("DELIVERY_CONCURRENCY", "20")),
+            telegram_global_rate=float(os.getenv("TELEGRAM_GLOBAL_RATE", "25")),
+            telegram_chat_interval=float(os.getenv("TELEGRAM_CHAT_INTERVAL", "1.0")),
+            selection_batch_size=int(os.getenv("SELECTION_BATCH_SIZE", "500")),
+            catalog_refresh_seconds=int(os.getenv("CATALOG_REFRESH_SECONDS", "60")),
+            selection_engine=os.getenv("SELECTION_ENGINE", "sql").strip().lower(),
+            answered_cache_size=int(os.getenv("ANSWERED_CACHE_SIZE", "100000")),
+            user_context_cache_size=int(os.getenv("USER_CONTEXT_CACHE_SIZE", "100000")),
+            ai_async=os.getenv("AI_ASYNC", "true").strip().lower() in ("1", "true", "yes"),
+            ai_executor_workers=int(os.getenv("AI_EXECUTOR_WORKERS", "4")),
+            ai_hedge_percentile=float(ai_hedge_percentile) if ai_hedge_percentile else None,
+            ai_hedge_max_ratio=float(os.getenv("AI_HEDGE_MAX_RATIO", "0.1")),
+            ai_request_timeout=float(ai_request_timeout) if ai_request_timeout else None,
+            update_deadline_seconds=float(update_deadline) if update_deadline else None,
+            hint_pregen_hour=int(hint_pregen_hour) if hint_pregen_hour else None,
+            hint_pregen_concurrency=int(os.getenv("HINT_PREGEN_CONCURRENCY", "2")),
+            ai_jobs_enabled=os.getenv("AI_JOBS_ENABLED", "false").strip().lower() in ("1", "true", "yes"),
+            ai_job_workers=int(os.getenv("AI_JOB_WORKERS", "4")),
+            ai_job_max_attempts=int(os.getenv("AI_JOB_MAX_ATTEMPTS", "5")),
+            ai_job_poll_interval=float(os.getenv("AI_JOB_POLL_INTERVAL", "0.5")),
+            speculative_feedback=os.getenv("SPECULATIVE_FEEDBACK", "false").strip().lower() in ("1", "true", "yes"),
+            speculative_feedback_per_user=int(os.getenv("SPECULATIVE_FEEDBACK_PER_USER", "1")),
+            speculative_feedback_max_inflight=int(os.getenv("SPECULATIVE_FEEDBACK_MAX_INFLIGHT", "10")),
+            speculative_feedback_hourly_budget=int(os.getenv("SPECULATIVE_FEEDBACK_HOURLY_BUDGET", "200")),
+            ai_streaming=os.getenv("AI_STREAMING", "false").strip().lower() in ("1", "true", "yes"),
+            ai_stream_edit_interval=float(os.getenv("AI_STREAM_EDIT_INTERVAL", "1.0")),
+            grading_hour=int(grading_hour) if grading_hour else None,
+            grading_batch_size=int(os.getenv("GRADING_BATCH_SIZE", "20")),
+            grading_max_answers=int(os.getenv("GRADING_MAX_ANSWERS", "1000")),
+            feedback_cache_ttl_hours=float(os.getenv("FEEDBACK_CACHE_TTL_HOURS", "720")),
+            feedback_cache_max_rows=int(os.getenv("FEEDBACK_CACHE_MAX_ROWS", "100000")),
+            feedback_cache_memory_size=int(os.getenv("FEEDBACK_CACHE_MEMORY_SIZE", "4096")),
         )
 
@@ -1,29 +1,118 @@
-from typing import Optional, List
-from sqlalchemy import select, and_, or_, func
+from datetime import timedelta
+from typing import Optional, List, Dict
+from sqlalchemy import (
+    select,
+    update,
+    delete,
+    and_,
+    or_,
+    func,
+    case,
+    exists,
+    true,
+    false,
+    literal,
+    tuple_,
+    union_all,
+    values,
+    column,
+    literal_column,
+    cast,
+    ColumnElement,
+    BigInteger,
+)
+from sqlalchemy.dialects.postgresql import insert as pg_insert, JSONB, JSONPATH
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import selectinload
-from bot.db.models import User, Question, UserQuestion, UserState
+from sqlalchemy.orm import aliased, selectinload
+from bot.db.models import (
+    User,
+    Question,
+    UserQuestion,
+    UserState,
+    CatalogVersion,
+    HintCache,
+    FeedbackCache,
+    AIJob,
+)
+
+# Ключ session.info: новые значения user_state, записанные в текущей транзакции,
+# {user_id: (awaiting_question_id, pending_question_ids)}. После коммита их применяет
+# кэш контекста пользователей (bot/services/user_context.py), после отката они отбрасываются
+USER_STATE_WRITES = "user_state_writes"
+
+
+def _record_user_state(
+    session: AsyncSession,
+    user_id: int,
+    awaiting_question_id: Optional[int],
+    pending_question_ids: Optional[List[int]],
+) -> None:
+    session.info.setdefault(USER_STATE_WRITES, {})[user_id] = (awaiting_question_id, pending_question_ids)
 
 
 async def get_or_create_user(session: AsyncSession, tg_user_id: int) -> User:
-    """Получает или создает пользователя."""
-    stmt = select(User).where(User.tg_user_id == tg_user_id)
-    result = await session.execute(stmt)
-    user = result.scalar_one_or_none()
+    """
+    Получает или создает пользователя вместе с user_state одним запросом.
     
-    if user is None:
-        user = User(tg_user_id=tg_user_id, is_active=True)
-        session.add(user)
-        await session.flush()
+    Существующий пользователь читается в CTE, новый вставляется с ON CONFLICT DO NOTHING
+    (без траты значения последовательности на каждый вызов). Если пользователя
+    одновременно создал другой апдейт, вставка ничего не вернет, а снимок запроса его
+    еще не видит - тогда пользователь читается отдельным SELECT.
+    """
+    existing = (
+        select(User.id, User.tg_user_id, User.is_active, User.created_at)
+        .where(User.tg_user_id == tg_user_id)
+        .cte("existing")
+    )
+    new_user = (
+        pg_insert(User)
+        .from_select(
+            ["tg_user_id", "is_active"],
+            select(literal(tg_user_id, BigInteger), true()).where(~exists(existing.select())),
+        )
+        .on_conflict_do_nothing(index_elements=[User.tg_user_id])
+        .returning(User.id, User.tg_user_id, User.is_active, User.created_at)
+        .cte("new_user")
+    )
+    new_state = (
+        pg_insert(UserState)
+        .from_select(["user_id"], select(new_user.c.id))
+        .returning(UserState.user_id)
+        .cte("new_state")
+    )
+    found = union_all(
+        select(existing, false().label("created")),
+        select(new_user, true().label("created")),
+    ).add_cte(new_state).subquery("found")
+    user_row = aliased(User, found)
         
-        # Создаем user_state
-        user_state = UserState(user_id=user.id, awaiting_question_id=None)
-        session.add(user_state)
-        await session.flush()
+    row = (await session.execute(select(user_row, found.c.created))).first()
+    if row is None:
+        result = await session.execute(select(User).where(User.tg_user_id == tg_user_id))
+        return result.scalar_one()
     
+    user, created = row
+    if created:
+        _record_user_state(session, user.id, None, None)
     return user
 
 
+async def get_user_context(session: AsyncSession, tg_user_id: int):
+    """
+    Читает одним запросом id пользователя и его user_state.
+    
+    Returns:
+        Строку (user_id, awaiting_question_id, pending_question_ids) или None, если пользователя нет
+    """
+    stmt = (
+        select(User.id, UserState.awaiting_question_id, UserState.pending_question_ids)
+        .outerjoin(UserState, UserState.user_id == User.id)
+        .where(User.tg_user_id == tg_user_id)
+    )
+    result = await session.execute(stmt)
+    return result.one_or_none()
+
+
 async def get_stats(session: AsyncSession, user_id: int) -> dict:
     """Возвращает статистику пользователя."""
     answered_count = await session.scalar(
@@ -46,6 +135,16 @@ async def get_stats(session: AsyncSession, user_id: int) -> dict:
     }
 
 
+def _not_answered(user_id) -> ColumnElement[bool]:
+    """Условие NOT EXISTS: пользователь еще не ответил на Question."""
+    return ~exists().where(
+        UserQuestion.user_id == user_id,
+        UserQuestion.question_id == Question.id,
+        # Литерал, а не параметр: иначе планировщик не сопоставит условие с частичным индексом
+        UserQuestion.status == literal("answered", literal_execute=True),
+    )
+
+
 async def select_next_questions(
     session: AsyncSession,
     user_id: int,
@@ -59,15 +158,9 @@ async def select_next_questions(
     Возвращает high_n вопросов с freq_score > threshold и low_n с <= threshold,
     всего total_n вопросов (с добором при нехватке).
     """
-    # Получаем ID вопросов, на которые уже отвечено
-    answered_stmt = select(UserQuestion.question_id).where(
-        and_(UserQuestion.user_id == user_id, UserQuestion.status == "answered")
-    )
-    answered_result = await session.execute(answered_stmt)
-    answered_ids = {row[0] for row in answered_result.all()}
-    
-    # Формируем базовое условие исключения отвеченных
-    base_condition = ~Question.id.in_(answered_ids) if answered_ids else True
+    # Исключаем отвеченные на стороне БД (anti-join по ix_user_questions_answered),
+    # не выгружая их список в Python
+    base_condition = _not_answered(user_id)
     
     # Выбираем high вопросы (freq_score > threshold)
     high_stmt = (
@@ -100,11 +193,9 @@ async def select_next_questions(
     
     # Если не хватает, добираем из оставшихся (любые, не отвеченные)
     if len(result) < total_n:
-        remaining_ids = answered_ids | selected_ids
-        remaining_condition = ~Question.id.in_(remaining_ids) if remaining_ids else True
         remaining_stmt = (
             select(Question)
-            .where(remaining_condition)
+            .where(and_(base_condition, ~Question.id.in_(selected_ids)) if selected_ids else base_condition)
             .order_by(Question.freq_score.desc(), Question.id.asc())
             .limit(total_n - len(result))
         )
@@ -117,49 +208,290 @@ async def select_next_questions(
     return result[:total_n]
 
 
+async def get_answered_question_ids(session: AsyncSession, user_ids: list[int]) -> Dict[int, list[int]]:
+    """Получает ID отвеченных вопросов для нескольких пользователей одним запросом."""
+    stmt = select(UserQuestion.user_id, UserQuestion.question_id).where(
+        and_(
+            UserQuestion.user_id.in_(user_ids),
+            UserQuestion.status == literal("answered", literal_execute=True),
+        )
+    )
+    result = await session.execute(stmt)
+    answered: Dict[int, list[int]] = {}
+    for user_id, question_id in result.all():
+        answered.setdefault(user_id, []).append(question_id)
+    return answered
+
+
+async def select_next_questions_bulk(
+    session: AsyncSession,
+    user_ids: list[int],
+    high_n: int,
+    low_n: int,
+    total_n: int,
+    threshold: int,
+) -> Dict[int, list[Question]]:
+    """
+    Выбирает вопросы сразу для пачки пользователей одним запросом.
+    Правила те же, что в select_next_questions: сначала high_n вопросов с freq_score > threshold,
+    затем low_n с <= threshold, затем добор из оставшихся, всего не больше total_n.
+    
+    Returns:
+        Словарь user_id -> список вопросов (пользователи без вопросов отсутствуют)
+    """
+    if not user_ids:
+        return {}
+    
+    is_high = Question.freq_score > threshold
+    
+    # Ранг вопроса внутри своей категории (high/low) для каждого пользователя
+    candidates = (
+        select(
+            User.id.label("user_id"),
+            Question.id.label("question_id"),
+            Question.freq_score.label("freq_score"),
+            is_high.label("is_high"),
+            func.row_number().over(
+                partition_by=(User.id, is_high),
+                order_by=(Question.freq_score.desc(), Question.id.asc()),
+            ).label("bucket_rank"),
+        )
+        .select_from(User)
+        .join(Question, true())
+        .where(and_(User.id.in_(user_ids), _not_answered(User.id)))
+        .subquery("candidates")
+    )
+    
+    # 0 - квота high, 1 - квота low, 2 - добор
+    c = candidates.c
+    preference = case(
+        (and_(c.is_high, c.bucket_rank <= high_n), 0),
+        (and_(~c.is_high, c.bucket_rank <= low_n), 1),
+        else_=2,
+    )
+    ranked = select(
+        c.user_id,
+        c.question_id,
+        func.row_number().over(
+            partition_by=c.user_id,
+            order_by=(preference, c.freq_score.desc(), c.question_id.asc()),
+        ).label("pick"),
+    ).subquery("ranked")
+    
+    stmt = (
+        select(ranked.c.user_id, Question)
+        .join(Question, Question.id == ranked.c.question_id)
+        .where(ranked.c.pick <= total_n)
+        .order_by(ranked.c.user_id, ranked.c.pick)
+    )
+    result = await session.execute(stmt)
+    
+    selections: Dict[int, list[Question]] = {}
+    for user_id, question in result.all():
+        selections.setdefault(user_id, []).append(question)
+    return selections
+
+
 async def mark_sent(session: AsyncSession, user_id: int, question_ids: list[int]) -> None:
-    """Помечает вопросы как отправленные."""
-    for question_id in question_ids:
-        stmt = select(UserQuestion).where(
-            and_(UserQuestion.user_id == user_id, UserQuestion.question_id == question_id)
+    """Помечает вопросы как отправленные (одним INSERT ... ON CONFLICT)."""
+    await mark_sent_bulk(session, {user_id: question_ids})
+
+
+async def mark_sent_bulk(
+    session: AsyncSession,
+    selections: Dict[int, List[int]],
+) -> Dict[int, Dict[int, Optional[tuple]]]:
+    """
+    Помечает вопросы как отправленные сразу для нескольких пользователей одним запросом.
+    
+    Вопрос, уже отправленный раньше (без ответа), может попасть в подборку снова:
+    его строка обновляется (status и sent_at), а не создается.
+    
+    Returns:
+        {user_id: {question_id: None, если строку создал этот запрос, иначе прежние
+        (status, sent_at)}} для restore_daily_state_bulk
+    """
+    rows = [
+        {"user_id": user_id, "question_id": question_id, "status": "sent"}
+        for user_id, question_ids in selections.items()
+        for question_id in question_ids
+    ]
+    if not rows:
+        return {}
+    
+    # Прежние значения читаются в том же запросе (CTE видит строки до изменения)
+    previous = (
+        select(UserQuestion.user_id, UserQuestion.question_id, UserQuestion.status, UserQuestion.sent_at)
+        .where(tuple_(UserQuestion.user_id, UserQuestion.question_id).in_([
+            (row["user_id"], row["question_id"]) for row in rows
+        ]))
+        .cte("previous")
+    )
+    upsert = pg_insert(UserQuestion).values(rows)
+    upsert = upsert.on_conflict_do_update(
+        constraint="uq_user_question",
+        set_={"status": upsert.excluded.status, "sent_at": func.now()},
+    ).returning(
+        UserQuestion.user_id,
+        UserQuestion.question_id,
+        # xmax = 0 только у строк, вставленных этим запросом
+        literal_column("xmax = 0").label("inserted"),
+    ).cte("upsert")
+    stmt = select(
+        upsert.c.user_id,
+        upsert.c.question_id,
+        upsert.c.inserted,
+        previous.c.status,
+        previous.c.sent_at,
+    ).outerjoin(
+        previous,
+        and_(previous.c.user_id == upsert.c.user_id, previous.c.question_id == upsert.c.question_id),
+    )
+    
+    marks: Dict[int, Dict[int, Optional[tuple]]] = {}
+    for user_id, question_id, inserted, status, sent_at in await session.execute(stmt):
+        if inserted:
+            marks.setdefault(user_id, {})[question_id] = None
+        elif status is not None:
+            # Строку, вставленную параллельно после снимка запроса, откатывать не к чему
+            marks.setdefault(user_id, {})[question_id] = (status, sent_at)
+    return marks
+
+
+async def set_daily_state_bulk(session: AsyncSession, selections: Dict[int, List[int]]) -> Dict[int, tuple]:
+    """
+    Сохраняет очередь вопросов и ожидание первого вопроса для нескольких пользователей
+    одним запросом.
+    
+    Returns:
+        Прежнее состояние {user_id: (awaiting_question_id, pending_question_ids)} для
+        restore_daily_state_bulk, если подборка до пользователя не дойдет
+    """
+    rows = [
+        {
+            "user_id": user_id,
+            "awaiting_question_id": question_ids[0],
+            "pending_question_ids": question_ids,
+        }
+        for user_id, question_ids in selections.items()
+        if question_ids
+    ]
+    if not rows:
+        return {}
+    
+    # Прежние значения читаются в том же запросе (CTE видит строки до изменения)
+    previous = (
+        select(UserState.user_id, UserState.awaiting_question_id, UserState.pending_question_ids)
+        .where(UserState.user_id.in_([row["user_id"] for row in rows]))
+        .cte("previous")
+    )
+    upsert = pg_insert(UserState).values(rows)
+    upsert = upsert.on_conflict_do_update(
+        index_elements=[UserState.user_id],
+        set_={
+            "awaiting_question_id": upsert.excluded.awaiting_question_id,
+            "pending_question_ids": upsert.excluded.pending_question_ids,
+        },
+    ).returning(UserState.user_id).cte("upsert")
+    result = await session.execute(select(previous).add_cte(upsert))
+    for row in rows:
+        _record_user_state(session, row["user_id"], row["awaiting_question_id"], row["pending_question_ids"])
+    return {user_id: (awaiting, pending) for user_id, awaiting, pending in result}
+
+
+async def restore_daily_state_bulk(
+    session: AsyncSession,
+    selections: Dict[int, List[int]],
+    previous: Dict[int, tuple],
+    marks: Dict[int, Dict[int, Optional[tuple]]],
+) -> None:
+    """
+    Откатывает ежедневную подборку пользователей, которым она не дошла: удаляет
+    строки user_questions, созданные mark_sent_bulk, возвращает прежние status и
+    sent_at обновленным им строкам и прежние ожидание и очередь из set_daily_state_bulk.
+    
+    Состояние возвращается, только если пользователь все еще ждет первый вопрос
+    подборки (его не изменил, например, /today).
+    """
+    selections = {user_id: question_ids for user_id, question_ids in selections.items() if question_ids}
+    if not selections:
+        return
+    
+    user_marks = [
+        (user_id, question_id, mark)
+        for user_id in selections
+        for question_id, mark in marks.get(user_id, {}).items()
+    ]
+    inserted = [(user_id, question_id) for user_id, question_id, mark in user_marks if mark is None]
+    if inserted:
+        await session.execute(
+            delete(UserQuestion)
+            .where(tuple_(UserQuestion.user_id, UserQuestion.question_id).in_(inserted))
+            .execution_options(synchronize_session=False)
+        )
+    
+    updated = [(user_id, question_id, *mark) for user_id, question_id, mark in user_marks if mark is not None]
+    if updated:
+        resent = values(
+            column("user_id", BigInteger),
+            column("question_id", BigInteger),
+            column("status", UserQuestion.status.type),
+            column("sent_at", UserQuestion.sent_at.type),
+            name="resent",
+        ).data(updated)
+        await session.execute(
+            update(UserQuestion)
+            .where(and_(
+                UserQuestion.user_id == resent.c.user_id,
+                UserQuestion.question_id == resent.c.question_id,
+            ))
+            .values(status=resent.c.status, sent_at=resent.c.sent_at)
+            .execution_options(synchronize_session=False)
         )
-        result = await session.execute(stmt)
-        uq = result.scalar_one_or_none()
-        
-        if uq is None:
-            uq = UserQuestion(
-                user_id=user_id,
-                question_id=question_id,
-                status="sent",
-            )
-            session.add(uq)
-        else:
-            uq.status = "sent"
     
-    await session.flush()
+    restored = values(
+        column("user_id", BigInteger),
+        column("daily_question_id", BigInteger),
+        column("awaiting_question_id", BigInteger),
+        column("pending_question_ids", JSONB(none_as_null=True)),
+        name="restored",
+    ).data([
+        (user_id, question_ids[0], *previous.get(user_id, (None, None)))
+        for user_id, question_ids in selections.items()
+    ])
+    stmt = (
+        update(UserState)
+        .where(and_(
+            UserState.user_id == restored.c.user_id,
+            UserState.awaiting_question_id == restored.c.daily_question_id,
+        ))
+        .values(
+            # NULL в VALUES без типа Postgres считает текстом
+            awaiting_question_id=cast(restored.c.awaiting_question_id, BigInteger),
+            pending_question_ids=cast(restored.c.pending_question_ids, JSONB),
+        )
+        .returning(UserState.user_id, UserState.awaiting_question_id, UserState.pending_question_ids)
+        .execution_options(synchronize_session=False)
+    )
+    for user_id, awaiting, pending in await session.execute(stmt):
+        _record_user_state(session, user_id, awaiting, pending)
 
 
 async def set_awaiting(session: AsyncSession, user_id: int, question_id: Optional[int]) -> None:
     """Устанавливает awaiting_question_id для пользователя."""
-    stmt = select(UserState).where(UserState.user_id == user_id)
-    result = await session.execute(stmt)
-    state = result.scalar_one_or_none()
-    
-    if state is None:
-        state = UserState(user_id=user_id, awaiting_question_id=question_id)
-        session.add(state)
-    else:
-        state.awaiting_question_id = question_id
-    
-    await session.flush()
+    stmt = pg_insert(UserState).values(user_id=user_id, awaiting_question_id=question_id)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[UserState.user_id],
+        set_={"awaiting_question_id": stmt.excluded.awaiting_question_id},
+    ).returning(UserState.pending_question_ids)
+    pending = (await session.execute(stmt)).scalar_one()
+    _record_user_state(session, user_id, question_id, pending)
 
 
 async def get_awaiting(session: AsyncSession, user_id: int) -> Optional[int]:
     """Получает awaiting_question_id для пользователя."""
-    stmt = select(UserState).where(UserState.user_id == user_id)
-    result = await session.execute(stmt)
-    state = result.scalar_one_or_none()
-    return state.awaiting_question_id if state else None
+    stmt = select(UserState.awaiting_question_id).where(UserState.user_id == user_id)
+    return await session.scalar(stmt)
 
 
 async def save_answer(
@@ -171,29 +503,25 @@ async def save_answer(
     """Сохраняет ответ пользователя."""
     from datetime import datetime, timezone
     
-    stmt = select(UserQuestion).where(
-        and_(UserQuestion.user_id == user_id, UserQuestion.question_id == question_id)
+    stmt = pg_insert(UserQuestion).values(
+        user_id=user_id,
+        question_id=question_id,
+        status="answered",
+        answer_text=text,
+        answered_at=datetime.now(timezone.utc),
     )
-    result = await session.execute(stmt)
-    uq = result.scalar_one_or_none()
-    
-    if uq is None:
-        uq = UserQuestion(
-            user_id=user_id,
-            question_id=question_id,
-            status="answered",
-            answer_text=text,
-            answered_at=datetime.now(timezone.utc),
-        )
-        session.add(uq)
-    else:
-        uq.status = "answered"
-        uq.answer_text = text
-        uq.answered_at = datetime.now(timezone.utc)
+    stmt = stmt.on_conflict_do_update(
+        constraint="uq_user_question",
+        set_={
+            "status": stmt.excluded.status,
+            "answer_text": stmt.excluded.answer_text,
+            "answered_at": stmt.excluded.answered_at,
+        },
+    )
+    await session.execute(stmt)
     
     # Сбрасываем awaiting
     await set_awaiting(session, user_id, None)
-    await session.flush()
 
 
 async def get_active_users(session: AsyncSession) -> list[User]:
@@ -203,44 +531,145 @@ async def get_active_users(session: AsyncSession) -> list[User]:
     return list(result.scalars().all())
 
 
-async def set_pending_questions(session: AsyncSession, user_id: int, question_ids: List[int]) -> None:
-    """Устанавливает очередь вопросов для пользователя."""
-    stmt = select(UserState).where(UserState.user_id == user_id)
+async def get_active_user_ids(session: AsyncSession) -> list[tuple[int, int]]:
+    """Получает пары (user_id, tg_user_id) всех активных пользователей."""
+    stmt = select(User.id, User.tg_user_id).where(User.is_active == True).order_by(User.id)
     result = await session.execute(stmt)
-    state = result.scalar_one_or_none()
-    
-    if state is None:
-        state = UserState(user_id=user_id, pending_question_ids=question_ids)
-        session.add(state)
-    else:
-        state.pending_question_ids = question_ids
-    
-    await session.flush()
+    return [(user_id, tg_user_id) for user_id, tg_user_id in result.all()]
+
+
+async def set_pending_questions(session: AsyncSession, user_id: int, question_ids: List[int]) -> None:
+    """Заменяет очередь вопросов пользователя целиком."""
+    stmt = pg_insert(UserState).values(user_id=user_id, pending_question_ids=question_ids)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[UserState.user_id],
+        set_={"pending_question_ids": stmt.excluded.pending_question_ids},
+    ).returning(UserState.awaiting_question_id)
+    awaiting = (await session.execute(stmt)).scalar_one()
+    _record_user_state(session, user_id, awaiting, question_ids)
 
 
 async def get_pending_questions(session: AsyncSession, user_id: int) -> List[int]:
     """Получает очередь вопросов для пользователя."""
-    stmt = select(UserState).where(UserState.user_id == user_id)
-    result = await session.execute(stmt)
-    state = result.scalar_one_or_none()
-    return state.pending_question_ids if state and state.pending_question_ids else []
+    stmt = select(UserState.pending_question_ids).where(UserState.user_id == user_id)
+    pending = await session.scalar(stmt)
+    return pending or []
 
 
 async def pop_next_question(session: AsyncSession, user_id: int) -> Optional[int]:
-    """Извлекает следующий вопрос из очереди."""
-    stmt = select(UserState).where(UserState.user_id == user_id)
-    result = await session.execute(stmt)
-    state = result.scalar_one_or_none()
-    
-    if not state or not state.pending_question_ids:
+    """
+    Извлекает следующий вопрос из очереди одним UPDATE ... RETURNING.
+    Строка блокируется на время запроса, поэтому параллельные вызовы не выдадут один вопрос дважды.
+    """
+    # Старое значение очереди: RETURNING в Postgres отдает только новые значения строки
+    old = (
+        select(UserState.user_id, UserState.pending_question_ids.label("pending"))
+        .where(and_(UserState.user_id == user_id, UserState.pending_question_ids.op("->")(0).is_not(None)))
+        .with_for_update()
+        .subquery("old")
+    )
+    stmt = (
+        update(UserState)
+        .where(UserState.user_id == old.c.user_id)
+        .values(pending_question_ids=_empty_queue_as_null(UserState.pending_question_ids.op("-")(0)))
+        .returning(
+            old.c.pending.op("->>")(0).cast(BigInteger),
+            UserState.awaiting_question_id,
+            UserState.pending_question_ids,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    row = (await session.execute(stmt)).one_or_none()
+    if row is None:
         return None
+    question_id, awaiting, pending = row
+    _record_user_state(session, user_id, awaiting, pending)
+    return question_id
+
+
+async def remove_pending_question(session: AsyncSession, user_id: int, question_id: int) -> None:
+    """Удаляет вопрос из очереди пользователя одним UPDATE (без чтения строки)."""
+    stmt = (
+        update(UserState)
+        .where(and_(
+            UserState.user_id == user_id,
+            UserState.pending_question_ids.contains([question_id]),
+        ))
+        .values(pending_question_ids=_empty_queue_as_null(_queue_without(question_id)))
+        .returning(UserState.awaiting_question_id, UserState.pending_question_ids)
+        .execution_options(synchronize_session=False)
+    )
+    row = (await session.execute(stmt)).one_or_none()
+    if row is not None:
+        _record_user_state(session, user_id, *row)
+
+
+async def save_answer_and_dequeue(session: AsyncSession, user_id: int, question_id: int, text: str) -> bool:
+    """
+    Сохраняет ответ на ожидаемый вопрос одним запросом: снимает ожидание, убирает
+    вопрос из очереди и записывает ответ (UPDATE user_state и INSERT в CTE).
     
-    question_id = state.pending_question_ids.pop(0)
-    if not state.pending_question_ids:
-        state.pending_question_ids = None
+    Ответ сохраняется, только если пользователь действительно ждет этот вопрос,
+    поэтому question_id можно брать из кэша: устаревшее значение ничего не запишет.
     
-    await session.flush()
-    return question_id
+    Returns:
+        True если ответ сохранен
+    """
+    from datetime import datetime, timezone
+    
+    state = (
+        update(UserState)
+        .where(and_(UserState.user_id == user_id, UserState.awaiting_question_id == question_id))
+        .values(
+            awaiting_question_id=None,
+            pending_question_ids=_empty_queue_as_null(_queue_without(question_id)),
+        )
+        .returning(UserState.user_id, UserState.awaiting_question_id, UserState.pending_question_ids)
+        .cte("state")
+    )
+    answer = pg_insert(UserQuestion).from_select(
+        ["user_id", "question_id", "status", "answer_text", "answered_at"],
+        select(
+            state.c.user_id,
+            literal(question_id, BigInteger),
+            literal("answered"),
+            literal(text),
+            literal(datetime.now(timezone.utc)),
+        ),
+    )
+    answer = answer.on_conflict_do_update(
+        constraint="uq_user_question",
+        set_={
+            "status": answer.excluded.status,
+            "answer_text": answer.excluded.answer_text,
+            "answered_at": answer.excluded.answered_at,
+        },
+    ).returning(UserQuestion.id).cte("answer")
+    stmt = select(
+        state.c.awaiting_question_id,
+        state.c.pending_question_ids,
+        select(func.count()).select_from(answer).scalar_subquery(),
+    )
+    row = (await session.execute(stmt)).one_or_none()
+    if row is None:
+        return False
+    awaiting, pending, _ = row
+    _record_user_state(session, user_id, awaiting, pending)
+    return True
+
+
+def _queue_without(question_id: int) -> ColumnElement:
+    """Очередь вопросов без question_id (вычисляется в БД, без чтения строки)."""
+    return func.jsonb_path_query_array(
+        UserState.pending_question_ids,
+        literal("$[*] ? (@ != $id)", JSONPATH),
+        func.jsonb_build_object("id", question_id),
+    )
+
+
+def _empty_queue_as_null(queue) -> ColumnElement:
+    """Пустая очередь хранится как NULL."""
+    return func.nullif(queue, literal([], JSONB))
 
 
 async def save_feedback(
@@ -248,17 +677,46 @@ async def save_feedback(
     user_id: int,
     question_id: int,
     feedback_text: str,
+    only_missing: bool = False,
 ) -> None:
-    """Сохраняет фидбек ИИ на ответ пользователя."""
-    stmt = select(UserQuestion).where(
-        and_(UserQuestion.user_id == user_id, UserQuestion.question_id == question_id)
+    """
+    Сохраняет фидбек ИИ на ответ пользователя (только если запись уже существует).
+    
+    only_missing=True - не перезаписывать фидбек, который уже есть (для фоновой оценки).
+    """
+    stmt = (
+        update(UserQuestion)
+        .where(and_(UserQuestion.user_id == user_id, UserQuestion.question_id == question_id))
+        .values(feedback_text=feedback_text)
     )
-    result = await session.execute(stmt)
-    uq = result.scalar_one_or_none()
+    if only_missing:
+        stmt = stmt.where(UserQuestion.feedback_text.is_(None))
+    await session.execute(stmt)
+
+
+async def get_ungraded_answers(
+    session: AsyncSession,
+    limit: int,
+    after_id: int = 0,
+) -> list:
+    """
+    Получает ответы без фидбека в порядке id, начиная после after_id (keyset-пагинация).
     
-    if uq is not None:
-        uq.feedback_text = feedback_text
-        await session.flush()
+    Returns:
+        Строки с полями id, user_id, question_id, answer_text
+    """
+    stmt = (
+        select(UserQuestion.id, UserQuestion.user_id, UserQuestion.question_id, UserQuestion.answer_text)
+        .where(
+            UserQuestion.status == literal("answered", literal_execute=True),
+            UserQuestion.feedback_text.is_(None),
+            UserQuestion.id > after_id,
+        )
+        .order_by(UserQuestion.id)
+        .limit(limit)
+    )
+    result = await session.execute(stmt)
+    return list(result.all())
 
 
 async def save_hint(
@@ -268,25 +726,18 @@ async def save_hint(
     hint_text: str,
 ) -> None:
     """Сохраняет подсказку ИИ для вопроса."""
-    stmt = select(UserQuestion).where(
-        and_(UserQuestion.user_id == user_id, UserQuestion.question_id == question_id)
+    # Создаем запись если её нет
+    stmt = pg_insert(UserQuestion).values(
+        user_id=user_id,
+        question_id=question_id,
+        status="sent",
+        hint_text=hint_text,
     )
-    result = await session.execute(stmt)
-    uq = result.scalar_one_or_none()
-    
-    if uq is None:
-        # Создаем запись если её нет
-        uq = UserQuestion(
-            user_id=user_id,
-            question_id=question_id,
-            status="sent",
-            hint_text=hint_text,
-        )
-        session.add(uq)
-    else:
-        uq.hint_text = hint_text
-    
-    await session.flush()
+    stmt = stmt.on_conflict_do_update(
+        constraint="uq_user_question",
+        set_={"hint_text": stmt.excluded.hint_text},
+    )
+    await session.execute(stmt)
 
 
 async def get_user_questions_with_answers(
@@ -304,3 +755,338 @@ async def get_user_questions_with_answers(
     result = await session.execute(stmt)
     return list(result.scalars().all())
 
+
+async def get_all_questions(session: AsyncSession) -> list[Question]:
+    """Получает весь каталог вопросов в порядке выдачи (freq_score desc, id)."""
+    stmt = select(Question).order_by(Question.freq_score.desc(), Question.id.asc())
+    result = await session.execute(stmt)
+    return list(result.scalars().all())
+
+
+async def get_question(session: AsyncSession, question_id: int) -> Optional[Question]:
+    """Получает вопрос по id."""
+    stmt = select(Question).where(Question.id == question_id)
+    result = await session.execute(stmt)
+    return result.scalar_one_or_none()
+
+
+async def get_catalog_version(session: AsyncSession) -> int:
+    """Получает текущую версию каталога вопросов (0, если импорта еще не было)."""
+    version = await session.scalar(select(CatalogVersion.version).where(CatalogVersion.id == 1))
+    return version or 0
+
+
+async def bump_catalog_version(session: AsyncSession) -> int:
+    """Увеличивает версию каталога вопросов и возвращает новую."""
+    stmt = pg_insert(CatalogVersion).values(id=1, version=1)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[CatalogVersion.id],
+        set_={"version": CatalogVersion.version + 1, "updated_at": func.now()},
+    ).returning(CatalogVersion.version)
+    result = await session.execute(stmt)
+    return result.scalar_one()
+
+
+async def get_cached_hint(session: AsyncSession, question_hash: str, prompt_version: int) -> Optional[str]:
+    """Получает самую свежую подсказку из кэша для вопроса и версии промпта (любой модели)."""
+    stmt = (
+        select(HintCache.hint_text)
+        .where(and_(HintCache.question_hash == question_hash, HintCache.prompt_version == prompt_version))
+        .order_by(HintCache.created_at.desc())
+        .limit(1)
+    )
+    return await session.scalar(stmt)
+
+
+async def save_cached_hint(
+    session: AsyncSession,
+    question_hash: str,
+    prompt_version: int,
+    model: str,
+    hint_text: str,
+) -> None:
+    """Сохраняет подсказку в общий кэш."""
+    stmt = pg_insert(HintCache).values(
+        question_hash=question_hash,
+        prompt_version=prompt_version,
+        model=model,
+        hint_text=hint_text,
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[HintCache.question_hash, HintCache.prompt_version, HintCache.model],
+        set_={"hint_text": stmt.excluded.hint_text, "created_at": func.now()},
+    )
+    await session.execute(stmt)
+
+
+async def get_questions_without_cached_hint(session: AsyncSession, prompt_version: int) -> list[Question]:
+    """Получает вопросы, для которых еще нет подсказки в кэше для данной версии промпта."""
+    cached = exists().where(
+        HintCache.question_hash == Question.question_hash,
+        HintCache.prompt_version == prompt_version,
+    )
+    stmt = select(Question).where(~cached).order_by(Question.freq_score.desc(), Question.id.asc())
+    result = await session.execute(stmt)
+    return list(result.scalars().all())
+
+
+async def get_cached_feedback(
+    session: AsyncSession,
+    question_hash: str,
+    answer_hash: str,
+    prompt_version: int,
+    ttl_seconds: float,
+) -> Optional[str]:
+    """Получает фидбек из кэша, если он не старше ttl_seconds, и отмечает использование записи."""
+    stmt = (
+        update(FeedbackCache)
+        .where(
+            FeedbackCache.question_hash == question_hash,
+            FeedbackCache.answer_hash == answer_hash,
+            FeedbackCache.prompt_version == prompt_version,
+            FeedbackCache.created_at > func.now() - timedelta(seconds=ttl_seconds),
+        )
+        .values(hits=FeedbackCache.hits + 1, last_used_at=func.now())
+        .returning(FeedbackCache.feedback_text)
+        .execution_options(synchronize_session=False)
+    )
+    result = await session.execute(stmt)
+    return result.scalar_one_or_none()
+
+
+async def save_cached_feedback(
+    session: AsyncSession,
+    question_hash: str,
+    answer_hash: str,
+    prompt_version: int,
+    feedback_text: str,
+) -> None:
+    """Сохраняет фидбек в общий кэш."""
+    stmt = pg_insert(FeedbackCache).values(
+        question_hash=question_hash,
+        answer_hash=answer_hash,
+        prompt_version=prompt_version,
+        feedback_text=feedback_text,
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[FeedbackCache.question_hash, FeedbackCache.answer_hash, FeedbackCache.prompt_version],
+        set_={"feedback_text": stmt.excluded.feedback_text, "created_at": func.now(), "last_used_at": func.now()},
+    )
+    await session.execute(stmt)
+
+
+async def touch_cached_feedback(session: AsyncSession, hits: Dict[tuple, int], chunk_size: int = 1000) -> None:
+    """
+    Отмечает использование записей кэша фидбека, найденных в памяти:
+    hits {(question_hash, answer_hash, prompt_version): число попаданий}.
+    """
+    items = list(hits.items())
+    for offset in range(0, len(items), chunk_size):
+        used = values(
+            column("question_hash", FeedbackCache.question_hash.type),
+            column("answer_hash", FeedbackCache.answer_hash.type),
+            column("prompt_version", FeedbackCache.prompt_version.type),
+            column("hits", FeedbackCache.hits.type),
+            name="used",
+        ).data([(*key, count) for key, count in items[offset:offset + chunk_size]])
+        await session.execute(
+            update(FeedbackCache)
+            .where(and_(
+                FeedbackCache.question_hash == used.c.question_hash,
+                FeedbackCache.answer_hash == used.c.answer_hash,
+                FeedbackCache.prompt_version == used.c.prompt_version,
+            ))
+            .values(hits=FeedbackCache.hits + used.c.hits, last_used_at=func.now())
+            .execution_options(synchronize_session=False)
+        )
+
+
+async def evict_feedback_cache(session: AsyncSession, ttl_seconds: float, max_rows: int) -> int:
+    """
+    Удаляет из кэша фидбека записи старше ttl_seconds и самые давно использованные сверх max_rows.
+    
+    Returns:
+        Количество удаленных записей
+    """
+    expired = await session.execute(
+        delete(FeedbackCache)
+        .where(FeedbackCache.created_at <= func.now() - timedelta(seconds=ttl_seconds))
+        .execution_options(synchronize_session=False)
+    )
+    
+    key = tuple_(FeedbackCache.question_hash, FeedbackCache.answer_hash, FeedbackCache.prompt_version)
+    overflow = (
+        select(FeedbackCache.question_hash, FeedbackCache.answer_hash, FeedbackCache.prompt_version)
+        .order_by(FeedbackCache.last_used_at.desc())
+        .offset(max_rows)
+    )
+    evicted = await session.execute(
+        delete(FeedbackCache).where(key.in_(overflow)).execution_options(synchronize_session=False)
+    )
+    return expired.rowcount + evicted.rowcount
+
+
+async def get_user_answer(session: AsyncSession, user_id: int, question_id: int) -> Optional[str]:
+    """Получает текст ответа пользователя на вопрос."""
+    stmt = select(UserQuestion.answer_text).where(
+        UserQuestion.user_id == user_id,
+        UserQuestion.question_id == question_id,
+    )
+    return await session.scalar(stmt)
+
+
+async def enqueue_ai_job(
+    session: AsyncSession,
+    kind: str,
+    user_id: int,
+    tg_user_id: int,
+    question_id: int,
+    priority: int = 0,
+) -> int:
+    """Ставит задачу ИИ в очередь, возвращает ее id. Задача станет видна воркерам после коммита."""
+    stmt = (
+        pg_insert(AIJob)
+        .values(
+            kind=kind,
+            user_id=user_id,
+            tg_user_id=tg_user_id,
+            question_id=question_id,
+            priority=priority,
+            status="queued",
+            attempts=0,
+        )
+        .returning(AIJob.id)
+    )
+    return (await session.execute(stmt)).scalar_one()
+
+
+async def claim_ai_jobs(session: AsyncSession, limit: int = 1) -> list:
+    """
+    Забирает до limit готовых к запуску задач и помечает их running.
+    
+    FOR UPDATE SKIP LOCKED позволяет нескольким воркерам (и процессам) разбирать
+    очередь параллельно, не блокируя друг друга и не получая одну задачу дважды.
+    """
+    ready = (
+        select(AIJob.id)
+        .where(and_(AIJob.status == literal("queued", literal_execute=True), AIJob.run_at <= func.now()))
+        .order_by(AIJob.priority.desc(), AIJob.run_at.asc())
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    stmt = (
+        update(AIJob)
+        .where(AIJob.id.in_(ready))
+        .values(status="running", attempts=AIJob.attempts + 1, started_at=func.now())
+        .returning(
+            AIJob.id,
+            AIJob.kind,
+            AIJob.user_id,
+            AIJob.tg_user_id,
+            AIJob.question_id,
+            AIJob.priority,
+            AIJob.attempts,
+            AIJob.created_at,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    return list((await session.execute(stmt)).all())
+
+
+async def complete_ai_job(session: AsyncSession, job_id: int) -> None:
+    """Отмечает задачу выполненной."""
+    stmt = (
+        update(AIJob)
+        .where(AIJob.id == job_id)
+        .values(status="done", finished_at=func.now(), last_error=None)
+        .execution_options(synchronize_session=False)
+    )
+    await session.execute(stmt)
+
+
+async def retry_ai_job(session: AsyncSession, job_id: int, delay_seconds: float, error: str) -> None:
+    """Возвращает задачу в очередь с отложенным запуском."""
+    stmt = (
+        update(AIJob)
+        .where(AIJob.id == job_id)
+        .values(status="queued", run_at=func.now() + timedelta(seconds=delay_seconds), last_error=error)
+        .execution_options(synchronize_session=False)
+    )
+    await session.execute(stmt)
+
+
+async def fail_ai_job(session: AsyncSession, job_id: int, error: str) -> None:
+    """Отмечает задачу окончательно проваленной."""
+    stmt = (
+        update(AIJob)
+        .where(AIJob.id == job_id)
+        .values(status="failed", finished_at=func.now(), last_error=error)
+        .execution_options(synchronize_session=False)
+    )
+    await session.execute(stmt)
+
+
+async def renew_ai_job_lease(session: AsyncSession, job_id: int) -> None:
+    """Продлевает аренду выполняемой задачи: started_at отсчитывается заново."""
+    stmt = (
+        update(AIJob)
+        .where(and_(AIJob.id == job_id, AIJob.status == literal("running", literal_execute=True)))
+        .values(started_at=func.now())
+        .execution_options(synchronize_session=False)
+    )
+    await session.execute(stmt)
+
+
+async def requeue_stale_ai_jobs(session: AsyncSession, timeout_seconds: float) -> int:
+    """
+    Возвращает в очередь задачи, аренду которых слишком долго не продлевали
+    (воркер упал или процесс перезапущен).
+    """
+    stmt = (
+        update(AIJob)
+        .where(and_(
+            AIJob.status == literal("running", literal_execute=True),
+            AIJob.started_at < func.now() - timedelta(seconds=timeout_seconds),
+        ))
+        .values(status="queued", run_at=func.now(), last_error="stale: worker did not finish the job")
+        .execution_options(synchronize_session=False)
+    )
+    result = await session.execute(stmt)
+    return result.rowcount
+
+
+async def delete_finished_ai_jobs(session: AsyncSession, older_than_seconds: float) -> int:
+    """Удаляет выполненные и проваленные задачи старше заданного возраста."""
+    stmt = (
+        delete(AIJob)
+        .where(and_(
+            AIJob.status.in_(["done", "failed"]),
+            AIJob.finished_at < func.now() - timedelta(seconds=older_than_seconds),
+        ))
+        .execution_options(synchronize_session=False)
+    )
+    result = await session.execute(stmt)
+    return result.rowcount
+
+
+async def get_ai_job_stats(session: AsyncSession) -> Dict[str, Dict[str, float]]:
+    """
+    Статистика очереди по статусам: количество задач и возраст самой старой в секундах.
+    
+    Returns:
+        {status: {"count": N, "oldest_age": seconds}}
+    """
+    stmt = (
+        select(
+            AIJob.status,
+            func.count(AIJob.id),
+            func.extract("epoch", func.now() - func.min(AIJob.created_at)),
+        )
+        .group_by(AIJob.status)
+    )
+    result = await session.execute(stmt)
+    return {
+        status: {"count": count, "oldest_age": float(oldest_age or 0)}
+        for status, count, oldest_age in result.all()
+    }
@@ -25,8 +25,16 @@ def create_sessionmaker(engine):
     )
 
 
+def _create_missing_indexes(sync_conn):
+    """Создает индексы, добавленные в модели после создания таблиц (create_all их не трогает)."""
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(sync_conn, checkfirst=True)
+
+
 async def init_db(engine):
-    """Инициализирует БД (создает таблицы)."""
+    """Инициализирует БД (создает таблицы и недостающие индексы)."""
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_create_missing_indexes)
 
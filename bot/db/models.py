@@ -1,6 +1,6 @@
 from datetime import datetime
 from typing import List
-from sqlalchemy import BigInteger, Boolean, SmallInteger, String, Text, ForeignKey, UniqueConstraint, DateTime
+from sqlalchemy import BigInteger, Boolean, Integer, SmallInteger, String, Text, ForeignKey, UniqueConstraint, DateTime, Index, text
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 from sqlalchemy.sql import func
@@ -21,6 +21,48 @@ class Question(Base):
     user_questions: Mapped[list["UserQuestion"]] = relationship(back_populates="question")
 
 
+# Порядок выдачи вопросов: freq_score по убыванию, затем id
+Index("ix_questions_freq_score_id", Question.freq_score.desc(), Question.id)
+
+
+class CatalogVersion(Base):
+    """Версия каталога вопросов: увеличивается при каждом импорте, по ней сбрасывается кэш."""
+    __tablename__ = "catalog_version"
+    
+    id: Mapped[int] = mapped_column(SmallInteger, primary_key=True, default=1)
+    version: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+
+class HintCache(Base):
+    """Подсказки ИИ, общие для всех пользователей: зависят только от текста вопроса и промпта."""
+    __tablename__ = "hint_cache"
+    
+    question_hash: Mapped[str] = mapped_column(String(64), primary_key=True)
+    prompt_version: Mapped[int] = mapped_column(SmallInteger, primary_key=True)
+    model: Mapped[str] = mapped_column(String(100), primary_key=True)  # Чем сгенерирована; читается подсказка любой модели
+    hint_text: Mapped[str] = mapped_column(Text, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+
+class FeedbackCache(Base):
+    """Фидбек ИИ на одинаковые ответы: зависит только от вопроса, нормализованного ответа и промпта."""
+    __tablename__ = "feedback_cache"
+    
+    question_hash: Mapped[str] = mapped_column(String(64), primary_key=True)
+    answer_hash: Mapped[str] = mapped_column(String(64), primary_key=True)
+    prompt_version: Mapped[int] = mapped_column(SmallInteger, primary_key=True)
+    feedback_text: Mapped[str] = mapped_column(Text, nullable=False)
+    hits: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    last_used_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    
+    __table_args__ = (
+        # Вытеснение давно не использованных записей при превышении размера
+        Index("ix_feedback_cache_last_used", "last_used_at"),
+    )
+
+
 class User(Base):
     __tablename__ = "users"
 
@@ -51,6 +93,19 @@ class UserQuestion(Base):
 
     __table_args__ = (
         UniqueConstraint("user_id", "question_id", name="uq_user_question"),
+        # Для anti-join "еще не отвечен" при выборе вопросов
+        Index(
+            "ix_user_questions_answered",
+            "user_id",
+            "question_id",
+            postgresql_where=text("status = 'answered'"),
+        ),
+        # Для ночной пакетной оценки ответов без фидбека
+        Index(
+            "ix_user_questions_ungraded",
+            "id",
+            postgresql_where=text("status = 'answered' AND feedback_text IS NULL"),
+        ),
     )
 
 
@@ -63,3 +118,33 @@ class UserState(Base):
 
     user: Mapped["User"] = relationship(back_populates="user_state")
 
+
+class AIJob(Base):
+    """Фоновая задача ИИ (подсказка или фидбек), которую выполняют воркеры через SKIP LOCKED."""
+    __tablename__ = "ai_jobs"
+    
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    kind: Mapped[str] = mapped_column(String(20), nullable=False)  # 'hint' | 'feedback'
+    user_id: Mapped[int] = mapped_column(BigInteger, ForeignKey("users.id"), nullable=False)
+    tg_user_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    question_id: Mapped[int] = mapped_column(BigInteger, ForeignKey("questions.id"), nullable=False)
+    priority: Mapped[int] = mapped_column(SmallInteger, nullable=False, default=0)  # больше - раньше
+    status: Mapped[str] = mapped_column(String(20), nullable=False, default="queued")  # 'queued' | 'running' | 'done' | 'failed'
+    attempts: Mapped[int] = mapped_column(SmallInteger, nullable=False, default=0)
+    run_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    started_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)  # начало или продление аренды
+    finished_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
+    last_error: Mapped[str | None] = mapped_column(Text, nullable=True)
+    
+    __table_args__ = (
+        # Выборка следующей задачи: только ожидающие, по приоритету и времени запуска
+        Index(
+            "ix_ai_jobs_queued",
+            text("priority DESC"),
+            "run_at",
+            postgresql_where=text("status = 'queued'"),
+        ),
+        # Поиск зависших задач и очистка завершенных
+        Index("ix_ai_jobs_status_started", "status", "started_at"),
+    )
@@ -1,122 +1,50 @@
+from functools import partial
+from typing import Optional
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from aiogram import Bot
 from bot.db.dao import (
-    get_or_create_user,
     set_awaiting,
-    get_awaiting,
-    save_answer,
-    get_pending_questions,
-    set_pending_questions,
+    save_answer_and_dequeue,
     save_feedback,
     save_hint,
 )
-from bot.db.models import Question, UserQuestion
+from bot.db.models import UserQuestion
+from bot.config import Config
+from bot.services.ai_jobs import enqueue_hint, enqueue_feedback
+from bot.services.catalog import question_catalog
+from bot.services.answered import answered_bitsets
 from bot.services.delivery import send_next_question
-from bot.services.hint import generate_hint, generate_feedback
+from bot.services.feedback_cache import feedback_cache
+from bot.services.hint import request_feedback, stream_feedback
+from bot.services.hint_cache import get_or_generate_hint, get_or_stream_hint
+from bot.services.speculation import feedback_speculator
+from bot.services.streaming import StreamingMessage
+from bot.services.user_context import user_contexts
+from bot.utils.ai_interface import AIInterface
+from bot.utils.markdown import format_hint_message, format_feedback_message
 from bot.keyboards.inline import get_feedback_keyboard, get_edit_answer_keyboard
 from bot.logging import logger
 
 router = Router()
 
 
-def escape_markdown_v2(text: str) -> str:
-    """
-    Экранирует специальные символы MarkdownV2 для безопасной вставки в сообщения Telegram.
-    
-    Args:
-        text: Текст для экранирования
-        
-    Returns:
-        Экранированный текст
-    """
-    # ВАЖНО: Сначала экранируем обратный слэш, чтобы не экранировать уже экранированные символы
-    text = text.replace('\\', '\\\\')
-    
-    # Затем экранируем остальные специальные символы MarkdownV2
-    # Список всех зарезервированных символов в MarkdownV2
-    special_chars = ['_', '*', '[', ']', '(', ')', '~', '`', '>', '#', '+', '-', '=', '{', '}', '.', '!', '|']
-    for char in special_chars:
-        text = text.replace(char, f'\\{char}')
-    
-    return text
-
-
-def format_hint_with_spoiler(hint_text: str) -> str:
-    """
-    Форматирует подсказку с правильным spoiler для MarkdownV2.
-    Ищет эталонный ответ между || || или ||текст|| и правильно форматирует его.
-    
-    Args:
-        hint_text: Текст подсказки от ИИ
-        
-    Returns:
-        Отформатированный текст с правильным spoiler
-    """
-    import re
-    
-    # Ищем паттерн || текст || или ||текст|| (с возможными пробелами)
-    # Используем нежадный поиск, чтобы найти первый spoiler
-    pattern = r'\|\|\s*(.*?)\s*\|\|'
-    
-    def escape_spoiler_content(text: str) -> str:
-        """Экранирует все специальные символы MarkdownV2 внутри spoiler"""
-        # Внутри spoiler нужно экранировать ВСЕ специальные символы MarkdownV2, включая точку
-        # ВАЖНО: Сначала экранируем обратный слэш
-        text = text.replace('\\', '\\\\')
-        # Затем экранируем все остальные специальные символы MarkdownV2
-        # Включая точку, которая является зарезервированным символом
-        special_chars = ['_', '*', '[', ']', '(', ')', '~', '`', '>', '#', '+', '-', '=', '{', '}', '.', '!', '|']
-        for char in special_chars:
-            text = text.replace(char, f'\\{char}')
-        return text
-    
-    # Находим все spoiler блоки
-    parts = []
-    last_end = 0
-    
-    for match in re.finditer(pattern, hint_text, flags=re.DOTALL):
-        # Добавляем текст до spoiler (подсказка)
-        if match.start() > last_end:
-            hint_part = hint_text[last_end:match.start()].strip()
-            if hint_part:
-                # Экранируем подсказку для MarkdownV2
-                escaped_hint = escape_markdown_v2(hint_part)
-                parts.append(escaped_hint)
-        
-        # Обрабатываем spoiler (эталонный ответ)
-        spoiler_text = match.group(1)
-        escaped_spoiler = escape_spoiler_content(spoiler_text)
-        parts.append(f'||{escaped_spoiler}||')
-        
-        last_end = match.end()
-    
-    # Добавляем оставшийся текст после последнего spoiler
-    if last_end < len(hint_text):
-        remaining = hint_text[last_end:].strip()
-        if remaining:
-            escaped_remaining = escape_markdown_v2(remaining)
-            parts.append(escaped_remaining)
-    
-    # Если spoiler не найден, просто экранируем весь текст
-    if not parts:
-        return escape_markdown_v2(hint_text)
-    
-    return '\n\n'.join(parts)
-
-
 @router.callback_query(F.data.startswith("hint:"))
-async def callback_hint(callback: CallbackQuery, session: AsyncSession, bot: Bot):
+async def callback_hint(
+    callback: CallbackQuery,
+    session: AsyncSession,
+    bot: Bot,
+    ai: Optional[AIInterface],
+    config: Config,
+):
     """Обработчик нажатия на кнопку 'Подсказка' - генерирует подсказку через ИИ."""
     question_id = int(callback.data.split(":")[1])
     tg_user_id = callback.from_user.id
     
-    # Получаем вопрос из БД
-    stmt = select(Question).where(Question.id == question_id)
-    result = await session.execute(stmt)
-    question = result.scalar_one_or_none()
+    # Получаем вопрос из каталога в памяти
+    question = await question_catalog.get_question(session, question_id)
     
     if question is None:
         await callback.answer("Вопрос не найден", show_alert=True)
@@ -124,23 +52,41 @@ async def callback_hint(callback: CallbackQuery, session: AsyncSession, bot: Bot
     
     await callback.answer("Генерирую подсказку...")
     
-    # Генерируем подсказку
+    # Через очередь: подсказку сгенерирует и пришлет фоновый воркер
+    if config.ai_jobs_enabled and ai is not None:
+        user_id = await user_contexts.get_user_id(session, tg_user_id)
+        await enqueue_hint(session, user_id, tg_user_id, question_id)
+        return
+    
+    # Потоковый режим: подсказка появляется в сообщении по мере генерации
+    streamer = None
+    if config.ai_streaming and ai is not None:
+        streamer = StreamingMessage(
+            bot,
+            callback.message.chat.id,
+            partial(format_hint_message, partial=True),
+            config.ai_stream_edit_interval,
+        )
+    
+    # Берем подсказку из общего кэша или генерируем
     try:
-        user = await get_or_create_user(session, tg_user_id)
-        hint = await generate_hint(question.question, question.freq_score)
+        user_id = await user_contexts.get_user_id(session, tg_user_id)
+        if streamer is not None:
+            hint = await get_or_stream_hint(session, ai, question, streamer, tg_user_id)
+        else:
+            hint = await get_or_generate_hint(session, ai, question, tg_user_id)
         
         # Сохраняем подсказку в БД
-        await save_hint(session, user.id, question_id, hint)
+        await save_hint(session, user_id, question_id, hint)
         
         # Форматируем подсказку с правильным spoiler для MarkdownV2
-        formatted_hint = format_hint_with_spoiler(hint)
-        # Экранируем заголовок отдельно
-        header = escape_markdown_v2("Подсказка:")
-        message_text = f"*{header}*\n\n{formatted_hint}"
-        await callback.message.answer(
-            message_text,
-            parse_mode="MarkdownV2"
-        )
+        if streamer is not None:
+            await streamer.finish(format_hint_message(hint))
+        else:
+            await callback.message.answer(
+                format_hint_message(hint),
+                parse_mode="MarkdownV2"
+            )
     except ValueError as e:
         # Нет API ключей
         logger.warning(f"AI API key not configured: {e}")
@@ -150,6 +96,8 @@ async def callback_hint(callback: CallbackQuery, session: AsyncSession, bot: Bot
         )
     except Exception as e:
         logger.error(f"Error generating hint for question {question_id}: {e}")
+        if streamer is not None:
+            await streamer.abort()
         await callback.message.answer("Не удалось сгенерировать подсказку. Попробуй позже.")
 
 
@@ -159,6 +107,9 @@ async def callback_feedback_no(callback: CallbackQuery, session: AsyncSession, b
     question_id = int(callback.data.split(":")[1])
     tg_user_id = callback.from_user.id
     
+    # Спекулятивный фидбек больше не нужен
+    feedback_speculator.cancel(tg_user_id, question_id)
+    
     await callback.answer()
     
     # Отправляем следующий вопрос
@@ -169,17 +120,21 @@ async def callback_feedback_no(callback: CallbackQuery, session: AsyncSession, b
 
 
 @router.callback_query(F.data.startswith("feedback:"))
-async def callback_feedback(callback: CallbackQuery, session: AsyncSession, bot: Bot):
+async def callback_feedback(
+    callback: CallbackQuery,
+    session: AsyncSession,
+    bot: Bot,
+    ai: Optional[AIInterface],
+    config: Config,
+):
     """Обработчик нажатия на кнопку 'Получить фидбек' - генерирует фидбек через ИИ."""
     question_id = int(callback.data.split(":")[1])
     tg_user_id = callback.from_user.id
     
-    user = await get_or_create_user(session, tg_user_id)
+    user_id = await user_contexts.get_user_id(session, tg_user_id)
     
-    # Получаем вопрос и ответ из БД
-    question_stmt = select(Question).where(Question.id == question_id)
-    question_result = await session.execute(question_stmt)
-    question = question_result.scalar_one_or_none()
+    # Получаем вопрос из каталога в памяти
+    question = await question_catalog.get_question(session, question_id)
     
     if question is None:
         await callback.answer("Вопрос не найден", show_alert=True)
@@ -187,7 +142,7 @@ async def callback_feedback(callback: CallbackQuery, session: AsyncSession, bot:
     
     # Получаем ответ пользователя
     answer_stmt = select(UserQuestion).where(
-        UserQuestion.user_id == user.id,
+        UserQuestion.user_id == user_id,
         UserQuestion.question_id == question_id
     )
     answer_result = await session.execute(answer_stmt)
@@ -198,29 +153,80 @@ async def callback_feedback(callback: CallbackQuery, session: AsyncSession, bot:
         return
     
     await callback.answer("Генерирую фидбек...")
+    answer_text = user_question.answer_text
+    
+    # Такой же ответ на этот вопрос уже оценивался: отдаем фидбек из кэша без вызова ИИ
+    feedback = await feedback_cache.get(session, question.question_hash, answer_text)
+    
+    # Фидбек, запущенный заранее сразу после сохранения ответа (готовый или еще в работе)
+    speculative = None
+    if feedback is not None:
+        feedback_speculator.cancel(tg_user_id, question_id)
+    elif config.speculative_feedback:
+        speculative = feedback_speculator.take(tg_user_id, question_id, answer_text)
+    
+    # Через очередь: фидбек придет отдельным сообщением, следующий вопрос отправляем сразу
+    if feedback is None and speculative is None and config.ai_jobs_enabled and ai is not None:
+        await enqueue_feedback(session, user_id, tg_user_id, question_id)
+        has_next = await send_next_question(session, bot, tg_user_id)
+        
+        if not has_next:
+            await callback.message.answer("Все вопросы завершены!")
+        return
+    
+    # Завершаем читающую транзакцию: пока ждем ИИ, соединение возвращается в пул,
+    # запись фидбека пойдет уже в новой короткой транзакции
+    await session.commit()
+    
+    # Потоковый режим: фидбек появляется в сообщении по мере генерации
+    streamer = None
+    if feedback is None and config.ai_streaming and ai is not None:
+        streamer = StreamingMessage(
+            bot,
+            callback.message.chat.id,
+            format_feedback_message,
+            config.ai_stream_edit_interval,
+        )
     
     # Генерируем фидбек
     try:
-        feedback = await generate_feedback(
-            question.question,
-            user_question.answer_text,
-            question.freq_score
-        )
+        generated = feedback is None
+        if feedback is None and speculative is not None:
+            feedback = await feedback_speculator.result(speculative)
+        if feedback is None and streamer is not None:
+            await streamer.start()
+            feedback = await stream_feedback(
+                ai,
+                question.question,
+                answer_text,
+                question.freq_score,
+                streamer.update,
+                tg_user_id,
+            )
+        if feedback is None:
+            feedback = await request_feedback(
+                ai,
+                question.question,
+                answer_text,
+                question.freq_score,
+                tg_user_id,
+            )
         
-        # Сохраняем фидбек в БД
-        await save_feedback(session, user.id, question_id, feedback)
+        # Сохраняем фидбек в БД и в общий кэш для таких же ответов
+        if generated:
+            await feedback_cache.put(session, question.question_hash, answer_text, feedback)
+        await save_feedback(session, user_id, question_id, feedback)
         
         keyboard = get_edit_answer_keyboard(question_id)
         # Экранируем специальные символы MarkdownV2 в AI-генерированном тексте
-        escaped_feedback = escape_markdown_v2(feedback)
-        # Экранируем заголовок отдельно
-        header = escape_markdown_v2("Фидбек на твой ответ:")
-        message_text = f"*{header}*\n\n{escaped_feedback}"
-        await callback.message.answer(
-            message_text,
-            parse_mode="MarkdownV2",
-            reply_markup=keyboard
-        )
+        if streamer is not None:
+            await streamer.finish(format_feedback_message(feedback), reply_markup=keyboard)
+        else:
+            await callback.message.answer(
+                format_feedback_message(feedback),
+                parse_mode="MarkdownV2",
+                reply_markup=keyboard
+            )
         
         # Отправляем следующий вопрос после фидбека
         has_next = await send_next_question(session, bot, tg_user_id)
@@ -242,6 +248,8 @@ async def callback_feedback(callback: CallbackQuery, session: AsyncSession, bot:
             await callback.message.answer("Все вопросы завершены!")
     except Exception as e:
         logger.error(f"Error generating feedback for question {question_id}: {e}")
+        if streamer is not None:
+            await streamer.abort()
         await callback.message.answer("Не удалось сгенерировать фидбек. Попробуй позже.")
         
         # Отправляем следующий вопрос даже если произошла ошибка
@@ -257,10 +265,13 @@ async def callback_edit_answer(callback: CallbackQuery, session: AsyncSession, b
     question_id = int(callback.data.split(":")[1])
     tg_user_id = callback.from_user.id
     
-    user = await get_or_create_user(session, tg_user_id)
+    # Фидбек на старый ответ больше не нужен
+    feedback_speculator.cancel(tg_user_id, question_id)
+    
+    user_id = await user_contexts.get_user_id(session, tg_user_id)
     
     # Устанавливаем ожидание нового ответа
-    await set_awaiting(session, user.id, question_id)
+    await set_awaiting(session, user_id, question_id)
     
     await callback.answer()
     await callback.message.answer("Ок, напиши исправленный ответ текстом одним сообщением")
@@ -282,10 +293,10 @@ async def callback_menu(callback: CallbackQuery, session: AsyncSession, bot: Bot
     question_id = int(callback.data.split(":")[1])
     tg_user_id = callback.from_user.id
     
-    user = await get_or_create_user(session, tg_user_id)
+    user_id = await user_contexts.get_user_id(session, tg_user_id)
     
     # Сбрасываем ожидание ответа
-    await set_awaiting(session, user.id, None)
+    await set_awaiting(session, user_id, None)
     
     await callback.answer("Ответ отменен")
     await callback.message.answer(
@@ -298,12 +309,20 @@ async def callback_menu(callback: CallbackQuery, session: AsyncSession, bot: Bot
 
 
 @router.message(F.text & ~F.text.startswith("/"))
-async def handle_text_answer(message: Message, session: AsyncSession, bot: Bot):
+async def handle_text_answer(
+    message: Message,
+    session: AsyncSession,
+    bot: Bot,
+    ai: Optional[AIInterface],
+    config: Config,
+):
     """Обработчик текстового ответа пользователя."""
     tg_user_id = message.from_user.id
     
-    user = await get_or_create_user(session, tg_user_id)
-    awaiting_question_id = await get_awaiting(session, user.id)
+    # Контекст из памяти: на типичный ответ остается один запрос к БД
+    context = await user_contexts.get(session, tg_user_id)
+    user_id = context.user_id
+    awaiting_question_id = context.awaiting_question_id
     
     if awaiting_question_id is None:
         # Пользователь не ожидает ответа, игнорируем
@@ -316,16 +335,36 @@ async def handle_text_answer(message: Message, session: AsyncSession, bot: Bot):
         return
     
     try:
-        await save_answer(session, user.id, awaiting_question_id, answer_text)
-        
-        # Убираем текущий вопрос из очереди
-        pending = await get_pending_questions(session, user.id)
-        if awaiting_question_id in pending:
-            pending.remove(awaiting_question_id)
-            await set_pending_questions(session, user.id, pending)
+        # Ответ, снятие ожидания и удаление вопроса из очереди - одним запросом
+        saved = await save_answer_and_dequeue(session, user_id, awaiting_question_id, answer_text)
+        if not saved:
+            # Контекст в памяти устарел: перечитываем его из БД
+            user_contexts.invalidate(user_id)
+            awaiting_question_id = (await user_contexts.get(session, tg_user_id)).awaiting_question_id
+            if awaiting_question_id is None:
+                return
+            saved = await save_answer_and_dequeue(session, user_id, awaiting_question_id, answer_text)
+            if not saved:
+                return
+        await session.commit()
+        answered_bitsets.mark_answered(user_id, awaiting_question_id)
         
         logger.info(f"User {tg_user_id} answered question {awaiting_question_id}")
         
+        # Начинаем генерировать фидбек до того, как пользователь нажмет "Да"
+        if config.speculative_feedback and ai is not None:
+            question = await question_catalog.get_question(session, awaiting_question_id)
+            # Если фидбек на такой ответ уже есть в кэше, генерировать заранее нечего
+            if question is not None and feedback_cache.get_from_memory(question.question_hash, answer_text) is None:
+                feedback_speculator.start(
+                    ai,
+                    tg_user_id,
+                    awaiting_question_id,
+                    question.question,
+                    answer_text,
+                    question.freq_score,
+                )
+        
         # Предлагаем получить фидбек одним сообщением
         keyboard = get_feedback_keyboard(awaiting_question_id)
         await message.answer(
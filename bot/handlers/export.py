@@ -3,8 +3,9 @@ from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery, BufferedInputFile
 from aiogram.filters import Command
 from sqlalchemy.ext.asyncio import AsyncSession
-from bot.db.dao import get_or_create_user, get_user_questions_with_answers
+from bot.db.dao import get_user_questions_with_answers
 from bot.services.export import export_to_markdown, export_to_csv
+from bot.services.user_context import user_contexts
 from bot.logging import logger
 
 router = Router()
@@ -16,8 +17,8 @@ async def cmd_export_markdown(message: Message, session: AsyncSession):
     tg_user_id = message.from_user.id
     
     try:
-        user = await get_or_create_user(session, tg_user_id)
-        user_questions = await get_user_questions_with_answers(session, user.id)
+        user_id = await user_contexts.get_user_id(session, tg_user_id)
+        user_questions = await get_user_questions_with_answers(session, user_id)
         
         if not user_questions:
             await message.answer("У тебя пока нет отвеченных вопросов для экспорта.")
@@ -54,8 +55,8 @@ async def cmd_export_csv(message: Message, session: AsyncSession):
     tg_user_id = message.from_user.id
     
     try:
-        user = await get_or_create_user(session, tg_user_id)
-        user_questions = await get_user_questions_with_answers(session, user.id)
+        user_id = await user_contexts.get_user_id(session, tg_user_id)
+        user_questions = await get_user_questions_with_answers(session, user_id)
         
         if not user_questions:
             await message.answer("У тебя пока нет отвеченных вопросов для экспорта.")
@@ -92,8 +93,8 @@ async def callback_export(callback: CallbackQuery, session: AsyncSession):
     await callback.answer("Генерирую файл...")
     
     try:
-        user = await get_or_create_user(session, tg_user_id)
-        user_questions = await get_user_questions_with_answers(session, user.id)
+        user_id = await user_contexts.get_user_id(session, tg_user_id)
+        user_questions = await get_user_questions_with_answers(session, user_id)
         
         if not user_questions:
             await callback.message.answer("У тебя пока нет отвеченных вопросов для экспорта.")
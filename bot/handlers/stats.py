@@ -2,7 +2,8 @@ from aiogram import Router, F
 from aiogram.types import Message
 from aiogram.filters import Command
 from sqlalchemy.ext.asyncio import AsyncSession
-from bot.db.dao import get_or_create_user, get_stats
+from bot.db.dao import get_stats
+from bot.services.user_context import user_contexts
 from bot.keyboards.inline import get_export_keyboard
 from bot.logging import logger
 
@@ -14,8 +15,8 @@ async def cmd_stats(message: Message, session: AsyncSession):
     """Обработчик команды /stats - показывает статистику."""
     tg_user_id = message.from_user.id
     
-    user = await get_or_create_user(session, tg_user_id)
-    stats = await get_stats(session, user.id)
+    user_id = await user_contexts.get_user_id(session, tg_user_id)
+    stats = await get_stats(session, user_id)
     
     text = (
         f"Статистика:\n\n"
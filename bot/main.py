@@ -6,7 +6,15 @@ from bot.config import Config
 from bot.db.engine import create_engine, create_sessionmaker, init_db
 from bot.handlers import start, today, stats, answer, reset, export
 from bot.scheduler import setup_scheduler
-from bot.middleware import DatabaseMiddleware, WhitelistMiddleware
+from bot.services.catalog import question_catalog
+from bot.services.answered import answered_bitsets
+from bot.services.ai_jobs import AIJobWorkers
+from bot.services.speculation import feedback_speculator
+from bot.services.feedback_cache import feedback_cache
+from bot.services.user_context import user_contexts
+from bot.middleware import DatabaseMiddleware, DeadlineMiddleware, DuplicateCallbackMiddleware, WhitelistMiddleware
+from bot.utils.ai_interface import AIInterface
+from bot.utils.rate_limit import TelegramRateLimiter, RateLimitMiddleware
 from bot.logging import logger
 from sqlalchemy.exc import OperationalError
 from sqlalchemy import text
@@ -88,8 +96,21 @@ async def main():
     
     sessionmaker = create_sessionmaker(engine)
     
+    # Загружаем каталог вопросов в память
+    async with sessionmaker() as session:
+        await question_catalog.refresh(session)
+    answered_bitsets.max_users = config.answered_cache_size
+    user_contexts.configure(config)
+    logger.info(f"Question selection engine: {config.selection_engine}")
+    feedback_speculator.configure(config)
+    feedback_cache.configure(config)
+    
     # Инициализируем бота и диспетчер
     bot = Bot(token=config.bot_token)
+    # Рассылка (rate_limited()) ждет слотов лимитера, чтобы не получать 429 от Telegram;
+    # ответы пользователям уходят сразу и только учитываются в лимитере
+    rate_limiter = TelegramRateLimiter(config.telegram_global_rate, config.telegram_chat_interval)
+    bot.session.middleware(RateLimitMiddleware(rate_limiter))
     dp = Dispatcher(storage=MemoryStorage())
     
     # Добавляем whitelist middleware (должен быть первым)
@@ -101,8 +122,34 @@ async def main():
     else:
         logger.info("Whitelist disabled (empty or not set)")
     
-    # Добавляем middleware для сессий БД, bot и config
-    db_middleware = DatabaseMiddleware(sessionmaker, bot, config)
+    # Общий AI клиент на весь процесс (None, если ключ не настроен)
+    try:
+        ai = AIInterface(
+            retry_attempts=2,
+            retry_delay=1.0,
+            use_async=config.ai_async,
+            executor_workers=config.ai_executor_workers,
+            hedge_percentile=config.ai_hedge_percentile,
+            hedge_max_ratio=config.ai_hedge_max_ratio,
+            request_timeout=config.ai_request_timeout,
+        )
+        logger.info(f"AI client initialized with models: {', '.join(ai.models)}")
+    except ValueError as e:
+        ai = None
+        logger.warning(f"AI features disabled: {e}")
+    
+    # Бюджет времени на апдейт: по нему прерываются вызовы ИИ и зависшие handlers
+    # (до DatabaseMiddleware, чтобы сессия БД закрывалась при отмене)
+    if config.update_deadline_seconds:
+        deadline_middleware = DeadlineMiddleware(config.update_deadline_seconds)
+        dp.message.middleware(deadline_middleware)
+        dp.callback_query.middleware(deadline_middleware)
+    
+    # Повторные нажатия "Подсказка"/"Да" не запускают вторую генерацию
+    dp.callback_query.middleware(DuplicateCallbackMiddleware())
+    
+    # Добавляем middleware для сессий БД, bot, config и AI клиента
+    db_middleware = DatabaseMiddleware(sessionmaker, bot, config, ai)
     dp.message.middleware(db_middleware)
     dp.callback_query.middleware(db_middleware)
     
@@ -115,16 +162,26 @@ async def main():
     dp.include_router(export.router)
     
     # Настраиваем scheduler
-    scheduler = setup_scheduler(sessionmaker, bot, config)
+    scheduler = setup_scheduler(sessionmaker, bot, config, ai)
     scheduler.start()
     logger.info(f"Scheduler started, daily job at {config.daily_hour}:{config.daily_minute:02d} {config.tz}")
     
+    # Воркеры фоновой очереди задач ИИ
+    ai_workers = None
+    if config.ai_jobs_enabled and ai is not None:
+        ai_workers = AIJobWorkers(sessionmaker, bot, ai, config)
+        ai_workers.start()
+    
     try:
         # Запускаем polling
         logger.info("Starting bot...")
         await dp.start_polling(bot)
     finally:
         scheduler.shutdown()
+        if ai_workers is not None:
+            await ai_workers.stop()
+        if ai is not None:
+            await ai.aclose()
         await bot.session.close()
         await engine.dispose()
 
@@ -1,8 +1,12 @@
-from typing import Callable, Dict, Any, Awaitable
+import asyncio
+from typing import Callable, Dict, Any, Awaitable, Optional
 from aiogram import BaseMiddleware, Bot
 from aiogram.types import TelegramObject, Message, CallbackQuery
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 from bot.config import Config
+from bot.utils.ai_interface import AIInterface
+from bot.utils.deadline import GRACE_SECONDS, deadline_after
+from bot.utils.metrics import metrics
 from bot.logging import logger
 
 
@@ -58,18 +62,107 @@ class WhitelistMiddleware(BaseMiddleware):
         return await handler(event, data)
 
 
+class DuplicateCallbackMiddleware(BaseMiddleware):
+    """
+    Middleware, отбрасывающее повторные нажатия той же кнопки, пока первое еще обрабатывается.
+    
+    Ключ - (пользователь, callback data), поэтому двойное нажатие "Подсказка" или "Да"
+    не запускает вторую генерацию. Повтор подтверждается пустым ответом на callback.
+    """
+    
+    def __init__(self, prefixes: tuple[str, ...] = ("hint:", "feedback:")):
+        self.prefixes = prefixes
+        self._in_progress: set[tuple[int, str]] = set()
+    
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if not isinstance(event, CallbackQuery) or not event.data or not event.data.startswith(self.prefixes):
+            return await handler(event, data)
+        
+        key = (event.from_user.id, event.data)
+        if key in self._in_progress:
+            metrics.incr("callback_duplicates_dropped")
+            await event.answer("Уже обрабатываю, подожди немного")
+            return
+        
+        self._in_progress.add(key)
+        try:
+            return await handler(event, data)
+        finally:
+            self._in_progress.discard(key)
+
+
+class DeadlineMiddleware(BaseMiddleware):
+    """
+    Middleware, ограничивающее время обработки апдейта.
+    
+    Задает дедлайн (bot/utils/deadline.py), по которому прерываются вызовы ИИ: handler
+    получает DeadlineExceeded и сам отвечает "попробуй позже". Если handler не уложился
+    и в GRACE_SECONDS после дедлайна (завис Telegram или БД), обработка отменяется:
+    сессия БД откатывается и закрывается внутренними middleware, а пользователю уходит
+    короткий ответ. Должно стоять перед DatabaseMiddleware.
+    """
+    
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+    
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        with deadline_after(self.seconds) as update_deadline:
+            timeout = asyncio.timeout_at(update_deadline + GRACE_SECONDS)
+            try:
+                async with timeout:
+                    return await handler(event, data)
+            except TimeoutError:
+                # Таймауты клиентов ИИ и Telegram внутри handler к дедлайну апдейта не относятся
+                if not timeout.expired():
+                    raise
+                metrics.incr("updates_deadline_exceeded")
+                logger.warning(f"Update {type(event).__name__} was not handled within {self.seconds:g}s, cancelled")
+        
+        await self._reply_later(event)
+    
+    @staticmethod
+    async def _reply_later(event: TelegramObject) -> None:
+        text = "Не успел обработать запрос. Попробуй позже."
+        try:
+            async with asyncio.timeout(GRACE_SECONDS):
+                if isinstance(event, CallbackQuery) and event.message is not None:
+                    await event.message.answer(text)
+                elif isinstance(event, Message):
+                    await event.answer(text)
+        except Exception as e:
+            logger.warning(f"Failed to reply after deadline: {e}")
+
+
 class DatabaseMiddleware(BaseMiddleware):
-    """Middleware для предоставления сессии БД, bot и config в handlers."""
+    """
+    Middleware для предоставления сессии БД, bot, config и общего AI клиента в handlers.
+    
+    Сессия берет соединение из пула лениво, при первом запросе. Handler может
+    закоммитить ее посреди работы (например, перед долгим вызовом ИИ): соединение
+    вернется в пул, а следующий запрос возьмет новое. В конце middleware коммитит остальное.
+    """
     
     def __init__(
         self,
         sessionmaker: async_sessionmaker[AsyncSession],
         bot: Bot,
         config: Config,
+        ai: Optional[AIInterface] = None,
     ):
         self.sessionmaker = sessionmaker
         self.bot = bot
         self.config = config
+        self.ai = ai
     
     async def __call__(
         self,
@@ -81,6 +174,7 @@ class DatabaseMiddleware(BaseMiddleware):
             data["session"] = session
             data["bot"] = self.bot
             data["config"] = self.config
+            data["ai"] = self.ai
             try:
                 result = await handler(event, data)
                 await session.commit()
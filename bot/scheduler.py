@@ -1,9 +1,15 @@
+from typing import Optional
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 from aiogram import Bot
-from bot.db.dao import get_active_users
-from bot.services.delivery import send_daily
+from bot.services.broadcast import deliver_daily
+from bot.services.catalog import question_catalog
+from bot.services.feedback_cache import feedback_cache
+from bot.services.grading import grade_ungraded_answers
+from bot.services.hint_cache import pregenerate_hints
+from bot.utils.ai_interface import AIInterface
 from bot.config import Config
 from bot.logging import logger
 
@@ -12,28 +18,17 @@ def setup_scheduler(
     sessionmaker: async_sessionmaker[AsyncSession],
     bot: Bot,
     config: Config,
+    ai: Optional[AIInterface] = None,
 ) -> AsyncIOScheduler:
     """Настраивает и возвращает scheduler с ежедневным job."""
     scheduler = AsyncIOScheduler(timezone=config.tz)
     
     async def daily_job():
         """Ежедневная рассылка вопросов всем активным пользователям."""
-        async with sessionmaker() as session:
-            try:
-                users = await get_active_users(session)
-                logger.info(f"Starting daily job for {len(users)} users")
-                
-                for user in users:
-                    try:
-                        await send_daily(session, bot, user.tg_user_id, config)
-                        await session.commit()
-                        logger.info(f"Sent daily questions to user {user.tg_user_id}")
-                    except Exception as e:
-                        logger.error(f"Error sending daily to user {user.tg_user_id}: {e}")
-                        await session.rollback()
-            except Exception as e:
-                logger.error(f"Error in daily job: {e}")
-                await session.rollback()
+        try:
+            await deliver_daily(sessionmaker, bot, config)
+        except Exception as e:
+            logger.error(f"Error in daily job: {e}")
     
     scheduler.add_job(
         daily_job,
@@ -43,5 +38,73 @@ def setup_scheduler(
         replace_existing=True,
     )
     
+    async def catalog_refresh_job():
+        """Перезагружает каталог вопросов, если импорт поднял его версию."""
+        try:
+            async with sessionmaker() as session:
+                await question_catalog.refresh(session)
+        except Exception as e:
+            logger.error(f"Error refreshing question catalog: {e}")
+    
+    scheduler.add_job(
+        catalog_refresh_job,
+        trigger=IntervalTrigger(seconds=config.catalog_refresh_seconds),
+        id="catalog_refresh",
+        name="Question catalog refresh",
+        replace_existing=True,
+    )
+    
+    async def feedback_cache_eviction_job():
+        """Удаляет устаревшие записи кэша фидбека и лишние сверх лимита."""
+        try:
+            await feedback_cache.evict(sessionmaker)
+        except Exception as e:
+            logger.error(f"Error evicting feedback cache: {e}")
+    
+    scheduler.add_job(
+        feedback_cache_eviction_job,
+        trigger=IntervalTrigger(hours=1),
+        id="feedback_cache_eviction",
+        name="Feedback cache eviction",
+        replace_existing=True,
+    )
+    
+    if config.hint_pregen_hour is not None and ai is not None:
+        async def hint_pregen_job():
+            """Догенерирует подсказки для вопросов, которых еще нет в кэше."""
+            try:
+                await pregenerate_hints(sessionmaker, ai, config.hint_pregen_concurrency)
+            except Exception as e:
+                logger.error(f"Error in hint pregeneration job: {e}")
+        
+        scheduler.add_job(
+            hint_pregen_job,
+            trigger=CronTrigger(hour=config.hint_pregen_hour, minute=0),
+            id="hint_pregen",
+            name="Hint cache pregeneration",
+            replace_existing=True,
+        )
+    
+    if config.grading_hour is not None and ai is not None:
+        async def grading_job():
+            """Оценивает пакетами ответы, на которые пользователи не запросили фидбек."""
+            try:
+                await grade_ungraded_answers(
+                    sessionmaker,
+                    ai,
+                    config.grading_batch_size,
+                    config.grading_max_answers,
+                )
+            except Exception as e:
+                logger.error(f"Error in answer grading job: {e}")
+        
+        scheduler.add_job(
+            grading_job,
+            trigger=CronTrigger(hour=config.grading_hour, minute=0),
+            id="answer_grading",
+            name="Nightly batch grading of answers",
+            replace_existing=True,
+        )
+    
     return scheduler
 
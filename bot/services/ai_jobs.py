@@ -0,0 +1,270 @@
+import asyncio
+import random
+from typing import Dict, List, Optional
+from aiogram import Bot
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from bot.config import Config
+from bot.db.dao import (
+    enqueue_ai_job,
+    claim_ai_jobs,
+    complete_ai_job,
+    retry_ai_job,
+    fail_ai_job,
+    requeue_stale_ai_jobs,
+    renew_ai_job_lease,
+    delete_finished_ai_jobs,
+    get_ai_job_stats,
+    get_user_answer,
+    save_feedback,
+    save_hint,
+)
+from bot.keyboards.inline import get_edit_answer_keyboard
+from bot.services.catalog import question_catalog
+from bot.services.feedback_cache import feedback_cache
+from bot.services.hint_cache import get_or_generate_hint
+from bot.utils.ai_interface import AIInterface
+from bot.utils.markdown import format_hint_message, format_feedback_message
+from bot.utils.metrics import metrics
+from bot.logging import logger
+
+JOB_HINT = "hint"
+JOB_FEEDBACK = "feedback"
+
+# Подсказку пользователь ждет, чтобы ответить на вопрос, поэтому она важнее фидбека.
+# Больше - раньше (в отличие от приоритетов квоты bot.utils.quota, где раньше - меньше)
+JOB_PRIORITY_HINT = 10
+JOB_PRIORITY_FEEDBACK = 5
+
+# Задача в running, чью аренду не продлевали дольше этого времени, считается брошенной
+# и возвращается в очередь
+STALE_JOB_SECONDS = 300
+# Как часто воркер продлевает аренду выполняемой задачи (ожидание квоты может быть долгим)
+JOB_HEARTBEAT_SECONDS = 60
+# Сколько хранить выполненные и проваленные задачи
+FINISHED_JOB_TTL_SECONDS = 24 * 3600
+MAINTENANCE_INTERVAL_SECONDS = 30
+RETRY_BASE_DELAY = 2.0
+RETRY_MAX_DELAY = 300.0
+
+FAILURE_MESSAGES = {
+    JOB_HINT: "Не удалось сгенерировать подсказку. Попробуй позже.",
+    JOB_FEEDBACK: "Не удалось сгенерировать фидбек. Попробуй позже.",
+}
+
+
+async def enqueue_hint(session: AsyncSession, user_id: int, tg_user_id: int, question_id: int) -> int:
+    """Ставит генерацию подсказки в очередь."""
+    return await enqueue_ai_job(session, JOB_HINT, user_id, tg_user_id, question_id, JOB_PRIORITY_HINT)
+
+
+async def enqueue_feedback(session: AsyncSession, user_id: int, tg_user_id: int, question_id: int) -> int:
+    """Ставит генерацию фидбека в очередь."""
+    return await enqueue_ai_job(session, JOB_FEEDBACK, user_id, tg_user_id, question_id, JOB_PRIORITY_FEEDBACK)
+
+
+async def process_hint_job(session: AsyncSession, bot: Bot, ai: Optional[AIInterface], job) -> None:
+    """Генерирует подсказку, сохраняет ее и отправляет пользователю."""
+    question = await question_catalog.get_question(session, job.question_id)
+    if question is None:
+        logger.warning(f"AI job {job.id}: question {job.question_id} not found, skipping")
+        return
+    
+    hint = await get_or_generate_hint(session, ai, question, job.tg_user_id)
+    await save_hint(session, job.user_id, job.question_id, hint)
+    await session.commit()
+    
+    await bot.send_message(job.tg_user_id, format_hint_message(hint), parse_mode="MarkdownV2")
+
+
+async def process_feedback_job(session: AsyncSession, bot: Bot, ai: Optional[AIInterface], job) -> None:
+    """Генерирует фидбек на ответ, сохраняет его и отправляет пользователю."""
+    question = await question_catalog.get_question(session, job.question_id)
+    answer_text = await get_user_answer(session, job.user_id, job.question_id)
+    if question is None or not answer_text:
+        logger.warning(f"AI job {job.id}: answer for question {job.question_id} not found, skipping")
+        return
+    
+    # Фидбек из кэша или новый; соединение не держим на время генерации
+    feedback = await feedback_cache.get_or_generate(session, ai, question, answer_text, job.tg_user_id)
+    await save_feedback(session, job.user_id, job.question_id, feedback)
+    await session.commit()
+    
+    await bot.send_message(
+        job.tg_user_id,
+        format_feedback_message(feedback),
+        parse_mode="MarkdownV2",
+        reply_markup=get_edit_answer_keyboard(job.question_id),
+    )
+
+
+JOB_PROCESSORS = {
+    JOB_HINT: process_hint_job,
+    JOB_FEEDBACK: process_feedback_job,
+}
+
+
+def retry_delay(attempts: int) -> float:
+    """Экспоненциальная задержка перед повтором с небольшим случайным разбросом."""
+    delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempts - 1))
+    return delay * random.uniform(0.8, 1.2)
+
+
+class AIJobWorkers:
+    """
+    Пул асинхронных воркеров очереди ai_jobs.
+    
+    Каждый воркер забирает задачу через SKIP LOCKED, выполняет ее и отмечает результат.
+    Ошибки повторяются с экспоненциальной задержкой до max_attempts, после чего
+    пользователь получает сообщение об ошибке. Пока задача выполняется, воркер продлевает
+    ее аренду. Отдельный цикл обслуживания возвращает в очередь задачи с истекшей арендой
+    (воркер или процесс упал), чистит старые и публикует глубину и возраст очереди в metrics.
+    """
+    
+    def __init__(
+        self,
+        sessionmaker: async_sessionmaker[AsyncSession],
+        bot: Bot,
+        ai: Optional[AIInterface],
+        config: Config,
+    ):
+        self.sessionmaker = sessionmaker
+        self.bot = bot
+        self.ai = ai
+        self.workers = max(1, config.ai_job_workers)
+        self.max_attempts = max(1, config.ai_job_max_attempts)
+        self.poll_interval = config.ai_job_poll_interval
+        self._tasks: List[asyncio.Task] = []
+        self._stopping = asyncio.Event()
+    
+    def start(self) -> None:
+        self._stopping.clear()
+        self._tasks = [
+            asyncio.create_task(self._worker(n), name=f"ai_job_worker_{n}")
+            for n in range(self.workers)
+        ]
+        self._tasks.append(asyncio.create_task(self._maintenance(), name="ai_job_maintenance"))
+        logger.info(f"AI job workers started: {self.workers}")
+    
+    async def stop(self) -> None:
+        """Останавливает воркеры; прерванные задачи вернутся в очередь как зависшие."""
+        self._stopping.set()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+    
+    async def _sleep(self, seconds: float) -> None:
+        try:
+            await asyncio.wait_for(self._stopping.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+    
+    async def _worker(self, n: int) -> None:
+        while not self._stopping.is_set():
+            try:
+                async with self.sessionmaker() as session, session.begin():
+                    jobs = await claim_ai_jobs(session, limit=1)
+            except Exception as e:
+                logger.error(f"AI job worker {n}: failed to claim job: {e}")
+                await self._sleep(self.poll_interval * 10)
+                continue
+            
+            if not jobs:
+                await self._sleep(self.poll_interval)
+                continue
+            
+            for job in jobs:
+                await self._run_job(job)
+    
+    async def _run_job(self, job) -> None:
+        loop = asyncio.get_running_loop()
+        processor = JOB_PROCESSORS.get(job.kind)
+        started = loop.time()
+        heartbeat = asyncio.create_task(self._heartbeat(job.id), name=f"ai_job_heartbeat_{job.id}")
+        try:
+            if processor is None:
+                raise ValueError(f"Unknown AI job kind: {job.kind}")
+            async with self.sessionmaker() as session:
+                await processor(session, self.bot, self.ai, job)
+                await complete_ai_job(session, job.id)
+                await session.commit()
+            metrics.incr(f"ai_jobs_done_{job.kind}")
+            logger.info(f"AI job {job.id} ({job.kind}) done in {loop.time() - started:.2f}s, attempt {job.attempts}")
+        except asyncio.CancelledError:
+            raise
+        except ValueError as e:
+            # Нет API ключа или неизвестный тип задачи - повтор не поможет
+            await self._fail(job, e)
+        except Exception as e:
+            if job.attempts >= self.max_attempts:
+                await self._fail(job, e)
+                return
+            delay = retry_delay(job.attempts)
+            metrics.incr("ai_jobs_retried")
+            logger.warning(f"AI job {job.id} ({job.kind}) attempt {job.attempts} failed: {e}. Retrying in {delay:.1f}s")
+            try:
+                async with self.sessionmaker() as session, session.begin():
+                    await retry_ai_job(session, job.id, delay, str(e)[:1000])
+            except Exception as db_error:
+                logger.error(f"AI job {job.id}: failed to schedule retry: {db_error}")
+        finally:
+            heartbeat.cancel()
+    
+    async def _heartbeat(self, job_id: int) -> None:
+        """Продлевает аренду задачи, чтобы обслуживание не вернуло ее в очередь, пока она выполняется."""
+        while True:
+            await asyncio.sleep(JOB_HEARTBEAT_SECONDS)
+            try:
+                async with self.sessionmaker() as session, session.begin():
+                    await renew_ai_job_lease(session, job_id)
+            except Exception as e:
+                logger.warning(f"AI job {job_id}: failed to renew lease: {e}")
+    
+    async def _fail(self, job, error: Exception) -> None:
+        metrics.incr("ai_jobs_failed")
+        logger.error(f"AI job {job.id} ({job.kind}) failed after {job.attempts} attempts: {error}")
+        try:
+            async with self.sessionmaker() as session, session.begin():
+                await fail_ai_job(session, job.id, str(error)[:1000])
+        except Exception as db_error:
+            logger.error(f"AI job {job.id}: failed to mark as failed: {db_error}")
+        
+        if isinstance(error, ValueError) and self.ai is None:
+            text = "ИИ недоступен: не настроен API ключ.\n\nДобавьте GEMINI_API_KEY в .env файл."
+        else:
+            text = FAILURE_MESSAGES.get(job.kind, "Не удалось выполнить запрос. Попробуй позже.")
+        try:
+            await self.bot.send_message(job.tg_user_id, text)
+        except Exception as e:
+            logger.warning(f"AI job {job.id}: failed to notify user {job.tg_user_id}: {e}")
+    
+    async def _maintenance(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                async with self.sessionmaker() as session, session.begin():
+                    requeued = await requeue_stale_ai_jobs(session, STALE_JOB_SECONDS)
+                    deleted = await delete_finished_ai_jobs(session, FINISHED_JOB_TTL_SECONDS)
+                    stats = await get_ai_job_stats(session)
+                publish_ai_job_stats(stats)
+                if requeued:
+                    logger.warning(f"Requeued {requeued} stale AI jobs")
+                if deleted:
+                    logger.info(f"Deleted {deleted} finished AI jobs")
+            except Exception as e:
+                logger.error(f"AI job maintenance failed: {e}")
+            await self._sleep(MAINTENANCE_INTERVAL_SECONDS)
+
+
+def publish_ai_job_stats(stats: Dict[str, Dict[str, float]]) -> None:
+    """Публикует глубину очереди и возраст самой старой задачи в metrics."""
+    queued = stats.get("queued", {})
+    running = stats.get("running", {})
+    metrics.set_gauge("ai_jobs_queued", queued.get("count", 0))
+    metrics.set_gauge("ai_jobs_oldest_queued_age", queued.get("oldest_age", 0.0))
+    metrics.set_gauge("ai_jobs_running", running.get("count", 0))
+    metrics.set_gauge("ai_jobs_failed_total", stats.get("failed", {}).get("count", 0))
+    if queued.get("count"):
+        logger.info(
+            f"AI job queue: {queued['count']} queued (oldest {queued['oldest_age']:.1f}s), "
+            f"{running.get('count', 0)} running"
+        )
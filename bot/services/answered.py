@@ -0,0 +1,120 @@
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Sequence
+from sqlalchemy.ext.asyncio import AsyncSession
+from bot.db.dao import get_answered_question_ids
+from bot.utils.metrics import metrics
+
+
+class AnsweredBitsets:
+    """
+    Отвеченные вопросы активных пользователей в памяти: user_id -> битсет (int),
+    где бит с номером question_id выставлен, если на вопрос есть ответ.
+    
+    Битсеты загружаются лениво из user_questions и обновляются через mark_answered/reset.
+    Число пользователей ограничено, вытесняются давно не использованные.
+    """
+    
+    def __init__(self, max_users: int = 100_000):
+        self.max_users = max_users
+        self._bits: "OrderedDict[int, int]" = OrderedDict()
+        # Ответы, пришедшие пока битсет пользователя загружается из БД
+        self._loading: Dict[int, int] = {}
+    
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._bits
+    
+    def __len__(self) -> int:
+        return len(self._bits)
+    
+    async def get(self, session: AsyncSession, user_id: int) -> int:
+        """Возвращает битсет пользователя, при необходимости загружая его из БД."""
+        bits = self._bits.get(user_id)
+        if bits is not None:
+            self._bits.move_to_end(user_id)
+            metrics.incr("answered_bitsets_hit")
+            return bits
+        
+        await self.hydrate(session, [user_id])
+        return self._bits.get(user_id, 0)
+    
+    async def hydrate(self, session: AsyncSession, user_ids: Iterable[int]) -> None:
+        """Загружает одним запросом битсеты пользователей, которых еще нет в памяти."""
+        missing = [user_id for user_id in user_ids if user_id not in self._bits]
+        if not missing:
+            return
+        
+        metrics.incr("answered_bitsets_miss", len(missing))
+        for user_id in missing:
+            self._loading.setdefault(user_id, 0)
+        try:
+            answered = await get_answered_question_ids(session, missing)
+        except BaseException:
+            for user_id in missing:
+                self._loading.pop(user_id, None)
+            raise
+        
+        for user_id in missing:
+            bits = self._loading.pop(user_id, 0)
+            for question_id in answered.get(user_id, ()):
+                bits |= 1 << question_id
+            self._store(user_id, bits)
+    
+    def mark_answered(self, user_id: int, question_id: int) -> None:
+        """Отмечает ответ (вызывать после коммита save_answer)."""
+        bit = 1 << question_id
+        if user_id in self._bits:
+            self._bits[user_id] |= bit
+        elif user_id in self._loading:
+            self._loading[user_id] |= bit
+    
+    def reset(self, user_id: int) -> None:
+        """Сбрасывает прогресс пользователя (вызывать после коммита удаления user_questions)."""
+        if user_id in self._bits:
+            self._bits[user_id] = 0
+        if user_id in self._loading:
+            self._loading[user_id] = 0
+    
+    def _store(self, user_id: int, bits: int) -> None:
+        self._bits[user_id] = bits
+        self._bits.move_to_end(user_id)
+        while len(self._bits) > self.max_users:
+            self._bits.popitem(last=False)
+
+
+def pick_questions(
+    ordered: Sequence,
+    answered_bits: int,
+    high_n: int,
+    low_n: int,
+    total_n: int,
+    threshold: int,
+) -> List:
+    """
+    Выбирает вопросы по тем же правилам, что select_next_questions, но в памяти.
+    
+    ordered должен быть отсортирован по (freq_score desc, id), поэтому high-вопросы
+    (freq_score > threshold) образуют префикс, а low - суффикс списка.
+    """
+    high: List = []
+    low: List = []
+    rest: List = []
+    for q in ordered:
+        if answered_bits >> q.id & 1:
+            continue
+        if q.freq_score > threshold:
+            if len(high) < high_n:
+                high.append(q)
+                continue
+        elif len(low) < low_n:
+            low.append(q)
+            continue
+        if len(rest) < total_n:
+            rest.append(q)
+        if len(low) >= low_n and len(rest) >= total_n:
+            break
+    
+    # Сначала high, потом low, затем добор из оставшихся в порядке каталога
+    return (high + low + rest)[:total_n]
+
+
+answered_bitsets = AnsweredBitsets()
@@ -0,0 +1,130 @@
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import List
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from aiogram import Bot
+from bot.db.dao import get_active_user_ids, mark_sent_bulk, set_daily_state_bulk, restore_daily_state_bulk
+from bot.services.delivery import send_daily_questions
+from bot.services.selection import select_questions_for_users
+from bot.config import Config
+from bot.utils.metrics import percentile
+from bot.utils.rate_limit import rate_limited
+from bot.logging import logger
+
+
+@dataclass
+class DeliveryReport:
+    """Итоги одного запуска рассылки."""
+    total: int = 0
+    sent: int = 0
+    failed: int = 0
+    duration: float = 0.0
+    latencies: List[float] = field(default_factory=list)
+    
+    @property
+    def throughput(self) -> float:
+        """Обработано пользователей в секунду."""
+        return self.total / self.duration if self.duration > 0 else 0.0
+    
+    def summary(self) -> str:
+        return (
+            f"users={self.total} sent={self.sent} failed={self.failed} "
+            f"duration={self.duration:.1f}s throughput={self.throughput:.1f}/s "
+            f"p50={percentile(self.latencies, 50):.3f}s "
+            f"p95={percentile(self.latencies, 95):.3f}s "
+            f"p99={percentile(self.latencies, 99):.3f}s"
+        )
+
+
+async def deliver_daily(
+    sessionmaker: async_sessionmaker[AsyncSession],
+    bot: Bot,
+    config: Config,
+) -> DeliveryReport:
+    """
+    Рассылает ежедневные вопросы всем активным пользователям.
+    
+    Пользователи обрабатываются пачками по config.selection_batch_size: для пачки
+    вопросы подбираются и сохраняются в одной транзакции (несколько запросов на пачку
+    вместо нескольких на пользователя), после чего отправка идет параллельно,
+    не более config.delivery_concurrency одновременно. Пока пачка отправляется,
+    готовится следующая, но не дальше: сохраненных и еще не отправленных подборок
+    не больше двух пачек. Пользователям, которым отправить не удалось, подборка
+    откатывается (restore_daily_state_bulk). Лимиты Telegram соблюдает
+    RateLimitMiddleware, подключенный к сессии бота: отправки рассылки идут в rate_limited().
+    """
+    async with sessionmaker() as session:
+        users = await get_active_user_ids(session)
+    
+    report = DeliveryReport(total=len(users))
+    logger.info(f"Starting daily job for {report.total} users (concurrency={config.delivery_concurrency})")
+    
+    semaphore = asyncio.Semaphore(max(1, config.delivery_concurrency))
+    
+    async def deliver(tg_user_id: int, questions: list) -> bool:
+        async with semaphore:
+            started = time.monotonic()
+            try:
+                with rate_limited():
+                    await send_daily_questions(bot, tg_user_id, questions)
+                report.sent += 1
+                return True
+            except Exception as e:
+                report.failed += 1
+                logger.error(f"Error sending daily to user {tg_user_id}: {e}")
+                return False
+            finally:
+                report.latencies.append(time.monotonic() - started)
+    
+    async def finish_batch(batch: list, question_ids: dict, previous: dict, marks: dict, tasks: list) -> None:
+        """Дожидается отправки пачки и откатывает подборки, которые не дошли."""
+        delivered = await asyncio.gather(*tasks)
+        undelivered = {
+            user_id: question_ids[user_id]
+            for (user_id, _), ok in zip(batch, delivered)
+            if not ok and question_ids.get(user_id)
+        }
+        if not undelivered:
+            return
+        try:
+            async with sessionmaker() as session, session.begin():
+                await restore_daily_state_bulk(session, undelivered, previous, marks)
+        except Exception as e:
+            logger.error(f"Error restoring daily state of {len(undelivered)} users: {e}")
+    
+    run_started = time.monotonic()
+    batch_size = max(1, config.selection_batch_size)
+    sending = None
+    for offset in range(0, len(users), batch_size):
+        batch = users[offset:offset + batch_size]
+        try:
+            async with sessionmaker() as session, session.begin():
+                selections = await select_questions_for_users(
+                    session, [user_id for user_id, _ in batch], config
+                )
+                question_ids = {
+                    user_id: [q.id for q in questions] for user_id, questions in selections.items()
+                }
+                marks = await mark_sent_bulk(session, question_ids)
+                previous = await set_daily_state_bulk(session, question_ids)
+        except Exception as e:
+            report.failed += len(batch)
+            logger.error(f"Error preparing daily batch of {len(batch)} users: {e}")
+            continue
+        
+        tasks = [
+            asyncio.create_task(deliver(tg_user_id, selections.get(user_id, [])))
+            for user_id, tg_user_id in batch
+        ]
+        # Следующую пачку готовим, только когда предыдущая отправлена
+        if sending is not None:
+            await sending
+        sending = finish_batch(batch, question_ids, previous, marks, tasks)
+    
+    if sending is not None:
+        await sending
+    report.duration = time.monotonic() - run_started
+    
+    logger.info(f"Daily job finished: {report.summary()}")
+    return report
@@ -0,0 +1,89 @@
+from typing import Dict, Iterable, Optional, Tuple
+from sqlalchemy.ext.asyncio import AsyncSession
+from bot.db.dao import get_all_questions, get_catalog_version, get_question
+from bot.logging import logger
+
+
+class CatalogQuestion:
+    """Компактная неизменяемая запись вопроса из каталога."""
+    __slots__ = ("id", "freq_score", "question", "question_hash")
+    
+    def __init__(self, id: int, freq_score: int, question: str, question_hash: str):
+        self.id = id
+        self.freq_score = freq_score
+        self.question = question
+        self.question_hash = question_hash
+    
+    @classmethod
+    def from_model(cls, question) -> "CatalogQuestion":
+        return cls(question.id, question.freq_score, question.question, question.question_hash)
+    
+    def __repr__(self) -> str:
+        return f"CatalogQuestion(id={self.id}, freq_score={self.freq_score})"
+
+
+class QuestionCatalog:
+    """
+    In-memory каталог вопросов на весь процесс.
+    
+    Таблица questions маленькая и меняется только скриптом импорта, поэтому держим
+    ее целиком в памяти: индекс по id и кортеж, отсортированный по (freq_score desc, id).
+    Актуальность проверяется по версии каталога (catalog_version), которую поднимает импорт.
+    """
+    
+    def __init__(self):
+        self.version = -1
+        self._by_id: Dict[int, CatalogQuestion] = {}
+        self.ordered: Tuple[CatalogQuestion, ...] = ()
+    
+    def __len__(self) -> int:
+        return len(self._by_id)
+    
+    @property
+    def loaded(self) -> bool:
+        return self.version >= 0
+    
+    def load(self, questions: Iterable, version: int) -> None:
+        """Заменяет содержимое каталога (атомарно для читателей)."""
+        records = [CatalogQuestion.from_model(q) for q in questions]
+        records.sort(key=lambda q: (-q.freq_score, q.id))
+        self._by_id = {q.id: q for q in records}
+        self.ordered = tuple(records)
+        self.version = version
+    
+    def get(self, question_id: int) -> Optional[CatalogQuestion]:
+        """Возвращает вопрос из памяти без обращения к БД."""
+        return self._by_id.get(question_id)
+    
+    async def refresh(self, session: AsyncSession) -> bool:
+        """
+        Перезагружает каталог, если версия в БД изменилась.
+        
+        Returns:
+            True если каталог был перезагружен
+        """
+        version = await get_catalog_version(session)
+        if version == self.version:
+            return False
+        
+        questions = await get_all_questions(session)
+        self.load(questions, version)
+        logger.info(f"Question catalog loaded: {len(self)} questions, version {version}")
+        return True
+    
+    async def get_question(self, session: AsyncSession, question_id: int) -> Optional[CatalogQuestion]:
+        """Read-through: вопрос из памяти, а при промахе - из БД с добавлением в каталог."""
+        record = self._by_id.get(question_id)
+        if record is not None:
+            return record
+        
+        question = await get_question(session, question_id)
+        if question is None:
+            return None
+        
+        record = CatalogQuestion.from_model(question)
+        self._by_id[record.id] = record
+        return record
+
+
+question_catalog = QuestionCatalog()
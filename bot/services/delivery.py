@@ -1,47 +1,63 @@
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
 from aiogram import Bot
 from bot.db.dao import (
-    get_or_create_user,
     mark_sent,
     set_pending_questions,
     pop_next_question,
     set_awaiting,
 )
-from bot.db.models import Question
+from bot.services.catalog import question_catalog
 from bot.services.selection import select_questions_for_user
+from bot.services.user_context import user_contexts
 from bot.config import Config
 from bot.keyboards.inline import get_answer_keyboard
+from bot.utils.deadline import telegram_timeout
 
 
 async def send_daily(session: AsyncSession, bot: Bot, tg_user_id: int, config: Config) -> None:
     """Отправляет ежедневную подборку вопросов пользователю (только первый вопрос)."""
-    user = await get_or_create_user(session, tg_user_id)
+    user_id = await user_contexts.get_user_id(session, tg_user_id)
     
-    questions = await select_questions_for_user(session, user.id, config)
+    questions = await select_questions_for_user(session, user_id, config)
     
+    if questions:
+        # Помечаем как отправленные
+        question_ids = [q.id for q in questions]
+        await mark_sent(session, user_id, question_ids)
+        
+        # Сохраняем все вопросы в очередь (включая первый)
+        await set_pending_questions(session, user_id, question_ids)
+        
+        # Сразу устанавливаем ожидание ответа на первый вопрос
+        await set_awaiting(session, user_id, questions[0].id)
+    
+    await send_daily_questions(bot, tg_user_id, questions)
+
+
+async def send_daily_questions(bot: Bot, tg_user_id: int, questions: list) -> None:
+    """
+    Отправляет первый вопрос уже подготовленной подборки (очередь и ожидание
+    должны быть сохранены заранее). Обращений к БД не делает.
+    """
     if not questions:
         await bot.send_message(
             tg_user_id,
-            "На сегодня все вопросы закончились!"
+            "На сегодня все вопросы закончились!",
+            request_timeout=telegram_timeout(),
         )
         return
     
-    # Помечаем как отправленные
-    question_ids = [q.id for q in questions]
-    await mark_sent(session, user.id, question_ids)
+    await send_question(bot, tg_user_id, questions[0])
     
-    # Сохраняем все вопросы в очередь (включая первый)
-    await set_pending_questions(session, user.id, question_ids)
     
-    # Отправляем только первый вопрос и сразу устанавливаем ожидание ответа
-    first_question = questions[0]
-    await set_awaiting(session, user.id, first_question.id)
-    keyboard = get_answer_keyboard(first_question.id)
+async def send_question(bot: Bot, tg_user_id: int, question) -> None:
+    """Отправляет текст вопроса с клавиатурой ответа."""
+    keyboard = get_answer_keyboard(question.id)
     await bot.send_message(
         tg_user_id,
-        f"{first_question.question}\n\nЧастота: {first_question.freq_score}/9\n\nНапиши ответ текстом:",
+        f"{question.question}\n\nЧастота: {question.freq_score}/9\n\nНапиши ответ текстом:",
         reply_markup=keyboard,
+        request_timeout=telegram_timeout(),
     )
 
 
@@ -50,32 +66,25 @@ async def send_next_question(session: AsyncSession, bot: Bot, tg_user_id: int) -
     Отправляет следующий вопрос из очереди пользователю и сразу устанавливает ожидание ответа.
     Возвращает True если вопрос отправлен, False если очередь пуста.
     """
-    user = await get_or_create_user(session, tg_user_id)
+    user_id = await user_contexts.get_user_id(session, tg_user_id)
     
     # Получаем следующий вопрос из очереди
-    question_id = await pop_next_question(session, user.id)
+    question_id = await pop_next_question(session, user_id)
     
     if question_id is None:
         return False
     
-    # Получаем вопрос из БД
-    stmt = select(Question).where(Question.id == question_id)
-    result = await session.execute(stmt)
-    question = result.scalar_one_or_none()
+    # Получаем вопрос из каталога в памяти
+    question = await question_catalog.get_question(session, question_id)
     
     if question is None:
         # Если вопрос не найден, пробуем следующий
         return await send_next_question(session, bot, tg_user_id)
     
     # Устанавливаем ожидание ответа
-    await set_awaiting(session, user.id, question.id)
+    await set_awaiting(session, user_id, question.id)
     
-    keyboard = get_answer_keyboard(question.id)
-    await bot.send_message(
-        tg_user_id,
-        f"{question.question}\n\nЧастота: {question.freq_score}/9\n\nНапиши ответ текстом:",
-        reply_markup=keyboard,
-    )
+    await send_question(bot, tg_user_id, question)
     
     return True
 
@@ -0,0 +1,129 @@
+from typing import Any, Dict, Optional
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from bot.config import Config
+from bot.db.dao import get_cached_feedback, save_cached_feedback, touch_cached_feedback, evict_feedback_cache
+from bot.services.catalog import CatalogQuestion
+from bot.services.hint import FEEDBACK_PROMPT_VERSION, request_feedback
+from bot.utils.ai_interface import AIInterface
+from bot.utils.hashing import sha256_hash
+from bot.utils.lru import LRUCache
+from bot.utils.metrics import metrics
+from bot.logging import logger
+
+
+class FeedbackCache:
+    """
+    Кэш фидбека на одинаковые ответы: пользователи часто присылают один и тот же
+    ответ (например, скопированный из spoiler подсказки).
+    
+    Ключ - (question_hash, sha256 нормализованного ответа, версия промпта). Записи
+    лежат в таблице feedback_cache, перед ней LRU в памяти. Записи старше ttl не
+    отдаются и удаляются вместе с давно не использованными сверх max_rows.
+    Попадания в памяти копятся и записываются в таблицу перед вытеснением,
+    чтобы горячие записи не считались давно не использованными.
+    Попадания, промахи, сэкономленные вызовы ИИ и доля попаданий пишутся в metrics.
+    """
+    
+    def __init__(self, memory_size: int = 4096, ttl_seconds: float = 30 * 24 * 3600, max_rows: int = 100000):
+        self.ttl_seconds = ttl_seconds
+        self.max_rows = max_rows
+        self.lru = LRUCache(maxsize=memory_size, ttl=ttl_seconds)
+        self._hits = 0
+        self._lookups = 0
+        # Попадания в памяти, еще не записанные в last_used_at/hits таблицы
+        self._touched: Dict[tuple, int] = {}
+    
+    def configure(self, config: Config) -> None:
+        self.ttl_seconds = config.feedback_cache_ttl_hours * 3600
+        self.max_rows = max(0, config.feedback_cache_max_rows)
+        self.lru = LRUCache(maxsize=max(1, config.feedback_cache_memory_size), ttl=self.ttl_seconds)
+    
+    @staticmethod
+    def _key(question_hash: str, answer_text: str) -> tuple:
+        return question_hash, sha256_hash(answer_text), FEEDBACK_PROMPT_VERSION
+    
+    def get_from_memory(self, question_hash: str, answer_text: str) -> Optional[str]:
+        """Ищет фидбек только в памяти (без запроса к БД)."""
+        return self.lru.get(self._key(question_hash, answer_text))
+    
+    async def get(self, session: AsyncSession, question_hash: str, answer_text: str) -> Optional[str]:
+        """Ищет фидбек сначала в памяти, затем в таблице feedback_cache."""
+        key = self._key(question_hash, answer_text)
+        feedback = self.lru.get(key)
+        if feedback is not None:
+            self._touched[key] = self._touched.get(key, 0) + 1
+            self._record("feedback_cache_hit_memory")
+            return feedback
+        
+        feedback = await get_cached_feedback(session, *key, self.ttl_seconds)
+        if feedback is not None:
+            self.lru.set(key, feedback)
+            self._record("feedback_cache_hit_db")
+        else:
+            self._record("feedback_cache_miss")
+        return feedback
+    
+    async def put(self, session: AsyncSession, question_hash: str, answer_text: str, feedback: str) -> None:
+        """Сохраняет фидбек в кэш (запись в БД коммитит вызывающий код)."""
+        key = self._key(question_hash, answer_text)
+        await save_cached_feedback(session, *key, feedback)
+        self.lru.set(key, feedback)
+    
+    async def get_or_generate(
+        self,
+        session: AsyncSession,
+        ai: Optional[AIInterface],
+        question: CatalogQuestion,
+        answer_text: str,
+        user_key: Optional[Any] = None,
+    ) -> str:
+        """
+        Возвращает фидбек из кэша, а при промахе генерирует его и сохраняет в кэш.
+        
+        Перед обращением к ИИ текущая транзакция сессии коммитится, чтобы соединение
+        не было занято на время генерации.
+        
+        Raises:
+            ValueError: Если API ключ не настроен
+            RuntimeError: Если ИИ не ответил
+        """
+        feedback = await self.get(session, question.question_hash, answer_text)
+        if feedback is not None:
+            return feedback
+        
+        await session.commit()
+        feedback = await request_feedback(ai, question.question, answer_text, question.freq_score, user_key)
+        await self.put(session, question.question_hash, answer_text, feedback)
+        return feedback
+    
+    async def evict(self, sessionmaker: async_sessionmaker[AsyncSession]) -> int:
+        """
+        Записывает накопленные попадания в памяти, затем удаляет из таблицы
+        устаревшие записи и лишние сверх max_rows.
+        """
+        touched, self._touched = self._touched, {}
+        try:
+            async with sessionmaker() as session, session.begin():
+                await touch_cached_feedback(session, touched)
+                deleted = await evict_feedback_cache(session, self.ttl_seconds, self.max_rows)
+        except Exception:
+            # Попадания не потеряются: запишутся при следующем вытеснении
+            for key, hits in touched.items():
+                self._touched[key] = self._touched.get(key, 0) + hits
+            raise
+        if deleted:
+            logger.info(f"Evicted {deleted} feedback cache entries")
+        metrics.incr("feedback_cache_evicted", deleted)
+        return deleted
+    
+    def _record(self, metric: str) -> None:
+        metrics.incr(metric)
+        self._lookups += 1
+        if metric != "feedback_cache_miss":
+            self._hits += 1
+            # Каждое попадание - не сделанный запрос к ИИ
+            metrics.incr("feedback_cache_saved_calls")
+        metrics.set_gauge("feedback_cache_hit_rate", self._hits / self._lookups)
+
+
+feedback_cache = FeedbackCache()
@@ -0,0 +1,295 @@
+import json
+import re
+from typing import Dict, List, Optional
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from bot.db.dao import get_ungraded_answers, save_feedback
+from bot.services.catalog import question_catalog
+from bot.utils.ai_interface import AIInterface
+from bot.utils.metrics import metrics
+from bot.utils.quota import PRIORITY_BACKGROUND, estimate_tokens
+from bot.logging import logger
+
+# Сколько ответов читать из БД за один запрос
+FETCH_PAGE_SIZE = 500
+# Ожидаемый размер фидбека на один ответ, токенов
+FEEDBACK_OUTPUT_TOKENS = 300
+# Доля бюджета контекста, которую занимает один пакет: оценка токенов грубая
+CONTEXT_BUDGET_SHARE = 0.5
+# Модели, у которых на пакет остается меньше токенов, ночную оценку не получают:
+# пакет почти целиком уходил бы на общий промпт, по одному ответу на запрос
+MIN_BATCH_TOKENS = 4096
+# Типичный ответ для проверки размера пакета: ~5 предложений по существу вопроса
+SAMPLE_ANSWER_CHARS = 800
+
+
+class GradingItem:
+    """Ответ пользователя, ожидающий оценки."""
+    __slots__ = ("id", "user_id", "question_id", "question", "freq_score", "answer_text")
+    
+    def __init__(self, id: int, user_id: int, question_id: int, question: str, freq_score: int, answer_text: str):
+        self.id = id
+        self.user_id = user_id
+        self.question_id = question_id
+        self.question = question
+        self.freq_score = freq_score
+        self.answer_text = answer_text
+    
+    def to_prompt(self) -> Dict[str, object]:
+        return {
+            "id": self.id,
+            "question": self.question,
+            "frequency": self.freq_score,
+            "answer": self.answer_text,
+        }
+
+
+def create_grading_prompt(items: List[GradingItem]) -> str:
+    """
+    Создает промпт для оценки нескольких ответов одним запросом.
+    
+    Ответы передаются JSON-массивом, результат ожидается JSON-массивом
+    объектов {"id": ..., "feedback": ...}.
+    """
+    payload = json.dumps([item.to_prompt() for item in items], ensure_ascii=False, indent=1)
+    prompt = f"""Ты - опытный технический интервьюер и ментор по DevOps/системному администрированию.
+
+Ниже JSON-массив ответов кандидатов на вопросы собеседования. У каждого элемента есть
+id, вопрос (question), частота вопроса (frequency, 0-9, чем выше, тем чаще спрашивают)
+и ответ кандидата (answer).
+
+{payload}
+
+Задача: для КАЖДОГО ответа дай конструктивный фидбек. Фидбек должен:
+1. Оценить полноту ответа (что хорошо, что можно улучшить)
+2. Указать на пропущенные важные аспекты (если есть)
+3. Дать конкретные рекомендации по улучшению
+4. Быть конструктивным
+5. Быть кратким (3-5 предложений)
+
+Формат ответа: только JSON-массив без пояснений и без markdown, по одному объекту на
+каждый ответ: [{{"id": <id ответа>, "feedback": "<фидбек>"}}]. Фидбек без префиксов
+типа "Фидбек:" или "Оценка:".
+"""
+    
+    return prompt
+
+
+def parse_grading_response(text: str, ids: List[int]) -> Dict[int, str]:
+    """
+    Разбирает ответ ИИ на пакет: {id ответа: фидбек}.
+    
+    Элементы с неизвестным id или пустым фидбеком пропускаются.
+    
+    Raises:
+        ValueError: Если ответ не JSON-массив
+    """
+    # Модели часто оборачивают JSON в ```json ... ```
+    text = re.sub(r"^\s*```(?:json)?\s*|\s*```\s*$", "", text.strip())
+    data = json.loads(text)
+    if not isinstance(data, list):
+        raise ValueError("Grading response is not a JSON array")
+    
+    expected = set(ids)
+    results: Dict[int, str] = {}
+    for entry in data:
+        if not isinstance(entry, dict):
+            continue
+        try:
+            item_id = int(entry.get("id"))
+        except (TypeError, ValueError):
+            continue
+        feedback = entry.get("feedback")
+        if item_id in expected and isinstance(feedback, str) and feedback.strip():
+            results[item_id] = feedback.strip()
+    return results
+
+
+def pack_batches(items: List[GradingItem], token_budget: int, max_items: int) -> List[List[GradingItem]]:
+    """Раскладывает ответы по пакетам, чтобы промпт и ожидаемый ответ укладывались в token_budget."""
+    base = estimate_tokens(create_grading_prompt([]), expected_output=0)
+    batches: List[List[GradingItem]] = []
+    batch: List[GradingItem] = []
+    used = base
+    for item in items:
+        cost = estimate_tokens(json.dumps(item.to_prompt(), ensure_ascii=False), FEEDBACK_OUTPUT_TOKENS)
+        if batch and (used + cost > token_budget or len(batch) >= max_items):
+            batches.append(batch)
+            batch, used = [], base
+        batch.append(item)
+        used += cost
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def grading_models(ai: AIInterface) -> Optional[List[str]]:
+    """
+    Модели, которым можно отдавать пакеты: бюджет одного запроса вмещает
+    хотя бы MIN_BATCH_TOKENS. None - подходящих нет, пакеты идут на любую модель.
+    """
+    models = [
+        model for model in ai.models
+        if ai.context_budget([model]) * CONTEXT_BUDGET_SHARE >= MIN_BATCH_TOKENS
+    ]
+    if not models:
+        logger.warning(f"No model fits a grading batch of {MIN_BATCH_TOKENS} tokens, grading on all models")
+        return None
+    return models
+
+
+def sample_batch_size(token_budget: int, max_items: int) -> int:
+    """Сколько типичных ответов помещается в один пакет при данном бюджете."""
+    sample = GradingItem(
+        id=0,
+        user_id=0,
+        question_id=0,
+        question="Что такое load average? Что показывает эта метрика? Почему load average состоит из трёх значений?",
+        freq_score=9,
+        answer_text="а" * SAMPLE_ANSWER_CHARS,
+    )
+    return len(pack_batches([sample] * max_items, token_budget, max_items)[0])
+
+
+class AnswerGrader:
+    """
+    Ночная пакетная оценка ответов, на которые пользователь не запросил фидбек.
+    
+    Несколько ответов оцениваются одним запросом к ИИ. Размер пакета ограничен
+    бюджетом контекста моделей и max_items; если ответ пакета не удалось разобрать,
+    пакет делится пополам и оценивается заново. Ответы, для которых фидбек не
+    получен, остаются без фидбека до следующего запуска. Ошибка самого ИИ
+    (недоступен, исчерпана квота) останавливает запуск.
+    """
+    
+    def __init__(
+        self,
+        sessionmaker: async_sessionmaker[AsyncSession],
+        ai: AIInterface,
+        max_items: int = 20,
+        max_answers: Optional[int] = None,
+    ):
+        self.sessionmaker = sessionmaker
+        self.ai = ai
+        self.max_items = max(1, max_items)
+        self.max_answers = max_answers
+        self.models = grading_models(ai)
+        self.token_budget = int(ai.context_budget(self.models) * CONTEXT_BUDGET_SHARE)
+        self.stats = {"total": 0, "graded": 0, "failed": 0, "calls": 0}
+        self._stopped = False
+    
+    async def run(self) -> Dict[str, int]:
+        """
+        Оценивает все ответы без фидбека (не больше max_answers за запуск).
+        
+        Returns:
+            Счетчики total/graded/failed/calls
+        """
+        logger.info(
+            f"Grading ungraded answers with {', '.join(self.models or self.ai.models)} "
+            f"(batch up to {self.max_items} answers, {self.token_budget} tokens)"
+        )
+        sample_size = sample_batch_size(self.token_budget, self.max_items)
+        if sample_size < min(2, self.max_items):
+            logger.warning(
+                f"Grading budget of {self.token_budget} tokens fits {sample_size} typical answer per batch, "
+                "check context_tokens/tpm in models.json"
+            )
+        after_id = 0
+        while not self._stopped and (self.max_answers is None or self.stats["total"] < self.max_answers):
+            limit = FETCH_PAGE_SIZE
+            if self.max_answers is not None:
+                limit = min(limit, self.max_answers - self.stats["total"])
+            
+            async with self.sessionmaker() as session:
+                rows = await get_ungraded_answers(session, limit, after_id)
+                items = await self._load_items(session, rows)
+            if not rows:
+                break
+            after_id = rows[-1].id
+            self.stats["total"] += len(rows)
+            self.stats["failed"] += len(rows) - len(items)
+            
+            for batch in pack_batches(items, self.token_budget, self.max_items):
+                if self._stopped:
+                    break
+                await self._grade(batch)
+        
+        if self.stats["calls"]:
+            metrics.set_gauge("grading_answers_per_call", self.stats["graded"] / self.stats["calls"])
+        logger.info(
+            f"Grading finished: graded {self.stats['graded']}, failed {self.stats['failed']} "
+            f"of {self.stats['total']} in {self.stats['calls']} AI calls"
+        )
+        return self.stats
+    
+    async def _load_items(self, session: AsyncSession, rows: list) -> List[GradingItem]:
+        items = []
+        for row in rows:
+            question = await question_catalog.get_question(session, row.question_id)
+            if question is None or not row.answer_text:
+                continue
+            items.append(GradingItem(
+                id=row.id,
+                user_id=row.user_id,
+                question_id=row.question_id,
+                question=question.question,
+                freq_score=question.freq_score,
+                answer_text=row.answer_text,
+            ))
+        return items
+    
+    async def _grade(self, batch: List[GradingItem]) -> None:
+        """Оценивает пакет; при неразборчивом ответе делит его пополам."""
+        ids = [item.id for item in batch]
+        self.stats["calls"] += 1
+        metrics.incr("grading_ai_calls")
+        try:
+            text = await self.ai.agenerate_text(create_grading_prompt(batch), PRIORITY_BACKGROUND, models=self.models)
+            results = parse_grading_response(text, ids)
+        except ValueError as e:
+            if len(batch) == 1:
+                logger.warning(f"Failed to grade answer {batch[0].id}: {e}")
+                self.stats["failed"] += 1
+                return
+            metrics.incr("grading_batch_splits")
+            logger.warning(f"Failed to parse grading of {len(batch)} answers ({e}), splitting the batch")
+            middle = len(batch) // 2
+            await self._grade(batch[:middle])
+            await self._grade(batch[middle:])
+            return
+        except Exception as e:
+            # ИИ недоступен или квота исчерпана - остальное оценим в следующий раз
+            logger.error(f"Failed to grade {len(batch)} answers, stopping: {e}")
+            self.stats["failed"] += len(batch)
+            self._stopped = True
+            return
+        
+        async with self.sessionmaker() as session, session.begin():
+            for item in batch:
+                feedback = results.get(item.id)
+                if feedback is not None:
+                    await save_feedback(session, item.user_id, item.question_id, feedback, only_missing=True)
+        
+        self.stats["graded"] += len(results)
+        self.stats["failed"] += len(batch) - len(results)
+        metrics.incr("grading_answers_graded", len(results))
+
+
+async def grade_ungraded_answers(
+    sessionmaker: async_sessionmaker[AsyncSession],
+    ai: Optional[AIInterface],
+    max_items: int = 20,
+    max_answers: Optional[int] = None,
+) -> Dict[str, int]:
+    """
+    Оценивает ответы без фидбека пакетами.
+    
+    Returns:
+        Счетчики total/graded/failed/calls
+    
+    Raises:
+        ValueError: Если API ключ не настроен
+    """
+    if ai is None:
+        raise ValueError("GEMINI_API_KEY not found. Please set GEMINI_API_KEY environment variable.")
+    return await AnswerGrader(sessionmaker, ai, max_items, max_answers).run()
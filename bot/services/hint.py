@@ -1,7 +1,68 @@
-import asyncio
+import hashlib
+from typing import Any, Awaitable, Callable, Optional, Tuple
 from bot.utils.ai_interface import AIInterface
+from bot.utils.deadline import within_deadline
+from bot.utils.quota import PRIORITY_HINT, PRIORITY_FEEDBACK
+from bot.utils.singleflight import SingleFlight
 from bot.logging import logger
 
+# Версия промпта подсказки: увеличить при изменении create_hint_prompt,
+# чтобы кэш подсказок не отдавал ответы на старый промпт
+HINT_PROMPT_VERSION = 1
+# Версия промпта фидбека: увеличить при изменении create_feedback_prompt
+FEEDBACK_PROMPT_VERSION = 1
+
+
+def _require_ai(ai: Optional[AIInterface]) -> AIInterface:
+    """Проверяет, что общий AI клиент создан при старте (есть API ключ)."""
+    if ai is None:
+        raise ValueError("GEMINI_API_KEY not found. Please set GEMINI_API_KEY environment variable.")
+    return ai
+
+
+# Одинаковые одновременные запросы (двойное нажатие, одна подсказка для нескольких
+# пользователей) делят один вызов ИИ
+ai_singleflight = SingleFlight("ai_singleflight")
+
+
+async def _generate(ai: AIInterface, prompt: str, priority: int, user_key: Optional[Any]) -> Tuple[str, str]:
+    """
+    Вызывает ИИ через single-flight по хешу промпта, возвращает (текст, модель).
+    
+    Хеш считается от промпта как есть: sha256_hash приводит текст к нижнему регистру,
+    и фидбек на ответы, различающиеся только регистром, достался бы чужому ответу.
+    
+    Общий вызов идет без дедлайна апдейта, а ожидание каждого вызывающего прерывается
+    по его дедлайну (DeadlineExceeded); вызов отменяется, когда ушли все ожидающие.
+    """
+    async with within_deadline():
+        return await ai_singleflight.do(
+            hashlib.sha256(prompt.encode('utf-8')).hexdigest(),
+            lambda: ai.agenerate_text_with_model(prompt, priority, user_key),
+        )
+
+
+async def _stream(
+    ai: AIInterface,
+    prompt: str,
+    priority: int,
+    user_key: Optional[Any],
+    on_text: Callable[[str], Awaitable[None]],
+) -> Tuple[str, str]:
+    """
+    Читает ответ ИИ потоком и передает в on_text накопленный текст, возвращает (текст, модель).
+    
+    Потоки не идут через single-flight: у каждого свой получатель. Чтение потока
+    прерывается по дедлайну апдейта (DeadlineExceeded).
+    """
+    text = ""
+    model = ai.model_name
+    async with within_deadline():
+        async for delta, model in ai.astream_text_with_model(prompt, priority, user_key):
+            text += delta
+            await on_text(text)
+    return text, model
+
 
 def create_hint_prompt(question: str, freq_score: int) -> str:
     """
@@ -33,35 +94,83 @@ def create_hint_prompt(question: str, freq_score: int) -> str:
     return prompt
 
 
-async def generate_hint(question: str, freq_score: int) -> str:
+async def generate_hint(
+    ai: Optional[AIInterface],
+    question: str,
+    freq_score: int,
+    user_key: Optional[Any] = None,
+) -> str:
     """
     Генерирует подсказку для вопроса с помощью ИИ.
     
     Args:
+        ai: Общий AI клиент (None, если API ключ не настроен)
         question: Текст вопроса
         freq_score: Частота вопроса
+        user_key: Для кого запрос (честная очередь квоты между пользователями)
         
     Returns:
         Текст подсказки
+    
+    Raises:
+        ValueError: Если API ключ не настроен
     """
+    ai = _require_ai(ai)
     try:
-        # Создаем AIInterface в отдельном потоке, так как он синхронный
-        loop = asyncio.get_event_loop()
-        ai = await loop.run_in_executor(
-            None,
-            lambda: AIInterface(retry_attempts=2, retry_delay=1.0)
-        )
-        
-        prompt = create_hint_prompt(question, freq_score)
-        
-        # Выполняем генерацию в отдельном потоке
-        hint = await loop.run_in_executor(None, ai.generate_text, prompt)
-        return hint.strip()
+        hint, _ = await request_hint(ai, question, freq_score, user_key)
+        return hint
     except Exception as e:
         logger.error(f"Error generating hint: {e}")
         return "❌ Не удалось сгенерировать подсказку. Попробуй позже."
 
 
+async def request_hint(
+    ai: Optional[AIInterface],
+    question: str,
+    freq_score: int,
+    user_key: Optional[Any] = None,
+    priority: int = PRIORITY_HINT,
+) -> Tuple[str, str]:
+    """
+    Запрашивает подсказку у ИИ без подмены ошибок текстом (для кэша подсказок).
+    
+    Returns:
+        (текст подсказки, модель)
+    
+    Raises:
+        ValueError: Если API ключ не настроен
+        RuntimeError: Если ИИ не ответил
+    """
+    ai = _require_ai(ai)
+    prompt = create_hint_prompt(question, freq_score)
+    hint, model = await _generate(ai, prompt, priority, user_key)
+    return hint.strip(), model
+
+
+async def stream_hint(
+    ai: Optional[AIInterface],
+    question: str,
+    freq_score: int,
+    on_text: Callable[[str], Awaitable[None]],
+    user_key: Optional[Any] = None,
+    priority: int = PRIORITY_HINT,
+) -> Tuple[str, str]:
+    """
+    Как request_hint, но передает в on_text накопленный текст по мере генерации.
+    
+    Returns:
+        (текст подсказки, модель)
+    
+    Raises:
+        ValueError: Если API ключ не настроен
+        RuntimeError: Если ИИ не ответил
+    """
+    ai = _require_ai(ai)
+    prompt = create_hint_prompt(question, freq_score)
+    hint, model = await _stream(ai, prompt, priority, user_key, on_text)
+    return hint.strip(), model
+
+
 def create_feedback_prompt(question: str, user_answer: str, freq_score: int) -> str:
     """
     Создает промпт для генерации фидбека на ответ пользователя.
@@ -101,32 +210,75 @@ def create_feedback_prompt(question: str, user_answer: str, freq_score: int) ->
     return prompt
 
 
-async def generate_feedback(question: str, user_answer: str, freq_score: int) -> str:
+async def generate_feedback(
+    ai: Optional[AIInterface],
+    question: str,
+    user_answer: str,
+    freq_score: int,
+    user_key: Optional[Any] = None,
+) -> str:
     """
     Генерирует фидбек на ответ пользователя с помощью ИИ.
     
     Args:
+        ai: Общий AI клиент (None, если API ключ не настроен)
         question: Текст вопроса
         user_answer: Ответ пользователя
         freq_score: Частота вопроса
+        user_key: Для кого запрос (честная очередь квоты между пользователями)
         
     Returns:
         Текст фидбека
+    
+    Raises:
+        ValueError: Если API ключ не настроен
     """
+    ai = _require_ai(ai)
     try:
-        # Создаем AIInterface в отдельном потоке, так как он синхронный
-        loop = asyncio.get_event_loop()
-        ai = await loop.run_in_executor(
-            None,
-            lambda: AIInterface(retry_attempts=2, retry_delay=1.0)
-        )
-        
-        prompt = create_feedback_prompt(question, user_answer, freq_score)
-        
-        # Выполняем генерацию в отдельном потоке
-        feedback = await loop.run_in_executor(None, ai.generate_text, prompt)
-        return feedback.strip()
+        return await request_feedback(ai, question, user_answer, freq_score, user_key)
     except Exception as e:
         logger.error(f"Error generating feedback: {e}")
         return "❌ Не удалось сгенерировать фидбек. Попробуй позже."
 
+
+async def request_feedback(
+    ai: Optional[AIInterface],
+    question: str,
+    user_answer: str,
+    freq_score: int,
+    user_key: Optional[Any] = None,
+    priority: int = PRIORITY_FEEDBACK,
+) -> str:
+    """
+    Запрашивает фидбек у ИИ без подмены ошибок текстом (для фоновых задач с повторами).
+    
+    Raises:
+        ValueError: Если API ключ не настроен
+        RuntimeError: Если ИИ не ответил
+    """
+    ai = _require_ai(ai)
+    prompt = create_feedback_prompt(question, user_answer, freq_score)
+    feedback, _ = await _generate(ai, prompt, priority, user_key)
+    return feedback.strip()
+
+
+async def stream_feedback(
+    ai: Optional[AIInterface],
+    question: str,
+    user_answer: str,
+    freq_score: int,
+    on_text: Callable[[str], Awaitable[None]],
+    user_key: Optional[Any] = None,
+    priority: int = PRIORITY_FEEDBACK,
+) -> str:
+    """
+    Как request_feedback, но передает в on_text накопленный текст по мере генерации.
+    
+    Raises:
+        ValueError: Если API ключ не настроен
+        RuntimeError: Если ИИ не ответил
+    """
+    ai = _require_ai(ai)
+    prompt = create_feedback_prompt(question, user_answer, freq_score)
+    feedback, _ = await _stream(ai, prompt, priority, user_key, on_text)
+    return feedback.strip()
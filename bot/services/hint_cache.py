@@ -0,0 +1,149 @@
+import asyncio
+from typing import Any, Dict, Optional
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from bot.db.dao import get_cached_hint, save_cached_hint, get_questions_without_cached_hint
+from bot.services.catalog import CatalogQuestion
+from bot.services.hint import HINT_PROMPT_VERSION, request_hint, stream_hint
+from bot.services.streaming import StreamingMessage
+from bot.utils.ai_interface import AIInterface
+from bot.utils.lru import LRUCache
+from bot.utils.metrics import metrics
+from bot.utils.quota import PRIORITY_BACKGROUND
+from bot.logging import logger
+
+# LRU перед таблицей hint_cache: ключ (question_hash, prompt_version)
+hint_lru = LRUCache(maxsize=2048)
+
+
+async def get_cached_hint_text(session: AsyncSession, question_hash: str) -> Optional[str]:
+    """
+    Ищет подсказку сначала в памяти, затем в таблице hint_cache.
+    
+    Подходит подсказка любой модели: модель выбирает роутер, и подсказка
+    запасной модели не хуже повторной генерации.
+    """
+    key = (question_hash, HINT_PROMPT_VERSION)
+    hint = hint_lru.get(key)
+    if hint is not None:
+        metrics.incr("hint_cache_hit_memory")
+        return hint
+    
+    hint = await get_cached_hint(session, question_hash, HINT_PROMPT_VERSION)
+    if hint is not None:
+        metrics.incr("hint_cache_hit_db")
+        hint_lru.set(key, hint)
+    return hint
+
+
+async def get_or_generate_hint(
+    session: AsyncSession,
+    ai: Optional[AIInterface],
+    question: CatalogQuestion,
+    user_key: Optional[Any] = None,
+) -> str:
+    """
+    Возвращает подсказку из кэша, а при промахе генерирует ее и сохраняет в кэш.
+    
+    Перед обращением к ИИ текущая транзакция сессии коммитится, чтобы соединение
+    не было занято на время генерации; запись в кэш идет в новой транзакции.
+    
+    Raises:
+        ValueError: Если API ключ не настроен
+        RuntimeError: Если ИИ не ответил
+    """
+    hint = await get_cached_hint_text(session, question.question_hash)
+    if hint is not None:
+        return hint
+    
+    metrics.incr("hint_cache_miss")
+    await session.commit()
+    hint, model = await request_hint(ai, question.question, question.freq_score, user_key)
+    await save_cached_hint(session, question.question_hash, HINT_PROMPT_VERSION, model, hint)
+    hint_lru.set((question.question_hash, HINT_PROMPT_VERSION), hint)
+    return hint
+
+
+async def get_or_stream_hint(
+    session: AsyncSession,
+    ai: Optional[AIInterface],
+    question: CatalogQuestion,
+    streamer: StreamingMessage,
+    user_key: Optional[Any] = None,
+) -> str:
+    """
+    Как get_or_generate_hint, но при промахе кэша показывает подсказку в streamer
+    по мере генерации. При попадании в кэш streamer не трогается.
+    
+    Raises:
+        ValueError: Если API ключ не настроен
+        RuntimeError: Если ИИ не ответил
+    """
+    hint = await get_cached_hint_text(session, question.question_hash)
+    if hint is not None:
+        return hint
+    
+    metrics.incr("hint_cache_miss")
+    await session.commit()
+    await streamer.start()
+    hint, model = await stream_hint(ai, question.question, question.freq_score, streamer.update, user_key)
+    await save_cached_hint(session, question.question_hash, HINT_PROMPT_VERSION, model, hint)
+    hint_lru.set((question.question_hash, HINT_PROMPT_VERSION), hint)
+    return hint
+
+
+async def pregenerate_hints(
+    sessionmaker: async_sessionmaker[AsyncSession],
+    ai: Optional[AIInterface],
+    concurrency: int = 2,
+) -> Dict[str, int]:
+    """
+    Генерирует подсказки для всех вопросов каталога, которых еще нет в кэше.
+    
+    Каждая подсказка сохраняется в своей транзакции, поэтому после сбоя
+    повторный запуск продолжает с оставшихся вопросов.
+    
+    Returns:
+        Счетчики generated/failed/total
+    
+    Raises:
+        ValueError: Если API ключ не настроен
+    """
+    if ai is None:
+        raise ValueError("GEMINI_API_KEY not found. Please set GEMINI_API_KEY environment variable.")
+    
+    async with sessionmaker() as session:
+        questions = [
+            CatalogQuestion.from_model(q)
+            for q in await get_questions_without_cached_hint(session, HINT_PROMPT_VERSION)
+        ]
+    
+    stats = {"total": len(questions), "generated": 0, "failed": 0}
+    logger.info(f"Pregenerating hints for {stats['total']} questions (concurrency={concurrency})")
+    
+    # concurrency воркеров разбирают общий итератор: корутин столько же, сколько воркеров
+    remaining = iter(questions)
+    
+    async def worker() -> None:
+        for question in remaining:
+            try:
+                hint, model = await request_hint(
+                    ai,
+                    question.question,
+                    question.freq_score,
+                    priority=PRIORITY_BACKGROUND,
+                )
+                async with sessionmaker() as session, session.begin():
+                    await save_cached_hint(session, question.question_hash, HINT_PROMPT_VERSION, model, hint)
+                hint_lru.set((question.question_hash, HINT_PROMPT_VERSION), hint)
+                stats["generated"] += 1
+            except Exception as e:
+                stats["failed"] += 1
+                logger.warning(f"Failed to pregenerate hint for question {question.id}: {e}")
+    
+    await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+    
+    logger.info(
+        f"Hint pregeneration finished: generated {stats['generated']}, "
+        f"failed {stats['failed']} of {stats['total']}"
+    )
+    return stats
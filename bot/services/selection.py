@@ -1,19 +1,16 @@
 from sqlalchemy.ext.asyncio import AsyncSession
-from bot.db.dao import select_next_questions
+from bot.db.dao import select_next_questions, select_next_questions_bulk
+from bot.services.answered import answered_bitsets, pick_questions
+from bot.services.catalog import question_catalog
 from bot.config import Config
 
 
-async def select_questions_for_user(
-    session: AsyncSession,
-    user_id: int,
-    config: Config,
-) -> list:
+def _split_counts(config: Config) -> tuple[int, int, int]:
     """
-    Выбирает вопросы для пользователя по правилам:
+    Возвращает (high_n, low_n, total_n):
     - 4 вопроса с freq_score > threshold
     - 1 вопрос с freq_score <= threshold
     - Всего config.questions_per_day вопросов
-    - При нехватке добирает из другой категории
     """
     high_n = 4
     low_n = 1
@@ -25,6 +22,34 @@ async def select_questions_for_user(
         high_n = int(total_n * 0.8)  # ~80% high
         low_n = total_n - high_n
     
+    return high_n, low_n, total_n
+
+
+def _use_memory_engine(config: Config) -> bool:
+    """In-memory движок включается конфигом и требует загруженного каталога."""
+    return config.selection_engine == "memory" and question_catalog.loaded
+
+
+async def select_questions_for_user(
+    session: AsyncSession,
+    user_id: int,
+    config: Config,
+) -> list:
+    """
+    Выбирает вопросы для пользователя по правилам:
+    - 4 вопроса с freq_score > threshold
+    - 1 вопрос с freq_score <= threshold
+    - Всего config.questions_per_day вопросов
+    - При нехватке добирает из другой категории
+    """
+    high_n, low_n, total_n = _split_counts(config)
+    
+    if _use_memory_engine(config):
+        answered = await answered_bitsets.get(session, user_id)
+        return pick_questions(
+            question_catalog.ordered, answered, high_n, low_n, total_n, config.high_score_threshold
+        )
+    
     questions = await select_next_questions(
         session=session,
         user_id=user_id,
@@ -36,3 +61,35 @@ async def select_questions_for_user(
     
     return questions
 
+
+async def select_questions_for_users(
+    session: AsyncSession,
+    user_ids: list[int],
+    config: Config,
+) -> dict[int, list]:
+    """
+    Выбирает вопросы для пачки пользователей по тем же правилам, что select_questions_for_user,
+    одним запросом к БД. Возвращает словарь user_id -> список вопросов.
+    """
+    high_n, low_n, total_n = _split_counts(config)
+    
+    if _use_memory_engine(config):
+        await answered_bitsets.hydrate(session, user_ids)
+        selections = {}
+        for user_id in user_ids:
+            answered = await answered_bitsets.get(session, user_id)
+            questions = pick_questions(
+                question_catalog.ordered, answered, high_n, low_n, total_n, config.high_score_threshold
+            )
+            if questions:
+                selections[user_id] = questions
+        return selections
+    
+    return await select_next_questions_bulk(
+        session=session,
+        user_ids=user_ids,
+        high_n=high_n,
+        low_n=low_n,
+        total_n=total_n,
+        threshold=config.high_score_threshold,
+    )
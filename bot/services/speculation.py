@@ -0,0 +1,168 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Optional, Tuple
+from bot.config import Config
+from bot.services.hint import request_feedback
+from bot.utils.ai_interface import AIInterface
+from bot.utils.deadline import detached_context, within_deadline
+from bot.utils.hashing import sha256_hash
+from bot.utils.metrics import metrics
+from bot.logging import logger
+
+# Готовый, но не востребованный результат хранится не дольше этого времени
+SPECULATION_TTL_SECONDS = 1800
+
+
+class _Speculation:
+    __slots__ = ("answer_hash", "task", "started_at")
+    
+    def __init__(self, answer_hash: str, task: asyncio.Task):
+        self.answer_hash = answer_hash
+        self.task = task
+        self.started_at = time.monotonic()
+
+
+class FeedbackSpeculator:
+    """
+    Спекулятивная генерация фидбека: запрос к ИИ стартует сразу после сохранения ответа,
+    не дожидаясь нажатия "Да".
+    
+    Результат привязан к (tg_user_id, question_id) и хешу текста ответа. "Нет" и
+    "Изменить ответ" отменяют задачу, новый ответ на тот же вопрос заменяет ее.
+    Расход квоты ограничен: не больше per_user задач на пользователя (лишние вытесняют
+    самую старую), не больше max_inflight одновременных запросов и не больше
+    hourly_budget запусков за скользящий час.
+    """
+    
+    def __init__(self, per_user: int = 1, max_inflight: int = 10, hourly_budget: int = 200):
+        self.per_user = per_user
+        self.max_inflight = max_inflight
+        self.hourly_budget = hourly_budget
+        self._items: "OrderedDict[Tuple[int, int], _Speculation]" = OrderedDict()
+        self._started: Deque[float] = deque()
+    
+    def configure(self, config: Config) -> None:
+        self.per_user = max(1, config.speculative_feedback_per_user)
+        self.max_inflight = max(0, config.speculative_feedback_max_inflight)
+        self.hourly_budget = max(0, config.speculative_feedback_hourly_budget)
+    
+    @property
+    def inflight(self) -> int:
+        return sum(1 for item in self._items.values() if not item.task.done())
+    
+    def start(
+        self,
+        ai: AIInterface,
+        tg_user_id: int,
+        question_id: int,
+        question: str,
+        answer_text: str,
+        freq_score: int,
+    ) -> bool:
+        """
+        Запускает генерацию фидбека в фоне, если позволяют лимиты.
+        
+        Returns:
+            True если задача запущена
+        """
+        self._expire()
+        key = (tg_user_id, question_id)
+        self.cancel(tg_user_id, question_id)
+        
+        if not self._within_budget():
+            metrics.incr("speculative_feedback_skipped_budget")
+            return False
+        
+        # Лимит на пользователя: вытесняем самые старые спекуляции этого пользователя
+        user_keys = [k for k in self._items if k[0] == tg_user_id]
+        for old_key in user_keys[:max(0, len(user_keys) - self.per_user + 1)]:
+            self._drop(old_key, "speculative_feedback_evicted")
+        
+        task = asyncio.create_task(
+            request_feedback(ai, question, answer_text, freq_score, tg_user_id),
+            name=f"speculative_feedback_{tg_user_id}_{question_id}",
+            # Фидбек ждет нажатия "Да" дольше, чем живет апдейт с ответом
+            context=detached_context(),
+        )
+        task.add_done_callback(self._on_done)
+        self._items[key] = _Speculation(sha256_hash(answer_text), task)
+        self._started.append(time.monotonic())
+        metrics.incr("speculative_feedback_started")
+        return True
+    
+    def take(self, tg_user_id: int, question_id: int, answer_text: str) -> Optional[asyncio.Task]:
+        """
+        Забирает задачу для ответа пользователя.
+        
+        Returns:
+            Задачу (готовую или еще выполняющуюся) или None, если спекуляции не было
+            или она считалась для другого текста ответа
+        """
+        item = self._items.pop((tg_user_id, question_id), None)
+        if item is None:
+            metrics.incr("speculative_feedback_miss")
+            return None
+        
+        if item.answer_hash != sha256_hash(answer_text):
+            item.task.cancel()
+            metrics.incr("speculative_feedback_stale")
+            return None
+        
+        metrics.incr("speculative_feedback_hit" if item.task.done() else "speculative_feedback_joined")
+        return item.task
+    
+    def cancel(self, tg_user_id: int, question_id: int) -> None:
+        """Отменяет спекуляцию (пользователь отказался от фидбека или меняет ответ)."""
+        self._drop((tg_user_id, question_id), "speculative_feedback_cancelled")
+    
+    @staticmethod
+    async def result(task: asyncio.Task) -> Optional[str]:
+        """
+        Ждет задачу и возвращает фидбек или None, если генерация не удалась.
+        
+        Ожидание прерывается по дедлайну апдейта (DeadlineExceeded).
+        """
+        async with within_deadline():
+            try:
+                return await task
+            except asyncio.CancelledError:
+                # Отменили саму задачу (пользователь изменил ответ) - фидбека нет;
+                # отмену ожидающего (дедлайн, остановка бота) пробрасываем
+                if not task.cancelled() or asyncio.current_task().cancelling():
+                    raise
+                return None
+            except Exception as e:
+                logger.warning(f"Speculative feedback failed: {e}")
+                return None
+    
+    def _drop(self, key: Tuple[int, int], metric: str) -> None:
+        item = self._items.pop(key, None)
+        if item is None:
+            return
+        if not item.task.done():
+            item.task.cancel()
+        elif not item.task.cancelled() and item.task.exception() is None:
+            # Квота уже потрачена, а результат не понадобился
+            metrics.incr("speculative_feedback_wasted")
+        metrics.incr(metric)
+    
+    def _within_budget(self) -> bool:
+        now = time.monotonic()
+        while self._started and now - self._started[0] > 3600:
+            self._started.popleft()
+        return self.inflight < self.max_inflight and len(self._started) < self.hourly_budget
+    
+    def _expire(self) -> None:
+        now = time.monotonic()
+        for key in [k for k, item in self._items.items() if now - item.started_at > SPECULATION_TTL_SECONDS]:
+            self._drop(key, "speculative_feedback_expired")
+    
+    @staticmethod
+    def _on_done(task: asyncio.Task) -> None:
+        # Забираем исключение, чтобы asyncio не писал "Task exception was never retrieved"
+        if not task.cancelled():
+            task.exception()
+
+
+feedback_speculator = FeedbackSpeculator()
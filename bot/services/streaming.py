@@ -0,0 +1,111 @@
+import asyncio
+from typing import Callable, Optional
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.types import InlineKeyboardMarkup, Message
+from bot.utils.metrics import metrics
+from bot.logging import logger
+
+PLACEHOLDER_TEXT = "⏳ Генерирую..."
+
+
+class StreamingMessage:
+    """
+    Сообщение, которое дописывается по мере генерации ответа ИИ.
+    
+    start() сразу отправляет заглушку, update() показывает накопленный текст, но
+    редактирует сообщение не чаще раза в interval секунд (лимиты Telegram на
+    редактирование), finish() выводит окончательный текст. render превращает сырой
+    накопленный текст в MarkdownV2 и должен давать валидную разметку для любого
+    префикса ответа.
+    """
+    
+    def __init__(self, bot: Bot, chat_id: int, render: Callable[[str], str], interval: float = 1.0):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.render = render
+        self.interval = interval
+        self.message: Optional[Message] = None
+        self._shown: Optional[str] = None
+        self._started_at = 0.0
+        self._next_edit = 0.0
+    
+    async def start(self) -> None:
+        """Отправляет заглушку, которую затем заменит текст ответа."""
+        if self.message is not None:
+            return
+        self.message = await self.bot.send_message(self.chat_id, PLACEHOLDER_TEXT)
+        self._started_at = asyncio.get_running_loop().time()
+        metrics.incr("ai_streams_started")
+    
+    async def update(self, text: str) -> None:
+        """Показывает накопленный текст, если с прошлого редактирования прошло достаточно времени."""
+        if self.message is None:
+            await self.start()
+        if asyncio.get_running_loop().time() < self._next_edit:
+            return
+        
+        first = self._shown is None
+        await self._edit(self.render(text))
+        if first and self._shown is not None:
+            first_content = asyncio.get_running_loop().time() - self._started_at
+            metrics.set_gauge("ai_stream_first_content_seconds", first_content)
+    
+    async def finish(self, rendered: str, reply_markup: Optional[InlineKeyboardMarkup] = None) -> None:
+        """
+        Выводит окончательный текст (уже в MarkdownV2).
+        
+        Если заглушка не отправлялась (например, ответ взят из кэша), отправляет новое сообщение.
+        """
+        if self.message is None:
+            await self.bot.send_message(self.chat_id, rendered, parse_mode="MarkdownV2", reply_markup=reply_markup)
+            return
+        await self._edit(rendered, reply_markup, final=True)
+    
+    async def abort(self) -> None:
+        """Удаляет заглушку или недописанный ответ после ошибки генерации."""
+        if self.message is None:
+            return
+        try:
+            await self.bot.delete_message(self.chat_id, self.message.message_id)
+        except Exception as e:
+            logger.warning(f"Failed to delete streaming message in chat {self.chat_id}: {e}")
+        self.message = None
+    
+    async def _edit(
+        self,
+        rendered: str,
+        reply_markup: Optional[InlineKeyboardMarkup] = None,
+        final: bool = False,
+    ) -> None:
+        loop = asyncio.get_running_loop()
+        if rendered == self._shown and reply_markup is None:
+            return
+        
+        try:
+            await self.bot.edit_message_text(
+                rendered,
+                chat_id=self.chat_id,
+                message_id=self.message.message_id,
+                parse_mode="MarkdownV2",
+                reply_markup=reply_markup,
+            )
+        except TelegramRetryAfter as e:
+            metrics.incr("ai_stream_edit_throttled")
+            if not final:
+                self._next_edit = loop.time() + e.retry_after
+                return
+            # Окончательный текст должен дойти: ждем, сколько просит Telegram
+            await asyncio.sleep(e.retry_after)
+            await self._edit(rendered, reply_markup, final=True)
+            return
+        except TelegramBadRequest as e:
+            if "message is not modified" in str(e):
+                return
+            if final:
+                raise
+            logger.warning(f"Failed to update streaming message in chat {self.chat_id}: {e}")
+        else:
+            self._shown = rendered
+            metrics.incr("ai_stream_edits")
+        self._next_edit = loop.time() + self.interval
@@ -0,0 +1,130 @@
+from typing import Dict, Optional, Tuple
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, SessionTransaction
+from bot.config import Config
+from bot.db.dao import USER_STATE_WRITES, get_or_create_user, get_user_context
+from bot.utils.lru import LRUCache
+from bot.utils.metrics import metrics
+
+# Страховка от расхождения с БД (запись в обход DAO, другой процесс): состояние
+# перечитывается не реже, чем раз в столько секунд
+STATE_TTL_SECONDS = 600
+
+
+class UserContext:
+    """Что handlers нужно о пользователе: id в БД, ожидаемый ответ и очередь вопросов."""
+    __slots__ = ("user_id", "awaiting_question_id", "pending_question_ids")
+    
+    def __init__(self, user_id: int, awaiting_question_id: Optional[int], pending_question_ids: Tuple[int, ...]):
+        self.user_id = user_id
+        self.awaiting_question_id = awaiting_question_id
+        self.pending_question_ids = pending_question_ids
+
+
+class UserContextCache:
+    """
+    Контекст пользователей в памяти: tg_user_id -> UserContext.
+    
+    Соответствие tg_user_id -> users.id не меняется и хранится в LRU без срока жизни.
+    Состояние из user_state обновляется write-through: функции DAO записывают новые
+    значения в session.info, после коммита они применяются к кэшу, после отката
+    отбрасываются. Обновляются только пользователи, которые уже есть в памяти, поэтому
+    ежедневная рассылка не вытесняет активных пользователей.
+    
+    Загрузка из БД, во время которой закоммитили изменение того же пользователя,
+    не кэшируется (она могла прочитать старое значение).
+    """
+    
+    def __init__(self, max_users: int = 100_000, ttl_seconds: float = STATE_TTL_SECONDS):
+        self._user_ids = LRUCache(maxsize=max_users)
+        self._states = LRUCache(maxsize=max_users, ttl=ttl_seconds)
+        # Номер последнего примененного коммита и коммиты, случившиеся во время загрузок
+        self._write_seq = 0
+        self._loads = 0
+        self._written_during_loads: Dict[int, int] = {}
+    
+    def configure(self, config: Config) -> None:
+        self._user_ids.maxsize = max(1, config.user_context_cache_size)
+        self._states.maxsize = max(1, config.user_context_cache_size)
+    
+    def __len__(self) -> int:
+        return len(self._states)
+    
+    async def get(self, session: AsyncSession, tg_user_id: int) -> UserContext:
+        """Возвращает контекст пользователя (создает пользователя, если его нет)."""
+        user_id = self._user_ids.get(tg_user_id)
+        if user_id is not None:
+            state = self._states.get(user_id)
+            if state is not None:
+                metrics.incr("user_context_hit")
+                return UserContext(user_id, *state)
+        
+        metrics.incr("user_context_miss")
+        return await self._load(session, tg_user_id)
+    
+    async def get_user_id(self, session: AsyncSession, tg_user_id: int) -> int:
+        """Возвращает users.id (создает пользователя, если его нет)."""
+        user_id = self._user_ids.get(tg_user_id)
+        if user_id is not None:
+            return user_id
+        return (await self.get(session, tg_user_id)).user_id
+    
+    async def _load(self, session: AsyncSession, tg_user_id: int) -> UserContext:
+        started_at = self._write_seq
+        self._loads += 1
+        try:
+            row = await get_user_context(session, tg_user_id)
+            written_at = self._written_during_loads.get(row.user_id, 0) if row is not None else 0
+        finally:
+            self._loads -= 1
+            if self._loads == 0:
+                self._written_during_loads.clear()
+        
+        if row is None:
+            # Новый пользователь еще не закоммичен: в кэш попадет при следующем обращении
+            user = await get_or_create_user(session, tg_user_id)
+            return UserContext(user.id, None, ())
+        
+        user_id, awaiting, pending = row
+        state = (awaiting, tuple(pending or ()))
+        self._user_ids.set(tg_user_id, user_id)
+        if written_at <= started_at:
+            self._states.set(user_id, state)
+        return UserContext(user_id, *state)
+    
+    def apply(self, writes: Dict[int, tuple]) -> None:
+        """Применяет закоммиченные изменения user_state {user_id: (awaiting, pending)}."""
+        for user_id, (awaiting, pending) in writes.items():
+            self._write_seq += 1
+            if self._loads:
+                self._written_during_loads[user_id] = self._write_seq
+            if self._states.get(user_id) is not None:
+                self._states.set(user_id, (awaiting, tuple(pending or ())))
+    
+    def invalidate(self, user_id: int) -> None:
+        """Забывает состояние пользователя: следующее обращение перечитает его из БД."""
+        self._write_seq += 1
+        if self._loads:
+            self._written_during_loads[user_id] = self._write_seq
+        self._states.pop(user_id)
+    
+    def clear(self) -> None:
+        self._states.clear()
+
+
+user_contexts = UserContextCache()
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_committed_user_state(session: Session) -> None:
+    writes = session.info.pop(USER_STATE_WRITES, None)
+    if writes:
+        user_contexts.apply(writes)
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _discard_user_state(session: Session, transaction: SessionTransaction) -> None:
+    # После коммита записи уже применены; здесь остаются только откатанные
+    if transaction.parent is None:
+        session.info.pop(USER_STATE_WRITES, None)
@@ -1,37 +1,94 @@
 import os
 import json
 import time
-from typing import Optional, Dict, Any, List
+import asyncio
+import concurrent.futures
+from collections import deque
+from typing import Optional, Dict, Any, AsyncIterator, Deque, List, Sequence, Tuple
 from pathlib import Path
 from dotenv import load_dotenv
 from google import genai
+from bot.utils import deadline
+from bot.utils.executor import BoundedExecutor
+from bot.utils.metrics import metrics
+from bot.utils.model_router import ModelRouter
+from bot.utils.quota import QuotaScheduler, TokenBucket, PRIORITY_BACKGROUND, estimate_tokens
 
 
 class AIInterface:
-    def __init__(self, retry_attempts: int = 2, retry_delay: float = 1.0, models_file: str = "models.json"):
+    def __init__(
+        self,
+        retry_attempts: int = 2,
+        retry_delay: float = 1.0,
+        models_file: str = "models.json",
+        api_key: Optional[str] = None,
+        api_keys: Optional[List[str]] = None,
+        use_async: bool = True,
+        executor_workers: int = 4,
+        hedge_percentile: Optional[float] = None,
+        hedge_max_ratio: float = 0.1,
+        hedge_min_delay: float = 1.0,
+        base_url: Optional[str] = None,
+        request_timeout: Optional[float] = 60.0,
+    ):
         """
-        Initialize AI Interface with Gemini API
+        Initialize AI Interface with Gemini API.
+        
+        The instance is meant to be created once at startup and shared: it keeps
+        one Gemini client (and HTTP connection pool) per API key and the health
+        and quota state of every (key, model) pair used to route requests.
         
         Args:
             retry_attempts: number of retry attempts
             retry_delay: delay between retries in seconds
             models_file: path to JSON file with available models
+            api_key: Gemini API key (defaults to GEMINI_API_KEY env var)
+            api_keys: several Gemini API keys (defaults to comma-separated GEMINI_API_KEYS
+                env var); requests are balanced across all (key, model) pairs
+            use_async: use the SDK's native asyncio client in agenerate_text;
+                otherwise run the blocking client in a dedicated executor
+            executor_workers: size of the dedicated executor for blocking calls
+            hedge_percentile: if set (e.g. 95), an async request that takes longer than
+                this percentile of the model's observed latency is duplicated to the
+                next best model and the first answer wins
+            hedge_max_ratio: maximum share of recent requests that may be hedged
+            hedge_min_delay: never hedge earlier than this many seconds
+            base_url: Gemini API endpoint (defaults to GEMINI_BASE_URL env var, e.g. a local
+                scripts/fake_gemini.py server for load tests)
+            request_timeout: HTTP timeout of a single API call in seconds (None - SDK default);
+                inside a Telegram update it is further shortened to the update's deadline
         """
         load_dotenv()
         
         self.retry_attempts = retry_attempts
         self.retry_delay = retry_delay
+        self.use_async = use_async
+        self.request_timeout = request_timeout
+        
+        # Hedging settings and the window of recent requests for the hedge budget
+        self.hedge_percentile = hedge_percentile
+        self.hedge_max_ratio = hedge_max_ratio
+        self.hedge_min_delay = hedge_min_delay
+        self._hedge_window: Deque[bool] = deque(maxlen=200)
+        
+        # Dedicated pool for blocking calls instead of the loop's shared default executor
+        self.executor = BoundedExecutor(executor_workers, "ai_executor")
         
         # Initialize Gemini
-        self.gemini_api_key = os.getenv("GEMINI_API_KEY")
-        if not self.gemini_api_key:
+        keys = api_keys or ([api_key] if api_key else self._keys_from_env())
+        if not keys:
             raise ValueError("GEMINI_API_KEY not found. Please set GEMINI_API_KEY environment variable.")
+        self.gemini_api_key = keys[0]
         
-        # Set API key as environment variable for genai.Client()
-        os.environ["GOOGLE_API_KEY"] = self.gemini_api_key
-        
-        # Initialize Gemini client (API key is read from GOOGLE_API_KEY env var)
-        self.gemini_client = genai.Client()
+        # One client per key with an explicit key (no process-wide env mutation).
+        # Keys are referred to as key1, key2, ... so they never end up in logs
+        self.base_url = base_url or os.getenv("GEMINI_BASE_URL") or None
+        http_options = {"base_url": self.base_url} if self.base_url else None
+        self.clients: Dict[str, genai.Client] = {
+            f"key{i + 1}": genai.Client(api_key=key, http_options=http_options) for i, key in enumerate(keys)
+        }
+        self.gemini_client = self.clients["key1"]
+        self.evicted_keys: Dict[str, genai.Client] = {}
         
         # Load available models from JSON file
         self.models = self._load_models(models_file)
@@ -39,11 +96,38 @@ class AIInterface:
             # Fallback to default model if no models file found
             self.models = ['gemini-2.5-flash-lite']
         
+        # Every key has its own quota, so each (key, model) pair is a separate target
+        targets = [(key_id, model) for model in self.models for key_id in self.clients]
+        
+        # Queues requests in front of per-target RPM/TPM limits instead of hitting 429
+        self.quota = QuotaScheduler({
+            target: self.model_limits[target[1]] for target in targets if target[1] in self.model_limits
+        })
+        
+        # Routes each request to the fastest healthy target (EWMA latency, errors, 429s, circuit breaker)
+        self.router = ModelRouter(targets)
+        
+        # Last model used, for logs and status
         self.current_model_index = 0
         self.model_name = self.models[self.current_model_index]
+    
+    @staticmethod
+    def _keys_from_env() -> List[str]:
+        """Read GEMINI_API_KEYS (comma-separated), falling back to GEMINI_API_KEY"""
+        keys = [key.strip() for key in os.getenv("GEMINI_API_KEYS", "").split(",") if key.strip()]
+        if not keys and os.getenv("GEMINI_API_KEY"):
+            keys = [os.getenv("GEMINI_API_KEY")]
+        return keys
 
     def _load_models(self, models_file: str) -> List[str]:
-        """Load available models from JSON file"""
+        """
+        Load available models from JSON file.
+        
+        Each entry is either a model name or an object with optional limits:
+        {"name": "gemini-2.5-flash", "rpm": 10, "tpm": 250000, "context_tokens": 1048576}.
+        Limits are stored in self.model_limits.
+        """
+        self.model_limits: Dict[str, Dict[str, Optional[float]]] = {}
         try:
             # Try to find models.json in the project root
             project_root = Path(__file__).parent.parent.parent
@@ -56,7 +140,18 @@ class AIInterface:
             if models_path.exists():
                 with open(models_path, 'r', encoding='utf-8') as f:
                     data = json.load(f)
-                    models = data.get('models', [])
+                    models = []
+                    for entry in data.get('models', []):
+                        if isinstance(entry, str):
+                            models.append(entry)
+                            continue
+                        name = entry['name']
+                        models.append(name)
+                        self.model_limits[name] = {
+                            "rpm": entry.get("rpm"),
+                            "tpm": entry.get("tpm"),
+                            "context_tokens": entry.get("context_tokens"),
+                        }
                     if models:
                         print(f"Loaded {len(models)} models from {models_path}")
                         return models
@@ -67,6 +162,34 @@ class AIInterface:
             print(f"Error loading models file: {e}")
             return []
     
+    def request_budget(self, model: str) -> Optional[int]:
+        """
+        Token budget of a single request (prompt plus answer) to the model: its context
+        window, capped by the burst of its per-minute token limit (a larger request
+        would wait for a full token bucket and leave it in debt). None if the model has no limits.
+        """
+        limits = self.model_limits.get(model, {})
+        budgets = [
+            value
+            for value in (
+                limits.get("context_tokens"),
+                TokenBucket.capacity_for(limits["tpm"]) if limits.get("tpm") else None,
+            )
+            if value
+        ]
+        return int(min(budgets)) if budgets else None
+    
+    def context_budget(self, models: Optional[Sequence[str]] = None, default: int = 32768) -> int:
+        """Token budget of a single request that every model (or every one of models) accepts"""
+        budgets = [budget for budget in map(self.request_budget, models or self.models) if budget]
+        return min(budgets) if budgets else default
+    
+    def _excluded_targets(self, models: Optional[Sequence[str]]) -> Tuple[Tuple[str, str], ...]:
+        """Targets a request restricted to models must not be routed to"""
+        if not models:
+            return ()
+        return tuple(target for target in self.router.targets if target[1] not in models)
+    
     def _is_rate_limit_error(self, error: Exception) -> bool:
         """Check if error is a rate limit/quota exceeded error"""
         error_str = str(error).lower()
@@ -88,83 +211,578 @@ class AIInterface:
         
         return any(indicator in error_str or indicator in error_type for indicator in rate_limit_indicators)
     
-    def _switch_to_next_model(self):
-        """Switch to the next available model"""
-        if len(self.models) <= 1:
-            return False
+    def _is_auth_error(self, error: Exception) -> bool:
+        """Check if error means the API key itself is invalid"""
+        error_str = str(error).lower()
+        auth_indicators = [
+            'api key not valid',
+            'api_key_invalid',
+            'invalid api key',
+            'api key expired',
+            'unauthenticated',
+            '401',
+        ]
+        return any(indicator in error_str for indicator in auth_indicators)
         
-        self.current_model_index = (self.current_model_index + 1) % len(self.models)
-        self.model_name = self.models[self.current_model_index]
-        print(f"Switched to model: {self.model_name}")
-        return True
+    def _choose_target(self, exclude: Tuple[Tuple[str, str], ...] = (), tokens: int = 0) -> Optional[Tuple[str, str]]:
+        """Pick the best (key, model) for the next request: health plus expected quota wait"""
+        target = self.router.choose(exclude, penalty=lambda t: self.quota.estimated_wait(t, tokens))
+        if target is not None:
+            self.model_name = target[1]
+            self.current_model_index = self.models.index(target[1])
+        return target
+    
+    def _record_result(self, target: Tuple[str, str], started: float, error: Optional[Exception] = None) -> None:
+        """Feed the outcome of a call into the router, evicting keys that fail authentication"""
+        if error is None:
+            self.router.record_success(target, time.monotonic() - started)
+        elif self._is_auth_error(error):
+            self._evict_key(target[0])
+        else:
+            self.router.record_failure(target, rate_limited=self._is_rate_limit_error(error))
+    
+    def _evict_key(self, key_id: str) -> None:
+        """Stop routing requests to a key rejected by the API"""
+        client = self.clients.pop(key_id, None)
+        if client is None:
+            return
+        self.evicted_keys[key_id] = client
+        for model in self.models:
+            self.router.remove_target((key_id, model))
+        metrics.incr("ai_keys_evicted")
+        print(f"API key {key_id} rejected by Gemini, evicted ({len(self.clients)} keys left)")
     
-    def _try_gemini(self, prompt: str, switch_on_rate_limit: bool = True) -> Optional[str]:
+    def _acquire_quota_blocking(
+        self,
+        target: Tuple[str, str],
+        tokens: int,
+        priority: int,
+        user_key: Optional[Any],
+        loop: Optional[asyncio.AbstractEventLoop],
+        timeout: Optional[float],
+    ) -> None:
+        """
+        Wait for the target's quota from a worker thread: the scheduler lives on the
+        bot's event loop, so the acquire runs there and the thread blocks on it.
+        Without a loop (a plain synchronous call, no bot running) there is nothing to share the quota with.
+        """
+        if loop is None:
+            return
+        future = asyncio.run_coroutine_threadsafe(self.quota.acquire(target, tokens, priority, user_key), loop)
+        try:
+            future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise TimeoutError(f"No quota for {target[1]} ({target[0]}) within {timeout:.1f}s")
+    
+    def _try_gemini(
+        self,
+        prompt: str,
+        switch_on_rate_limit: bool = True,
+        exclude: Tuple[Tuple[str, str], ...] = (),
+        timeout: Optional[float] = None,
+        priority: int = PRIORITY_BACKGROUND,
+        user_key: Optional[Any] = None,
+        loop: Optional[asyncio.AbstractEventLoop] = None,
+        quota_timeout: Optional[float] = None,
+    ) -> Optional[str]:
         """Try to generate text using Gemini API"""
+        tokens = estimate_tokens(prompt)
+        target = self._choose_target(exclude, tokens)
+        if target is None:
+            return None
+        key_id, model_name = target
+        
+        waited = time.monotonic()
+        try:
+            self._acquire_quota_blocking(target, tokens, priority, user_key, loop, quota_timeout)
+        except BaseException:
+            self.router.release(target)
+            raise
+        if timeout is not None and quota_timeout is not None:
+            # The quota wait comes out of the same time budget as the HTTP call
+            timeout = max(min(timeout, quota_timeout - (time.monotonic() - waited)), 0.001)
+        
+        started = time.monotonic()
         try:
             # Используем правильный API для генерации контента
-            interaction = self.gemini_client.interactions.create(
-                model=self.model_name,
-                input=prompt
+            interaction = self.clients[key_id].interactions.create(
+                model=model_name,
+                input=prompt,
+                timeout=timeout,
             )
-            return interaction.outputs[-1].text
+            self._record_result(target, started)
+            return self._interaction_text(interaction)
         except Exception as e:
-            error_msg = str(e)
-            print(f"Gemini API error with model {self.model_name}: {error_msg}")
-            
-            # If it's a rate limit error and we have other models, switch
-            if switch_on_rate_limit and self._is_rate_limit_error(e):
-                if self._switch_to_next_model():
-                    # Retry with new model
-                    print(f"Retrying with model: {self.model_name}")
-                    try:
-                        interaction = self.gemini_client.interactions.create(
-                            model=self.model_name,
-                            input=prompt
-                        )
-                        return interaction.outputs[-1].text
-                    except Exception as retry_error:
-                        print(f"Retry with {self.model_name} also failed: {retry_error}")
+            self._record_result(target, started, e)
+            print(f"Gemini API error with model {model_name} ({key_id}): {e}")
+            
+            # If it's a rate limit or auth error, retry once with the next best key/model
+            retryable = self._is_rate_limit_error(e) or self._is_auth_error(e)
+            if switch_on_rate_limit and retryable and len(self.router.targets) > len(exclude) + 1:
+                print("Retrying with another model")
+                return self._try_gemini(
+                    prompt,
+                    switch_on_rate_limit=False,
+                    exclude=exclude + (target,),
+                    timeout=timeout,
+                    priority=priority,
+                    user_key=user_key,
+                    loop=loop,
+                    quota_timeout=quota_timeout,
+                )
             
             return None
 
-    def generate_text(self, prompt: str) -> str:
+    async def _call_model_async(
+        self,
+        target: Tuple[str, str],
+        prompt: str,
+        priority: int = PRIORITY_BACKGROUND,
+        user_key: Optional[Any] = None,
+        quota_acquired: bool = False,
+    ) -> str:
+        """
+        Single async call to one (key, model), outcome is recorded in the router.
+        quota_acquired - the caller has already waited for the target's quota.
+        """
+        key_id, model_name = target
+        # Wait for the target's quota first, so the router sees the model's latency, not the queue
+        if not quota_acquired:
+            await self.quota.acquire(target, estimate_tokens(prompt), priority, user_key)
+        client = self.clients.get(key_id)
+        if client is None:
+            raise RuntimeError(f"API key {key_id} was evicted")
+        
+        started = time.monotonic()
+        try:
+            interaction = await client.aio.interactions.create(
+                model=model_name,
+                input=prompt,
+                timeout=self._request_timeout(),
+            )
+        except asyncio.CancelledError:
+            self.router.release(target)
+            raise
+        except Exception as e:
+            self._record_result(target, started, e)
+            raise
+        self._record_result(target, started)
+        return self._interaction_text(interaction)
+    
+    def _hedge_delay(self, target: Tuple[str, str]) -> Optional[float]:
+        """How long to wait for the primary target before hedging, None if hedging is off"""
+        if self.hedge_percentile is None or len(self.router.targets) < 2:
+            return None
+        delay = self.router.latency_percentile(target, self.hedge_percentile)
+        if delay is None:
+            return None
+        return max(delay, self.hedge_min_delay)
+    
+    def _take_hedge_budget(self) -> bool:
+        """
+        Allow a hedge only while hedges stay under hedge_max_ratio of recent requests.
+        With no hedge in the window (e.g. right after a restart) one hedge is allowed:
+        otherwise the first slow requests could never hedge.
+        """
+        hedges = sum(self._hedge_window)
+        if hedges == 0:
+            return self.hedge_max_ratio > 0
+        return hedges < self.hedge_max_ratio * len(self._hedge_window)
+    
+    async def _hedged_call(
+        self,
+        target: Tuple[str, str],
+        prompt: str,
+        tried: List[Tuple[str, str]],
+        priority: int = PRIORITY_BACKGROUND,
+        user_key: Optional[Any] = None,
+    ) -> Tuple[str, str]:
+        """
+        Call the primary target; if it is slower than its usual latency percentile,
+        send the same prompt to the next best target and take whichever answers first.
+        """
+        tried.append(target)
+        # The hedge timer starts only once the primary is dispatched: time spent in the
+        # client-side quota queue is not model latency and must not fire a hedge
+        try:
+            await self.quota.acquire(target, estimate_tokens(prompt), priority, user_key)
+        except BaseException:
+            self.router.release(target)
+            raise
+        primary = asyncio.ensure_future(
+            self._call_model_async(target, prompt, priority, user_key, quota_acquired=True)
+        )
+        tasks = {primary: target}
+        hedged = False
+        try:
+            delay = self._hedge_delay(target)
+            if delay is not None:
+                done, _ = await asyncio.wait({primary}, timeout=delay)
+                if not done and self._take_hedge_budget():
+                    hedge_target = self._choose_target(tuple(tried), estimate_tokens(prompt))
+                    if hedge_target is not None:
+                        print(f"Model {target[1]} is slower than {delay:.1f}s, hedging with {hedge_target[1]}")
+                        tried.append(hedge_target)
+                        hedge = self._call_model_async(hedge_target, prompt, priority, user_key)
+                        tasks[asyncio.ensure_future(hedge)] = hedge_target
+                        hedged = True
+                        metrics.incr("ai_hedges_fired")
+            
+            pending = set(tasks)
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            metrics.incr("ai_hedge_wins")
+                        self.model_name = tasks[task][1]
+                        return task.result(), tasks[task][1]
+                    error = task.exception()
+            raise error
+        finally:
+            self._hedge_window.append(hedged)
+            # Cancel the loser (or everything, if the caller was cancelled)
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+    
+    async def _try_gemini_async(
+        self,
+        prompt: str,
+        switch_on_rate_limit: bool = True,
+        exclude: Tuple[Tuple[str, str], ...] = (),
+        priority: int = PRIORITY_BACKGROUND,
+        user_key: Optional[Any] = None,
+    ) -> Optional[Tuple[str, str]]:
+        """Try to generate text using the SDK's native asyncio client, returns (text, model)"""
+        target = self._choose_target(exclude, estimate_tokens(prompt))
+        if target is None:
+            return None
+        
+        tried: List[Tuple[str, str]] = list(exclude)
+        try:
+            return await self._hedged_call(target, prompt, tried, priority, user_key)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Gemini API error with model {target[1]} ({target[0]}): {e}")
+            
+            # If it's a rate limit or auth error, retry once with the next best key/model
+            retryable = self._is_rate_limit_error(e) or self._is_auth_error(e)
+            if switch_on_rate_limit and retryable and len(self.router.targets) > len(tried):
+                print("Retrying with another model")
+                return await self._try_gemini_async(
+                    prompt,
+                    switch_on_rate_limit=False,
+                    exclude=tuple(tried),
+                    priority=priority,
+                    user_key=user_key,
+                )
+            
+            return None
+    
+    def generate_text(
+        self,
+        prompt: str,
+        timeout: Optional[float] = None,
+        models: Optional[Sequence[str]] = None,
+        priority: int = PRIORITY_BACKGROUND,
+        user_key: Optional[Any] = None,
+        loop: Optional[asyncio.AbstractEventLoop] = None,
+    ) -> str:
         """
         Generate text using Gemini API with retries
         
         Args:
             prompt: The text prompt to send to the AI
+            timeout: overall time budget in seconds; every HTTP call and retry
+                delay is cut to what is left of it (None - request_timeout per call)
+            models: route the request only to these models (None - any model)
+            priority: quota priority, as in agenerate_text
+            user_key: who the request is for, as in agenerate_text
+            loop: the bot's event loop when called from the executor: every attempt
+                waits for its target's quota there, like the async path does
             
         Returns:
             Generated text from Gemini API
             
         Raises:
             RuntimeError: If Gemini API fails after all retry attempts
+            TimeoutError: If the time budget ran out
         """
-        if not self.gemini_api_key:
+        if not self.clients:
             raise RuntimeError("Gemini API is not available. Please set GEMINI_API_KEY environment variable.")
         
+        budget_end = time.monotonic() + timeout if timeout is not None else None
+        exclude = self._excluded_targets(models)
+        
+        def remaining() -> Optional[float]:
+            if budget_end is None:
+                return None
+            left = budget_end - time.monotonic()
+            if left <= 0:
+                raise TimeoutError(f"Gemini API did not answer within {timeout:.1f}s")
+            return left
+        
+        def left() -> Optional[float]:
+            left = remaining()
+            if left is None:
+                return self.request_timeout
+            return left if self.request_timeout is None else min(left, self.request_timeout)
+        
         # Try with retries
         for attempt in range(self.retry_attempts):
             print(f"Trying Gemini (attempt {attempt + 1}/{self.retry_attempts})")
             
-            result = self._try_gemini(prompt)
+            result = self._try_gemini(
+                prompt,
+                exclude=exclude,
+                timeout=left(),
+                priority=priority,
+                user_key=user_key,
+                loop=loop,
+                quota_timeout=remaining(),
+            )
             if result is not None:
                 print(f"Successfully generated text using Gemini")
                 return result
             
             if attempt < self.retry_attempts - 1:  # Don't sleep after last attempt
-                time.sleep(self.retry_delay)
+                time.sleep(min(self.retry_delay, left() or self.retry_delay))
         
         # If we get here, all attempts failed
         raise RuntimeError(f"Gemini API failed after {self.retry_attempts} attempts.")
 
+    async def agenerate_text(
+        self,
+        prompt: str,
+        priority: int = PRIORITY_BACKGROUND,
+        user_key: Optional[Any] = None,
+        models: Optional[Sequence[str]] = None,
+    ) -> str:
+        """
+        Async version of generate_text: does not block the event loop and
+        backs off with asyncio.sleep between attempts.
+        
+        Args:
+            prompt: The text prompt to send to the AI
+            priority: quota priority (PRIORITY_HINT / PRIORITY_FEEDBACK / PRIORITY_BACKGROUND)
+            user_key: who the request is for; queued requests are shared fairly between users
+            models: route the request only to these models (None - any model)
+        
+        Raises:
+            RuntimeError: If Gemini API fails after all retry attempts
+        """
+        text, _ = await self.agenerate_text_with_model(prompt, priority, user_key, models)
+        return text
+    
+    async def agenerate_text_with_model(
+        self,
+        prompt: str,
+        priority: int = PRIORITY_BACKGROUND,
+        user_key: Optional[Any] = None,
+        models: Optional[Sequence[str]] = None,
+    ) -> Tuple[str, str]:
+        """
+        Same as agenerate_text, but also returns the name of the model that answered.
+        
+        Returns:
+            (generated text, model name)
+        """
+        # Inside a Telegram update the whole call, retries included, is cut at the
+        # update's deadline: the pending HTTP request is cancelled, not left hanging
+        async with deadline.within_deadline():
+            if not self.use_async:
+                # A thread cannot be cancelled: the blocking call gets what is left of the
+                # deadline as its budget (without a deadline - request_timeout per HTTP call)
+                text = await self.executor.run(
+                    self.generate_text,
+                    prompt,
+                    deadline.remaining(),
+                    models,
+                    priority,
+                    user_key,
+                    asyncio.get_running_loop(),
+                )
+                return text, self.model_name
+        
+            for attempt in range(self.retry_attempts):
+                print(f"Trying Gemini async (attempt {attempt + 1}/{self.retry_attempts})")
+            
+                result = await self._try_gemini_async(
+                    prompt,
+                    exclude=self._excluded_targets(models),
+                    priority=priority,
+                    user_key=user_key,
+                )
+                if result is not None:
+                    return result
+            
+                if attempt < self.retry_attempts - 1:  # Don't sleep after last attempt
+                    await asyncio.sleep(self.retry_delay)
+        
+        raise RuntimeError(f"Gemini API failed after {self.retry_attempts} attempts.")
+    
+    async def astream_text(
+        self,
+        prompt: str,
+        priority: int = PRIORITY_BACKGROUND,
+        user_key: Optional[Any] = None,
+    ) -> AsyncIterator[str]:
+        """
+        Stream generated text as it arrives, yielding text deltas.
+        
+        Raises:
+            RuntimeError: If Gemini API fails after all retry attempts
+        """
+        async for delta, _ in self.astream_text_with_model(prompt, priority, user_key):
+            yield delta
+    
+    async def astream_text_with_model(
+        self,
+        prompt: str,
+        priority: int = PRIORITY_BACKGROUND,
+        user_key: Optional[Any] = None,
+    ) -> AsyncIterator[Tuple[str, str]]:
+        """
+        Same as astream_text, but yields (text delta, model name).
+        
+        A target that fails before the first delta is retried on the next best one.
+        A failure in the middle of the answer is raised: the caller has already
+        shown part of the text. Streams are not hedged. In blocking mode
+        (use_async=False) the whole answer comes as a single delta.
+        The update's deadline only shortens HTTP timeouts here; the caller bounds
+        the whole read with deadline.within_deadline().
+        """
+        if not self.use_async:
+            text = await self.executor.run(
+                self.generate_text,
+                prompt,
+                deadline.remaining(),
+                None,
+                priority,
+                user_key,
+                asyncio.get_running_loop(),
+            )
+            yield text, self.model_name
+            return
+        
+        tokens = estimate_tokens(prompt)
+        tried: List[Tuple[str, str]] = []
+        for attempt in range(self.retry_attempts):
+            target = self._choose_target(tuple(tried), tokens)
+            if target is None:
+                # Every target has been tried: start over from the best one
+                tried = []
+                target = self._choose_target((), tokens)
+            if target is None:
+                break
+            tried.append(target)
+            key_id, model_name = target
+            print(f"Trying Gemini stream with model {model_name} ({key_id}) (attempt {attempt + 1}/{self.retry_attempts})")
+            
+            started = time.monotonic()
+            streamed = False
+            try:
+                await self.quota.acquire(target, tokens, priority, user_key)
+                client = self.clients.get(key_id)
+                if client is None:
+                    raise RuntimeError(f"API key {key_id} was evicted")
+                
+                started = time.monotonic()
+                stream = await client.aio.interactions.create(
+                    model=model_name,
+                    input=prompt,
+                    stream=True,
+                    timeout=self._request_timeout(),
+                )
+                async with stream:
+                    async for event in stream:
+                        delta = self._stream_delta(event)
+                        if delta:
+                            streamed = True
+                            yield delta, model_name
+            except (asyncio.CancelledError, GeneratorExit):
+                # The caller stopped reading: no verdict on the model
+                self.router.release(target)
+                raise
+            except Exception as e:
+                self._record_result(target, started, e)
+                print(f"Gemini stream error with model {model_name} ({key_id}): {e}")
+                if streamed:
+                    raise
+                if attempt < self.retry_attempts - 1:  # Don't sleep after last attempt
+                    await asyncio.sleep(self.retry_delay)
+                continue
+            
+            self._record_result(target, started)
+            self.model_name = model_name
+            return
+        
+        raise RuntimeError(f"Gemini API failed after {self.retry_attempts} attempts.")
+    
+    def _request_timeout(self) -> Optional[float]:
+        """HTTP timeout for one async call: request_timeout, cut to the update's deadline"""
+        left = deadline.remaining()
+        if left is None:
+            return self.request_timeout
+        left = max(left, 0.001)
+        return left if self.request_timeout is None else min(left, self.request_timeout)
+    
+    @staticmethod
+    def _interaction_text(interaction: Any) -> str:
+        """Text of a finished interaction (output_text in current SDKs, outputs in older ones)"""
+        text = getattr(interaction, "output_text", None)
+        if text is None:
+            text = interaction.outputs[-1].text
+        return text
+    
+    @staticmethod
+    def _stream_delta(event: Any) -> str:
+        """Text carried by one streaming event, empty for other event types"""
+        event_type = getattr(event, "event_type", None)
+        if event_type == "error":
+            error = getattr(event, "error", None)
+            raise RuntimeError(getattr(error, "message", None) or "Gemini stream failed")
+        if event_type == "step.delta":
+            delta = getattr(event, "delta", None)
+            if getattr(delta, "type", None) == "text":
+                return delta.text or ""
+        return ""
+    
+    def close(self) -> None:
+        """Close the underlying HTTP clients and the executor"""
+        self.executor.shutdown()
+        for client in [*self.clients.values(), *self.evicted_keys.values()]:
+            client.close()
+    
+    async def aclose(self) -> None:
+        """Close both the async and sync HTTP clients"""
+        for client in [*self.clients.values(), *self.evicted_keys.values()]:
+            await client.aio.aclose()
+        self.close()
+    
     def get_status(self) -> Dict[str, Any]:
         """Get the status of available providers"""
         return {
-            "gemini_available": self.gemini_api_key is not None,
+            "gemini_available": bool(self.clients),
+            "api_keys": list(self.clients),
+            "evicted_keys": list(self.evicted_keys),
             "retry_attempts": self.retry_attempts,
             "retry_delay": self.retry_delay,
             "current_model": self.model_name,
             "available_models": self.models,
-            "current_model_index": self.current_model_index
+            "current_model_index": self.current_model_index,
+            "model_health": self.router.snapshot(),
+            "model_limits": self.model_limits,
+            "quota_queue_depth": self.quota.queue_depths(),
+            "hedge_percentile": self.hedge_percentile,
+            "hedge_ratio": sum(self._hedge_window) / len(self._hedge_window) if self._hedge_window else 0.0,
+            "use_async": self.use_async,
+            "base_url": self.base_url,
+            "request_timeout": self.request_timeout,
+            "executor_workers": self.executor.max_workers,
+            "executor_queue_depth": self.executor.queue_depth,
         }
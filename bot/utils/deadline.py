@@ -0,0 +1,92 @@
+import asyncio
+import contextvars
+import math
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Iterator, Optional
+from bot.utils.metrics import metrics
+
+# Время после дедлайна, оставленное handler на ответ пользователю ("попробуй позже")
+# и на освобождение ресурсов; после него обработка апдейта прерывается принудительно
+GRACE_SECONDS = 5.0
+
+# Момент (время цикла событий), к которому должна закончиться обработка текущего апдейта.
+# Задача asyncio получает копию контекста, поэтому фоновые задачи, запущенные из handler,
+# наследовали бы дедлайн апдейта - их нужно запускать в detached_context()
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("deadline", default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    """Бюджет времени на обработку апдейта исчерпан."""
+
+
+def remaining() -> Optional[float]:
+    """Сколько секунд осталось до дедлайна (может быть отрицательным); None, если дедлайна нет."""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - asyncio.get_running_loop().time()
+
+
+def telegram_timeout() -> Optional[int]:
+    """request_timeout для запроса к Telegram: до дедлайна с учетом GRACE_SECONDS, None - по умолчанию aiogram."""
+    left = remaining()
+    if left is None:
+        return None
+    return max(1, math.ceil(left + GRACE_SECONDS))
+
+
+@contextmanager
+def deadline_after(seconds: Optional[float]) -> Iterator[Optional[float]]:
+    """
+    Устанавливает дедлайн через seconds секунд (None - без изменений).
+    
+    Вложенный дедлайн не может быть позже внешнего. Возвращает действующий дедлайн.
+    """
+    current = _deadline.get()
+    if seconds is None:
+        yield current
+        return
+    
+    deadline = asyncio.get_running_loop().time() + seconds
+    if current is not None:
+        deadline = min(deadline, current)
+    token = _deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _deadline.reset(token)
+
+
+@asynccontextmanager
+async def within_deadline() -> AsyncIterator[None]:
+    """
+    Прерывает блок по дедлайну текущего апдейта: ожидание внутри отменяется
+    (вместе с HTTP запросом), наружу выходит DeadlineExceeded. Без дедлайна ничего не делает.
+    
+    Не оборачивать в него yield асинхронного генератора: отмена попадет в код потребителя.
+    """
+    deadline = _deadline.get()
+    if deadline is None:
+        yield
+        return
+    
+    if asyncio.get_running_loop().time() >= deadline:
+        metrics.incr("deadline_exceeded")
+        raise DeadlineExceeded("Update deadline exceeded")
+    
+    timeout = asyncio.timeout_at(deadline)
+    try:
+        async with timeout:
+            yield
+    except TimeoutError:
+        if not timeout.expired():
+            raise
+        metrics.incr("deadline_exceeded")
+        raise DeadlineExceeded("Update deadline exceeded") from None
+
+
+def detached_context() -> contextvars.Context:
+    """Копия текущего контекста без дедлайна - для asyncio.create_task(..., context=...) фоновых задач."""
+    context = contextvars.copy_context()
+    context.run(_deadline.set, None)
+    return context
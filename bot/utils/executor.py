@@ -0,0 +1,62 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+from bot.utils.metrics import metrics
+
+
+class BoundedExecutor:
+    """
+    Отдельный пул потоков для блокирующих вызовов.
+    
+    В отличие от стандартного executor цикла событий (run_in_executor(None, ...)),
+    размер задается явно и пул не делится с остальным кодом, поэтому всплеск
+    блокирующих вызовов не останавливает чужие задачи. Глубина очереди
+    публикуется в metrics как <name>_queue_depth.
+    """
+    
+    def __init__(self, max_workers: int, name: str):
+        self.name = name
+        self.max_workers = max(1, max_workers)
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+    
+    @property
+    def queue_depth(self) -> int:
+        """Сколько вызовов ждут свободного потока."""
+        return self._queued
+    
+    @property
+    def running(self) -> int:
+        return self._running
+    
+    def _update(self, queued: int = 0, running: int = 0) -> None:
+        with self._lock:
+            self._queued += queued
+            self._running += running
+            metrics.set_gauge(f"{self.name}_queue_depth", self._queued)
+            metrics.set_gauge(f"{self.name}_running", self._running)
+    
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """Выполняет блокирующую функцию в пуле и ждет результат."""
+        def call():
+            self._update(queued=-1, running=1)
+            try:
+                return fn(*args)
+            finally:
+                self._update(running=-1)
+        
+        self._update(queued=1)
+        future = self._pool.submit(call)
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            # Если вызов еще не начался, убираем его из очереди
+            if future.cancel():
+                self._update(queued=-1)
+            raise
+    
+    def shutdown(self, wait: bool = False) -> None:
+        self._pool.shutdown(wait=wait, cancel_futures=True)
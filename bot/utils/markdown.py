@@ -0,0 +1,144 @@
+import re
+from typing import Callable
+
+# Максимальная длина текста сообщения Telegram
+MESSAGE_LIMIT = 4096
+
+
+def escape_markdown_v2(text: str) -> str:
+    """
+    Экранирует специальные символы MarkdownV2 для безопасной вставки в сообщения Telegram.
+    
+    Args:
+        text: Текст для экранирования
+    
+    Returns:
+        Экранированный текст
+    """
+    # ВАЖНО: Сначала экранируем обратный слэш, чтобы не экранировать уже экранированные символы
+    text = text.replace('\\', '\\\\')
+    
+    # Затем экранируем остальные специальные символы MarkdownV2
+    # Список всех зарезервированных символов в MarkdownV2
+    special_chars = ['_', '*', '[', ']', '(', ')', '~', '`', '>', '#', '+', '-', '=', '{', '}', '.', '!', '|']
+    for char in special_chars:
+        text = text.replace(char, f'\\{char}')
+    
+    return text
+
+
+def format_hint_with_spoiler(hint_text: str) -> str:
+    """
+    Форматирует подсказку с правильным spoiler для MarkdownV2.
+    Ищет эталонный ответ между || || или ||текст|| и правильно форматирует его.
+    
+    Args:
+        hint_text: Текст подсказки от ИИ
+    
+    Returns:
+        Отформатированный текст с правильным spoiler
+    """
+    # Ищем паттерн || текст || или ||текст|| (с возможными пробелами)
+    # Используем нежадный поиск, чтобы найти первый spoiler
+    pattern = r'\|\|\s*(.*?)\s*\|\|'
+    
+    def escape_spoiler_content(text: str) -> str:
+        """Экранирует все специальные символы MarkdownV2 внутри spoiler"""
+        # Внутри spoiler нужно экранировать ВСЕ специальные символы MarkdownV2, включая точку
+        # ВАЖНО: Сначала экранируем обратный слэш
+        text = text.replace('\\', '\\\\')
+        # Затем экранируем все остальные специальные символы MarkdownV2
+        # Включая точку, которая является зарезервированным символом
+        special_chars = ['_', '*', '[', ']', '(', ')', '~', '`', '>', '#', '+', '-', '=', '{', '}', '.', '!', '|']
+        for char in special_chars:
+            text = text.replace(char, f'\\{char}')
+        return text
+    
+    # Находим все spoiler блоки
+    parts = []
+    last_end = 0
+    
+    for match in re.finditer(pattern, hint_text, flags=re.DOTALL):
+        # Добавляем текст до spoiler (подсказка)
+        if match.start() > last_end:
+            hint_part = hint_text[last_end:match.start()].strip()
+            if hint_part:
+                # Экранируем подсказку для MarkdownV2
+                escaped_hint = escape_markdown_v2(hint_part)
+                parts.append(escaped_hint)
+        
+        # Обрабатываем spoiler (эталонный ответ)
+        spoiler_text = match.group(1)
+        escaped_spoiler = escape_spoiler_content(spoiler_text)
+        parts.append(f'||{escaped_spoiler}||')
+        
+        last_end = match.end()
+    
+    # Добавляем оставшийся текст после последнего spoiler
+    if last_end < len(hint_text):
+        remaining = hint_text[last_end:].strip()
+        if remaining:
+            escaped_remaining = escape_markdown_v2(remaining)
+            parts.append(escaped_remaining)
+    
+    # Если spoiler не найден, просто экранируем весь текст
+    if not parts:
+        return escape_markdown_v2(hint_text)
+    
+    return '\n\n'.join(parts)
+
+
+def close_partial_spoiler(hint_text: str) -> str:
+    """
+    Дописывает недогенерированную подсказку так, чтобы разметка spoiler была валидной.
+    
+    Одиночный | в конце может оказаться началом ||, поэтому отбрасывается.
+    Незакрытый || закрывается, а если после него еще нет текста - убирается.
+    """
+    if hint_text.endswith("|") and not hint_text.endswith("||"):
+        hint_text = hint_text[:-1]
+    if hint_text.count("||") % 2:
+        start = hint_text.rfind("||")
+        if hint_text[start + 2:].strip():
+            hint_text = hint_text.rstrip() + "||"
+        else:
+            hint_text = hint_text[:start]
+    return hint_text
+
+
+def fit_message(text: str, render: Callable[[str], str], limit: int = MESSAGE_LIMIT) -> str:
+    """
+    Рендерит текст в MarkdownV2 и укладывает результат в лимит длины сообщения.
+    
+    Укорачивается исходный текст, а не готовая разметка: обрезка разметки может
+    разорвать экранирование или spoiler.
+    """
+    rendered = render(text)
+    while len(rendered) > limit and text:
+        # Экранирование не более чем удваивает длину, так что хватает нескольких итераций
+        overflow = len(rendered) - limit
+        text = text[:max(0, len(text) - overflow // 2 - 1)].rstrip("|")
+        rendered = render(text + "…")
+    return rendered
+
+
+def format_hint_message(hint_text: str, partial: bool = False) -> str:
+    """
+    Собирает сообщение с подсказкой в MarkdownV2: заголовок и текст со spoiler.
+    
+    partial=True - подсказка еще генерируется, незакрытый spoiler закрывается.
+    """
+    header = escape_markdown_v2("Подсказка:")
+    
+    def render(text: str) -> str:
+        if partial:
+            text = close_partial_spoiler(text)
+        return f"*{header}*\n\n{format_hint_with_spoiler(text)}"
+    
+    return fit_message(hint_text, render)
+
+
+def format_feedback_message(feedback_text: str) -> str:
+    """Собирает сообщение с фидбеком ИИ в MarkdownV2 (валидно и для недописанного текста)."""
+    header = escape_markdown_v2("Фидбек на твой ответ:")
+    return fit_message(feedback_text, lambda text: f"*{header}*\n\n{escape_markdown_v2(text)}")
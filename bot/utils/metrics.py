@@ -0,0 +1,43 @@
+import math
+from typing import Dict, Iterable
+
+
+def percentile(values: Iterable[float], p: float) -> float:
+    """
+    Вычисляет перцентиль (nearest-rank) для набора значений.
+    
+    Args:
+        values: Значения (например, задержки в секундах)
+        p: Перцентиль от 0 до 100
+    
+    Returns:
+        Значение перцентиля или 0.0 для пустого набора
+    """
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    rank = max(1, math.ceil(p / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+class Metrics:
+    """Простые in-process счетчики и gauge-метрики."""
+    
+    def __init__(self):
+        self.counters: Dict[str, int] = {}
+        self.gauges: Dict[str, float] = {}
+    
+    def incr(self, name: str, value: int = 1) -> None:
+        """Увеличивает счетчик."""
+        self.counters[name] = self.counters.get(name, 0) + value
+    
+    def set_gauge(self, name: str, value: float) -> None:
+        """Устанавливает текущее значение gauge."""
+        self.gauges[name] = value
+    
+    def snapshot(self) -> Dict[str, float]:
+        """Возвращает копию всех метрик."""
+        return {**self.counters, **self.gauges}
+
+
+metrics = Metrics()
@@ -0,0 +1,225 @@
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Hashable, Iterable, List, Optional, Sequence
+from bot.utils.metrics import percentile
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class TargetHealth:
+    """Состояние одной цели маршрутизации (модели или пары ключ/модель)."""
+    __slots__ = (
+        "target",
+        "order",
+        "ewma_latency",
+        "latencies",
+        "ewma_error",
+        "rate_limits",
+        "state",
+        "opened_at",
+        "consecutive_failures",
+        "probe_in_flight",
+        "requests",
+        "failures",
+    )
+    
+    def __init__(self, target: Hashable, order: int):
+        self.target = target
+        self.order = order
+        self.ewma_latency: Optional[float] = None
+        # Последние задержки успешных запросов, для перцентилей
+        self.latencies: Deque[float] = deque(maxlen=200)
+        self.ewma_error = 0.0
+        self.rate_limits: Deque[float] = deque()
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.consecutive_failures = 0
+        self.probe_in_flight = False
+        self.requests = 0
+        self.failures = 0
+
+
+class ModelRouter:
+    """
+    Выбор модели для запроса по живой статистике.
+    
+    Для каждой цели считаются EWMA задержки и доли ошибок и число 429 за последнее окно.
+    Запрос уходит на цель с наименьшей оценкой (задержка с штрафами за ошибки и 429),
+    при равенстве - на более раннюю в списке. Небольшая доля запросов (explore_ratio)
+    идет на случайную здоровую цель, чтобы узнать задержку остальных моделей.
+    
+    Circuit breaker: после failure_threshold ошибок подряд или ответа 429 цель
+    выключается на open_seconds, затем пропускает один пробный запрос (half-open):
+    успех закрывает breaker, ошибка снова открывает его.
+    
+    Методы потокобезопасны: блокирующий клиент вызывается из пула потоков.
+    """
+    
+    def __init__(
+        self,
+        targets: Sequence[Hashable],
+        alpha: float = 0.2,
+        failure_threshold: int = 3,
+        open_seconds: float = 30.0,
+        rate_limit_window: float = 60.0,
+        explore_ratio: float = 0.05,
+    ):
+        self.alpha = alpha
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.rate_limit_window = rate_limit_window
+        self.explore_ratio = explore_ratio
+        self._health: Dict[Hashable, TargetHealth] = {
+            target: TargetHealth(target, order) for order, target in enumerate(targets)
+        }
+        self._lock = threading.Lock()
+    
+    @property
+    def targets(self) -> List[Hashable]:
+        return list(self._health)
+    
+    def add_target(self, target: Hashable) -> None:
+        with self._lock:
+            if target not in self._health:
+                self._health[target] = TargetHealth(target, len(self._health))
+    
+    def remove_target(self, target: Hashable) -> None:
+        with self._lock:
+            self._health.pop(target, None)
+    
+    def choose(
+        self,
+        exclude: Iterable[Hashable] = (),
+        penalty: Optional[Callable[[Hashable], float]] = None,
+    ) -> Optional[Hashable]:
+        """
+        Возвращает цель для следующего запроса.
+        
+        penalty - дополнительная оценка цели в секундах (например, ожидание квоты),
+        прибавляется к оценке по задержке.
+        
+        Если все цели выключены, возвращает ту, что выключена раньше всех:
+        лучше попробовать, чем сразу отказать пользователю.
+        """
+        excluded = set(exclude)
+        now = time.monotonic()
+        with self._lock:
+            candidates = [h for h in self._health.values() if h.target not in excluded]
+            if not candidates:
+                return None
+            
+            available = [h for h in candidates if self._available(h, now)]
+            if not available:
+                fallback = min(candidates, key=lambda h: h.opened_at)
+                return fallback.target
+            
+            # Пробный запрос в half-open цель имеет приоритет: иначе она не восстановится
+            for health in available:
+                if health.state == HALF_OPEN:
+                    health.probe_in_flight = True
+                    return health.target
+            
+            if len(available) > 1 and random.random() < self.explore_ratio:
+                return random.choice(available).target
+            
+            best_known = min(
+                (h.ewma_latency for h in available if h.ewma_latency is not None),
+                default=0.0,
+            )
+            return min(
+                available,
+                key=lambda h: (self._score(h, now, best_known) + (penalty(h.target) if penalty else 0.0), h.order),
+            ).target
+    
+    def record_success(self, target: Hashable, latency: float) -> None:
+        with self._lock:
+            health = self._health.get(target)
+            if health is None:
+                return
+            health.requests += 1
+            health.ewma_latency = latency if health.ewma_latency is None else (
+                self.alpha * latency + (1 - self.alpha) * health.ewma_latency
+            )
+            health.latencies.append(latency)
+            health.ewma_error = (1 - self.alpha) * health.ewma_error
+            health.consecutive_failures = 0
+            health.probe_in_flight = False
+            health.state = CLOSED
+    
+    def record_failure(self, target: Hashable, rate_limited: bool = False) -> None:
+        now = time.monotonic()
+        with self._lock:
+            health = self._health.get(target)
+            if health is None:
+                return
+            health.requests += 1
+            health.failures += 1
+            health.ewma_error = self.alpha + (1 - self.alpha) * health.ewma_error
+            health.consecutive_failures += 1
+            if rate_limited:
+                health.rate_limits.append(now)
+            
+            if health.state == HALF_OPEN or rate_limited or health.consecutive_failures >= self.failure_threshold:
+                health.state = OPEN
+                health.opened_at = now
+            health.probe_in_flight = False
+    
+    def latency_percentile(self, target: Hashable, p: float, min_samples: int = 20) -> Optional[float]:
+        """Перцентиль задержки цели в секундах или None, если замеров пока мало."""
+        with self._lock:
+            health = self._health.get(target)
+            if health is None or len(health.latencies) < min_samples:
+                return None
+            return percentile(health.latencies, p)
+    
+    def release(self, target: Hashable) -> None:
+        """Снимает отметку пробного запроса, если он был отменен без результата."""
+        with self._lock:
+            health = self._health.get(target)
+            if health is not None:
+                health.probe_in_flight = False
+    
+    def snapshot(self) -> List[Dict[str, Any]]:
+        """Таблица здоровья целей для get_status()."""
+        now = time.monotonic()
+        with self._lock:
+            rows = []
+            for health in self._health.values():
+                self._prune_rate_limits(health, now)
+                rows.append({
+                    "target": health.target,
+                    "state": health.state,
+                    "ewma_latency_ms": round(health.ewma_latency * 1000, 1) if health.ewma_latency is not None else None,
+                    "p95_latency_ms": round(percentile(health.latencies, 95) * 1000, 1) if health.latencies else None,
+                    "error_rate": round(health.ewma_error, 3),
+                    "recent_429": len(health.rate_limits),
+                    "consecutive_failures": health.consecutive_failures,
+                    "requests": health.requests,
+                    "failures": health.failures,
+                    "open_for_s": round(max(0.0, self.open_seconds - (now - health.opened_at)), 1)
+                    if health.state == OPEN else 0.0,
+                })
+            return rows
+    
+    def _available(self, health: TargetHealth, now: float) -> bool:
+        if health.state == CLOSED:
+            return True
+        if health.state == OPEN and now - health.opened_at >= self.open_seconds:
+            health.state = HALF_OPEN
+            health.probe_in_flight = False
+        # В half-open пропускаем только один пробный запрос
+        return health.state == HALF_OPEN and not health.probe_in_flight
+    
+    def _score(self, health: TargetHealth, now: float, best_known: float) -> float:
+        self._prune_rate_limits(health, now)
+        # Неизмеренная цель считается не хуже лучшей известной, порядок в списке решает ничью
+        latency = health.ewma_latency if health.ewma_latency is not None else best_known
+        return latency * (1 + 4 * health.ewma_error) + 2.0 * len(health.rate_limits)
+    
+    def _prune_rate_limits(self, health: TargetHealth, now: float) -> None:
+        while health.rate_limits and now - health.rate_limits[0] > self.rate_limit_window:
+            health.rate_limits.popleft()
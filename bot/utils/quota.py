@@ -0,0 +1,228 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, Hashable, Optional
+from bot.utils.deadline import detached_context
+from bot.utils.metrics import metrics
+
+# Приоритеты запросов к ИИ: меньше - раньше
+PRIORITY_HINT = 0
+PRIORITY_FEEDBACK = 1
+PRIORITY_BACKGROUND = 2
+
+
+def estimate_tokens(text: str, expected_output: int = 512) -> int:
+    """Грубая оценка токенов запроса: ~4 символа на токен плюс ожидаемый ответ."""
+    return len(text) // 4 + expected_output
+
+
+class TokenBucket:
+    """
+    Token bucket, настроенный так, чтобы не превысить limit за любое окно в 60 секунд.
+    
+    Емкость (burst) - десятая часть лимита, скорость пополнения - остаток лимита
+    в минуту: burst + rate * 60 == limit.
+    
+    Запрос больше емкости ждет полного ведра и списывается целиком, уводя ведро
+    в минус: следующие запросы ждут, пока долг не восполнится.
+    """
+    
+    def __init__(self, limit_per_minute: float):
+        self.capacity = self.capacity_for(limit_per_minute)
+        self.rate = max(limit_per_minute - self.capacity, 1.0) / 60
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+    
+    @staticmethod
+    def capacity_for(limit_per_minute: float) -> float:
+        """Емкость ведра для лимита в минуту: больше за один запрос без ожидания долга не уйдет."""
+        return max(1.0, limit_per_minute / 10)
+    
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    def wait_time(self, amount: float, now: float) -> float:
+        """Через сколько секунд можно будет забрать amount (запрос больше емкости ждет полного ведра)."""
+        self._refill(now)
+        needed = min(amount, self.capacity)
+        if self.tokens >= needed:
+            return 0.0
+        return (needed - self.tokens) / self.rate
+    
+    def consume(self, amount: float, now: float) -> None:
+        self._refill(now)
+        self.tokens -= amount
+
+
+class _Waiter:
+    __slots__ = ("tokens", "future")
+    
+    def __init__(self, tokens: int, future: asyncio.Future):
+        self.tokens = tokens
+        self.future = future
+
+
+class ModelQuota:
+    """
+    Очередь запросов к одной модели перед ее RPM/TPM ведрами.
+    
+    Запросы ждут в очереди вместо того, чтобы получить 429. Порядок выдачи:
+    сначала по приоритету, внутри приоритета - по кругу между пользователями
+    (по одному запросу от каждого), внутри пользователя - FIFO.
+    """
+    
+    def __init__(self, name: str, rpm: Optional[float], tpm: Optional[float]):
+        self.name = name
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self._queues: Dict[int, "OrderedDict[Hashable, Deque[_Waiter]]"] = {}
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._size = 0
+    
+    @property
+    def queue_depth(self) -> int:
+        return self._size
+    
+    def _wait_time(self, tokens: int, now: float) -> float:
+        wait = 0.0
+        if self.requests is not None:
+            wait = max(wait, self.requests.wait_time(1, now))
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.wait_time(tokens, now))
+        return wait
+    
+    def _consume(self, tokens: int, now: float) -> None:
+        if self.requests is not None:
+            self.requests.consume(1, now)
+        if self.tokens is not None:
+            self.tokens.consume(tokens, now)
+    
+    def estimated_wait(self, tokens: int) -> float:
+        """Примерное ожидание нового запроса в секундах: ведра плюс очередь перед ним."""
+        now = time.monotonic()
+        wait = self._wait_time(tokens, now)
+        if self._size and self.requests is not None:
+            wait += self._size / self.requests.rate
+        return wait
+    
+    async def acquire(self, tokens: int, priority: int, user_key: Hashable) -> None:
+        """Ждет, пока запрос можно отправить без превышения квоты."""
+        if self.requests is None and self.tokens is None:
+            return
+        
+        now = time.monotonic()
+        if self._size == 0 and self._wait_time(tokens, now) == 0:
+            self._consume(tokens, now)
+            return
+        
+        waiter = _Waiter(tokens, asyncio.get_running_loop().create_future())
+        users = self._queues.setdefault(priority, OrderedDict())
+        users.setdefault(user_key, deque()).append(waiter)
+        self._size += 1
+        metrics.incr("ai_quota_waits")
+        self._publish()
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(
+                self._dispatch(),
+                name=f"ai_quota_{self.name}",
+                context=detached_context(),
+            )
+        
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if not waiter.future.done():
+                self._remove(priority, user_key, waiter)
+            raise
+    
+    def _remove(self, priority: int, user_key: Hashable, waiter: _Waiter) -> None:
+        users = self._queues.get(priority)
+        queue = users.get(user_key) if users else None
+        if queue is None or waiter not in queue:
+            return
+        queue.remove(waiter)
+        self._size -= 1
+        if not queue:
+            del users[user_key]
+        self._publish()
+    
+    def _next(self):
+        """Следующий запрос: наивысший приоритет, первый пользователь в круговой очереди."""
+        for priority in sorted(self._queues):
+            users = self._queues[priority]
+            if users:
+                user_key, queue = next(iter(users.items()))
+                return priority, user_key, queue
+        return None
+    
+    async def _dispatch(self) -> None:
+        while self._size > 0:
+            priority, user_key, queue = self._next()
+            waiter = queue[0]
+            now = time.monotonic()
+            wait = self._wait_time(waiter.tokens, now)
+            if wait > 0:
+                # За время ожидания может прийти запрос с более высоким приоритетом
+                await asyncio.sleep(wait)
+                continue
+            
+            queue.popleft()
+            self._size -= 1
+            users = self._queues[priority]
+            del users[user_key]
+            if queue:
+                # Пользователь уходит в конец круга
+                users[user_key] = queue
+            self._publish()
+            
+            if waiter.future.done():
+                continue
+            self._consume(waiter.tokens, now)
+            waiter.future.set_result(None)
+    
+    def _publish(self) -> None:
+        metrics.set_gauge(f"ai_quota_queue_depth_{self.name}", self._size)
+
+
+class QuotaScheduler:
+    """
+    Клиентский планировщик квот: по одной очереди ModelQuota на цель.
+    
+    Цель - модель или пара (ключ API, модель): у каждого ключа своя квота.
+    """
+    
+    def __init__(self, limits: Dict[Hashable, Dict[str, Optional[float]]]):
+        """
+        Args:
+            limits: {target: {"rpm": ..., "tpm": ...}}, None - без ограничения
+        """
+        self._targets: Dict[Hashable, ModelQuota] = {
+            target: ModelQuota(_label(target), limit.get("rpm"), limit.get("tpm"))
+            for target, limit in limits.items()
+        }
+    
+    async def acquire(
+        self,
+        target: Hashable,
+        tokens: int,
+        priority: int = PRIORITY_BACKGROUND,
+        user_key: Optional[Hashable] = None,
+    ) -> None:
+        quota = self._targets.get(target)
+        if quota is not None:
+            await quota.acquire(tokens, priority, user_key)
+    
+    def estimated_wait(self, target: Hashable, tokens: int) -> float:
+        quota = self._targets.get(target)
+        return quota.estimated_wait(tokens) if quota is not None else 0.0
+    
+    def queue_depths(self) -> Dict[str, int]:
+        return {quota.name: quota.queue_depth for quota in self._targets.values()}
+
+
+def _label(target: Hashable) -> str:
+    """Имя цели для метрик: ("key1", "gemini-2.5-flash") -> "key1/gemini-2.5-flash"."""
+    if isinstance(target, tuple):
+        return "/".join(str(part) for part in target)
+    return str(target)
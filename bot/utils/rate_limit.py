@@ -0,0 +1,134 @@
+import asyncio
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Union
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import TelegramMethod, Response
+from aiogram.methods.base import TelegramType
+from bot.utils.metrics import metrics
+from bot.logging import logger
+
+# Включен ли лимитер для запросов текущей задачи (см. rate_limited())
+_rate_limited: contextvars.ContextVar[bool] = contextvars.ContextVar("telegram_rate_limited", default=False)
+
+
+@contextmanager
+def rate_limited() -> Iterator[None]:
+    """
+    Запросы к Telegram внутри блока ждут своего слота в TelegramRateLimiter
+    (для рассылок). Остальные запросы - ответы handlers, редактирования потоковых
+    сообщений - уходят сразу.
+    """
+    token = _rate_limited.set(True)
+    try:
+        yield
+    finally:
+        _rate_limited.reset(token)
+
+
+class TelegramRateLimiter:
+    """
+    Планировщик отправок с учетом лимитов Telegram.
+    
+    Каждому запросу резервируется слот не раньше следующего свободного
+    глобального слота и следующего свободного слота конкретного чата,
+    поэтому ожидающие обслуживаются в порядке поступления без активного опроса.
+    """
+    
+    # Сколько записей по чатам держим до очистки устаревших
+    _PRUNE_THRESHOLD = 10_000
+    
+    def __init__(self, global_rate: float, chat_interval: float):
+        """
+        Args:
+            global_rate: Максимум запросов в секунду на весь бот
+            chat_interval: Минимальный интервал между запросами в один чат (секунды)
+        """
+        self.global_interval = 1.0 / global_rate if global_rate > 0 else 0.0
+        self.chat_interval = chat_interval
+        self._next_global = 0.0
+        self._next_chat: Dict[Union[int, str], float] = {}
+        self._lock = asyncio.Lock()
+    
+    async def acquire(self, chat_id: Optional[Union[int, str]] = None) -> float:
+        """
+        Ждет своего слота на отправку.
+        
+        Returns:
+            Время ожидания в секундах
+        """
+        loop = asyncio.get_running_loop()
+        async with self._lock:
+            now = loop.time()
+            slot = self._reserve(chat_id, now)
+        
+        delay = slot - now
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return max(0.0, delay)
+    
+    def note(self, chat_id: Optional[Union[int, str]] = None) -> None:
+        """
+        Учитывает запрос, отправленный без ожидания: занимает текущий слот, чтобы
+        рассылка уступила место ответам пользователям, а не превысила лимит вместе с ними.
+        """
+        self._reserve(chat_id, asyncio.get_running_loop().time(), wait=False)
+    
+    def _reserve(self, chat_id: Optional[Union[int, str]], now: float, wait: bool = True) -> float:
+        """Занимает ближайшие свободные слоты; возвращает момент отправки (now, если wait=False)."""
+        slot = max(now, self._next_global)
+        if chat_id is not None:
+            if wait:
+                slot = max(slot, self._next_chat.get(chat_id, 0.0))
+                self._next_chat[chat_id] = slot + self.chat_interval
+            else:
+                # Запрос уже ушел: следующий в этот чат - не раньше чем через chat_interval
+                self._next_chat[chat_id] = max(self._next_chat.get(chat_id, 0.0), now + self.chat_interval)
+            if len(self._next_chat) > self._PRUNE_THRESHOLD:
+                self._prune(now)
+        self._next_global = slot + self.global_interval
+        return slot if wait else now
+    
+    def _prune(self, now: float) -> None:
+        """Удаляет чаты, чьи слоты уже в прошлом."""
+        self._next_chat = {chat: ts for chat, ts in self._next_chat.items() if ts > now}
+
+
+class RateLimitMiddleware(BaseRequestMiddleware):
+    """
+    Request middleware для aiogram: запросы внутри rate_limited() ждут слота в
+    TelegramRateLimiter и переживают TelegramRetryAfter повторами. Остальные запросы
+    только учитываются в лимитере, а TelegramRetryAfter получает вызывающий код.
+    """
+    
+    def __init__(self, limiter: TelegramRateLimiter, max_retries: int = 3):
+        self.limiter = limiter
+        self.max_retries = max_retries
+    
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            # Служебные запросы (getUpdates, answerCallbackQuery) не ограничиваем
+            return await make_request(bot, method)
+        if not _rate_limited.get():
+            # Ответы пользователям не ждут рассылку, но занимают ее слоты
+            self.limiter.note(chat_id)
+            return await make_request(bot, method)
+        
+        for attempt in range(self.max_retries + 1):
+            await self.limiter.acquire(chat_id)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                metrics.incr("telegram_retry_after")
+                if attempt >= self.max_retries:
+                    raise
+                logger.warning(f"Telegram flood control for chat {chat_id}, retry in {e.retry_after}s")
+                await asyncio.sleep(e.retry_after)
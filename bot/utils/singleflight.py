@@ -0,0 +1,58 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+from bot.utils.deadline import detached_context
+from bot.utils.metrics import metrics
+
+
+class _Call:
+    __slots__ = ("future", "waiters")
+    
+    def __init__(self, future: asyncio.Future):
+        self.future = future
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Схлопывает одновременные одинаковые вызовы: пока вызов с ключом выполняется,
+    остальные вызовы с тем же ключом ждут его результат, а не запускают свой.
+    
+    Отмена одного из ожидающих не прерывает общий вызов; он отменяется, только когда
+    отменены все ожидающие. Счетчики <name>_calls и <name>_collapsed пишутся в metrics.
+    """
+    
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Hashable, _Call] = {}
+    
+    def __len__(self) -> int:
+        return len(self._calls)
+    
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        call = self._calls.get(key)
+        if call is not None:
+            metrics.incr(f"{self.name}_collapsed")
+        else:
+            metrics.incr(f"{self.name}_calls")
+            # Общий вызов не наследует дедлайн первого вызывающего: каждый ждет по своему
+            call = _Call(asyncio.get_running_loop().create_task(fn(), context=detached_context()))
+            self._calls[key] = call
+            call.future.add_done_callback(lambda done: self._forget(key, done))
+        
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.future)
+        except asyncio.CancelledError:
+            if call.waiters == 1 and not call.future.done():
+                call.future.cancel()
+            raise
+        finally:
+            call.waiters -= 1
+    
+    def _forget(self, key: Hashable, future: asyncio.Future) -> None:
+        call = self._calls.get(key)
+        if call is not None and call.future is future:
+            del self._calls[key]
+        # Забираем исключение, чтобы asyncio не писал "exception was never retrieved"
+        if not future.cancelled():
+            future.exception()
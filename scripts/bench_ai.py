@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк пути ИИ на локальной замене Gemini (scripts/fake_gemini.py), без расхода квоты.
+
+Запускает fake_gemini в этом же процессе (или использует уже запущенный через --url),
+создает AIInterface, направленный на него, и отправляет N одновременных запросов:
+- ai: generate_hint / generate_feedback (сервисный слой, БД не нужна);
+- handlers: нажатия "Подсказка" и "Получить фидбек" через DatabaseMiddleware
+  (нужна DATABASE_URL; тестовые данные создаются с отрицательными tg_user_id и удаляются).
+
+Печатает пропускную способность, p50/p99/max, число ошибок, распределение запросов по
+моделям и исходам на стороне сервера, состояние роутера моделей и счетчики метрик ИИ.
+Лимиты rpm/tpm из models.json по умолчанию отключены, чтобы мерить сам путь запроса
+(--with-limits включает их).
+
+Использование:
+    python scripts/bench_ai.py --requests 200 --concurrency 50 --median 0.8 --p99 4 \\
+        --rate-429 0.05 --model gemini-2.5-flash-lite:rate_5xx=0.3 --hedge-percentile 95
+    python scripts/bench_ai.py --scenario handlers --streaming --requests 50
+"""
+import argparse
+import asyncio
+import dataclasses
+import json
+import logging
+import sys
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+# Добавляем корневую директорию в путь
+sys.path.insert(0, str(Path(__file__).parent.parent))
+sys.path.insert(0, str(Path(__file__).parent))
+
+import aiohttp
+from aiohttp import web
+from fake_gemini import add_behavior_arguments, build_server
+from bot.services.hint import generate_feedback, generate_hint
+from bot.utils.ai_interface import AIInterface
+from bot.utils.metrics import metrics, percentile
+
+PROJECT_ROOT = Path(__file__).parent.parent
+TG_ID_BASE = -9_100_000
+
+
+def models_file(with_limits: bool) -> str:
+    """models.json для бенчмарка: те же модели, лимиты - только с --with-limits."""
+    data = json.loads((PROJECT_ROOT / "models.json").read_text())
+    if not with_limits:
+        data["models"] = [
+            {key: value for key, value in entry.items() if key not in ("rpm", "tpm")}
+            if isinstance(entry, dict) else entry
+            for entry in data["models"]
+        ]
+    tmp = tempfile.NamedTemporaryFile("w", suffix=".json", delete=False)
+    json.dump(data, tmp)
+    tmp.close()
+    return tmp.name
+
+
+async def fetch_stats(url: str) -> dict:
+    async with aiohttp.ClientSession() as http:
+        async with http.get(f"{url}/stats") as response:
+            return await response.json()
+
+
+async def run_calls(concurrency: int, calls: list) -> tuple:
+    """Выполняет корутины-фабрики не более concurrency одновременно; возвращает (задержки в мс, ошибки, время)."""
+    semaphore = asyncio.Semaphore(concurrency)
+    timings, errors = [], 0
+    
+    async def one(call):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                ok = await call()
+            except Exception as e:
+                print(f"  error: {e}")
+                ok = False
+            timings.append((time.perf_counter() - started) * 1000)
+            if not ok:
+                errors += 1
+    
+    started = time.perf_counter()
+    await asyncio.gather(*(one(call) for call in calls))
+    return timings, errors, time.perf_counter() - started
+
+
+def report(name: str, timings: list, errors: int, duration: float) -> None:
+    print(
+        f"{name:<10} n={len(timings):<5} {len(timings) / duration:7.1f} req/s "
+        f"p50={percentile(timings, 50):8.1f} ms p99={percentile(timings, 99):8.1f} ms "
+        f"max={max(timings):8.1f} ms errors={errors}"
+    )
+
+
+def ai_calls(ai: AIInterface, kind: str, requests: int) -> list:
+    """Запросы с разными промптами, чтобы singleflight и кэши не схлопывали их."""
+    def hint(n):
+        async def call():
+            text = await generate_hint(ai, f"Бенчмарк: вопрос №{n} о контейнерах?", 5, n)
+            return not text.startswith("❌")
+        return call
+    
+    def feedback(n):
+        async def call():
+            text = await generate_feedback(ai, f"Бенчмарк: вопрос №{n}?", f"Ответ №{n}", 5, n)
+            return not text.startswith("❌")
+        return call
+    
+    factory = hint if kind == "hint" else feedback
+    return [factory(n) for n in range(requests)]
+
+
+async def handler_calls(ai: AIInterface, streaming: bool, requests: int):
+    """
+    Готовит пользователей и вопросы в БД и возвращает (фабрики нажатий по видам, очистка).
+    
+    У каждого пользователя свой вопрос, чтобы кэши подсказок и фидбека не срабатывали.
+    """
+    from sqlalchemy import delete, insert, select
+    from bot.config import Config
+    from bot.db.engine import create_engine, create_sessionmaker, init_db
+    from bot.db.dao import get_or_create_user, save_answer
+    from bot.db.models import FeedbackCache, HintCache, Question, User, UserQuestion, UserState
+    from bot.handlers.answer import callback_feedback, callback_hint
+    from bot.middleware import DatabaseMiddleware
+    from bot.services.catalog import question_catalog
+    from bot.utils.hashing import sha256_hash
+    
+    config = dataclasses.replace(Config.from_env(), ai_streaming=streaming, ai_jobs_enabled=False, speculative_feedback=False)
+    engine = create_engine(config)
+    await init_db(engine)
+    sessionmaker = create_sessionmaker(engine)
+    
+    async def _noop(*args, **kwargs):
+        return SimpleNamespace(message_id=1)
+    
+    bot = SimpleNamespace(send_message=_noop, edit_message_text=_noop, delete_message=_noop)
+    middleware = DatabaseMiddleware(sessionmaker, bot, config, ai)
+    tg_ids = [TG_ID_BASE - i for i in range(requests)]
+    
+    stamp = time.time()
+    hashes = [sha256_hash(f"bench ai question {n} {stamp}") for n in range(requests)]
+    async with sessionmaker() as session:
+        question_ids = (await session.execute(
+            insert(Question).returning(Question.id),
+            [
+                {"freq_score": 5, "question": f"Бенчмарк: вопрос №{n}?", "question_hash": question_hash}
+                for n, question_hash in enumerate(hashes)
+            ],
+        )).scalars().all()
+        for tg_user_id, question_id in zip(tg_ids, question_ids):
+            user = await get_or_create_user(session, tg_user_id)
+            await save_answer(session, user.id, question_id, f"bench answer {tg_user_id}")
+        await session.commit()
+        await question_catalog.refresh(session)
+    
+    def press(handler, kind, tg_user_id, question_id):
+        async def call():
+            failed = False
+            
+            async def answer(text, *args, **kwargs):
+                nonlocal failed
+                failed = failed or text.startswith("Не удалось")
+            
+            callback = SimpleNamespace(
+                data=f"{kind}:{question_id}",
+                from_user=SimpleNamespace(id=tg_user_id),
+                answer=_noop,
+                message=SimpleNamespace(answer=answer, chat=SimpleNamespace(id=tg_user_id)),
+            )
+            await middleware(handler, callback, {})
+            return not failed
+        return call
+    
+    async def hint_handler(event, data):
+        return await callback_hint(event, data["session"], data["bot"], data["ai"], data["config"])
+    
+    async def feedback_handler(event, data):
+        return await callback_feedback(event, data["session"], data["bot"], data["ai"], data["config"])
+    
+    calls = {
+        "hint": [press(hint_handler, "hint", t, q) for t, q in zip(tg_ids, question_ids)],
+        "feedback": [press(feedback_handler, "feedback", t, q) for t, q in zip(tg_ids, question_ids)],
+    }
+    
+    async def cleanup():
+        async with sessionmaker() as session:
+            user_ids = select(User.id).where(User.tg_user_id.in_(tg_ids)).scalar_subquery()
+            await session.execute(delete(UserQuestion).where(UserQuestion.user_id.in_(user_ids)))
+            await session.execute(delete(UserState).where(UserState.user_id.in_(user_ids)))
+            await session.execute(delete(User).where(User.tg_user_id.in_(tg_ids)))
+            await session.execute(delete(HintCache).where(HintCache.question_hash.in_(hashes)))
+            await session.execute(delete(Question).where(Question.id.in_(question_ids)))
+            await session.execute(delete(FeedbackCache).where(FeedbackCache.question_hash.in_(hashes)))
+            await session.commit()
+        await engine.dispose()
+    
+    return calls, cleanup
+
+
+def print_server_stats(before: dict, after: dict) -> None:
+    diff = {key: after.get(key, 0) - before.get(key, 0) for key in after}
+    models = sorted({key.split("/", 1)[1] for key in diff if key.startswith("requests/")})
+    print("server:")
+    for model in models:
+        outcomes = ", ".join(
+            f"{outcome}={diff.get(f'{outcome}/{model}', 0)}"
+            for outcome in ("ok", "429", "5xx", "timeout", "401")
+            if diff.get(f"{outcome}/{model}", 0)
+        )
+        print(f"  {model:<24} requests={diff[f'requests/{model}']:<5} {outcomes}")
+
+
+def print_ai_state(ai: AIInterface) -> None:
+    print("router:")
+    for row in ai.router.snapshot():
+        print(
+            f"  {'/'.join(row['target']):<30} state={row['state']:<9} requests={row['requests']:<5} "
+            f"failures={row['failures']:<4} ewma={row['ewma_latency_ms']} ms p95={row['p95_latency_ms']} ms"
+        )
+    counters = {key: value for key, value in sorted(metrics.snapshot().items()) if key.startswith("ai_")}
+    print("metrics:")
+    for key, value in counters.items():
+        print(f"  {key} = {value}")
+
+
+async def run(args: argparse.Namespace):
+    # Лог каждого HTTP запроса заглушил бы отчет
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    runner = None
+    url = args.url
+    if url is None:
+        runner = web.AppRunner(build_server(args).app(), access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", args.port)
+        await site.start()
+        url = f"http://127.0.0.1:{args.port}"
+    
+    ai = AIInterface(
+        retry_attempts=2,
+        retry_delay=args.retry_delay,
+        models_file=models_file(args.with_limits),
+        api_keys=args.api_key or ["bench-key"],
+        hedge_percentile=args.hedge_percentile,
+        base_url=url,
+    )
+    cleanup = None
+    try:
+        if args.scenario == "handlers":
+            calls, cleanup = await handler_calls(ai, args.streaming, args.requests)
+        else:
+            calls = {kind: ai_calls(ai, kind, args.requests) for kind in ("hint", "feedback")}
+        
+        before = await fetch_stats(url)
+        for kind in args.kinds:
+            timings, errors, duration = await run_calls(args.concurrency, calls[kind])
+            report(kind, timings, errors, duration)
+        print_server_stats(before, await fetch_stats(url))
+        print_ai_state(ai)
+    finally:
+        if cleanup is not None:
+            await cleanup()
+        await ai.aclose()
+        if runner is not None:
+            await runner.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", choices=("ai", "handlers"), default="ai")
+    parser.add_argument("--kinds", nargs="+", choices=("hint", "feedback"), default=["hint", "feedback"])
+    parser.add_argument("--requests", type=int, default=100, help="запросов каждого вида")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--streaming", action="store_true", help="handlers: потоковый режим (AI_STREAMING)")
+    parser.add_argument("--hedge-percentile", type=float, default=None)
+    parser.add_argument("--retry-delay", type=float, default=0.1)
+    parser.add_argument("--with-limits", action="store_true", help="учитывать rpm/tpm из models.json")
+    parser.add_argument("--api-key", action="append", help="ключи для AIInterface (можно несколько)")
+    parser.add_argument("--url", help="уже запущенный fake_gemini; по умолчанию запускается в процессе")
+    parser.add_argument("--port", type=int, default=8765)
+    add_behavior_arguments(parser)
+    asyncio.run(run(parser.parse_args()))
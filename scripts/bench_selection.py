@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк выбора вопросов: задержка select_next_questions в зависимости от
+количества отвеченных вопросов пользователя (0 -> 10k).
+
+Все тестовые данные создаются внутри одной транзакции и откатываются в конце,
+поэтому скрипт можно запускать на рабочей БД.
+
+Использование: python scripts/bench_selection.py [--max-answered 10000] [--runs 50]
+"""
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+from pathlib import Path
+
+# Добавляем корневую директорию в путь
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from sqlalchemy import insert, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from bot.config import Config
+from bot.db.engine import create_engine, init_db
+from bot.db.dao import select_next_questions
+from bot.db.models import Question, User, UserQuestion
+from bot.utils.hashing import sha256_hash
+from bot.utils.metrics import percentile
+
+
+async def bench(max_answered: int, runs: int):
+    config = Config.from_env()
+    engine = create_engine(config)
+    await init_db(engine)
+    
+    steps = [0, 100, 1000, 2500, 5000, 7500, 10000]
+    steps = [n for n in steps if n < max_answered] + [max_answered]
+    
+    async with engine.connect() as conn:
+        trans = await conn.begin()
+        session = AsyncSession(bind=conn, expire_on_commit=False)
+        try:
+            # Синтетический каталог: answered + запас на выдачу
+            question_ids = (await session.execute(
+                insert(Question).returning(Question.id),
+                [
+                    {
+                        "freq_score": i % 10,
+                        "question": f"bench question {i}",
+                        "question_hash": sha256_hash(f"bench question {i} {time.time()}"),
+                    }
+                    for i in range(max_answered + 100)
+                ],
+            )).scalars().all()
+            
+            user_id = (await session.execute(
+                insert(User).values(tg_user_id=-int(time.time())).returning(User.id)
+            )).scalar_one()
+            
+            answered = 0
+            print(f"{'answered':>10} {'p50 ms':>10} {'p95 ms':>10} {'mean ms':>10}")
+            for target in steps:
+                if target > answered:
+                    await session.execute(
+                        insert(UserQuestion),
+                        [
+                            {"user_id": user_id, "question_id": qid, "status": "answered"}
+                            for qid in question_ids[answered:target]
+                        ],
+                    )
+                    answered = target
+                    await session.execute(text("ANALYZE questions"))
+                    await session.execute(text("ANALYZE user_questions"))
+                
+                # Прогрев
+                await select_next_questions(session, user_id, 4, 1, 5, config.high_score_threshold)
+                
+                timings = []
+                for _ in range(runs):
+                    started = time.perf_counter()
+                    await select_next_questions(session, user_id, 4, 1, 5, config.high_score_threshold)
+                    timings.append((time.perf_counter() - started) * 1000)
+                
+                print(
+                    f"{answered:>10} {percentile(timings, 50):>10.2f} "
+                    f"{percentile(timings, 95):>10.2f} {statistics.mean(timings):>10.2f}"
+                )
+        finally:
+            await session.close()
+            await trans.rollback()
+    
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--max-answered", type=int, default=10000)
+    parser.add_argument("--runs", type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(bench(args.max_answered, args.runs))
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк get_or_create_user: пропускная способность при создании новых пользователей
+(cold) и при обращении к уже существующим (warm).
+
+Каждый вызов выполняется в своей сессии с коммитом, как в DatabaseMiddleware.
+С --race каждый tg_user_id запрашивается двумя сессиями одновременно: ошибок
+уникальности быть не должно, у пользователя ровно одна строка users и user_state.
+--legacy запускает прежнюю реализацию (SELECT, INSERT users, INSERT user_state) для сравнения.
+
+Тестовые пользователи создаются с отрицательными tg_user_id и удаляются в конце.
+
+Использование: python scripts/bench_user_creation.py [--users 2000] [--concurrency 20] [--race] [--legacy]
+"""
+import argparse
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+# Добавляем корневую директорию в путь
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from sqlalchemy import delete, func, select
+from bot.config import Config
+from bot.db.engine import create_engine, create_sessionmaker, init_db
+from bot.db.dao import get_or_create_user
+from bot.db.models import User, UserState
+from bot.utils.metrics import percentile
+
+TG_ID_BASE = -9_200_000
+
+
+async def legacy_get_or_create_user(session, tg_user_id: int) -> User:
+    """Прежняя реализация: до четырех обращений к БД и гонка при одновременном создании."""
+    user = (await session.execute(select(User).where(User.tg_user_id == tg_user_id))).scalar_one_or_none()
+    if user is None:
+        user = User(tg_user_id=tg_user_id, is_active=True)
+        session.add(user)
+        await session.flush()
+        session.add(UserState(user_id=user.id, awaiting_question_id=None))
+        await session.flush()
+    return user
+
+
+async def run_phase(sessionmaker, get_user, tg_ids: list, concurrency: int) -> tuple:
+    """Вызывает get_user для каждого tg_user_id; возвращает (задержки в мс, ошибки, время)."""
+    semaphore = asyncio.Semaphore(concurrency)
+    timings, errors = [], 0
+    
+    async def one(tg_user_id: int):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                async with sessionmaker() as session:
+                    await get_user(session, tg_user_id)
+                    await session.commit()
+            except Exception as e:
+                errors += 1
+                if errors <= 3:
+                    print(f"  error: {type(e).__name__}: {e}".splitlines()[0])
+            timings.append((time.perf_counter() - started) * 1000)
+    
+    started = time.perf_counter()
+    await asyncio.gather(*(one(tg_user_id) for tg_user_id in tg_ids))
+    return timings, errors, time.perf_counter() - started
+
+
+def report(name: str, timings: list, errors: int, duration: float) -> None:
+    print(
+        f"{name:<6} n={len(timings):<6} {len(timings) / duration:8.1f} calls/s "
+        f"p50={percentile(timings, 50):7.2f} ms p99={percentile(timings, 99):7.2f} ms errors={errors}"
+    )
+
+
+async def bench(users: int, concurrency: int, race: bool, legacy: bool):
+    config = Config.from_env()
+    engine = create_engine(config)
+    await init_db(engine)
+    sessionmaker = create_sessionmaker(engine)
+    get_user = legacy_get_or_create_user if legacy else get_or_create_user
+    
+    tg_ids = [TG_ID_BASE - i for i in range(users)]
+    # С --race каждый id идет двумя соседними вызовами, которые выполняются одновременно
+    calls = [tg_user_id for tg_user_id in tg_ids for _ in range(2 if race else 1)]
+    
+    print(f"{'legacy' if legacy else 'cte'}: users={users} concurrency={concurrency} race={race}")
+    try:
+        report("cold", *await run_phase(sessionmaker, get_user, calls, concurrency))
+        report("warm", *await run_phase(sessionmaker, get_user, calls, concurrency))
+        
+        async with sessionmaker() as session:
+            user_count = await session.scalar(select(func.count()).select_from(User).where(User.tg_user_id.in_(tg_ids)))
+            state_count = await session.scalar(
+                select(func.count()).select_from(UserState).join(User).where(User.tg_user_id.in_(tg_ids))
+            )
+        print(f"users={user_count} user_state={state_count} (expected {users})")
+    finally:
+        async with sessionmaker() as session:
+            user_ids = select(User.id).where(User.tg_user_id.in_(tg_ids)).scalar_subquery()
+            await session.execute(delete(UserState).where(UserState.user_id.in_(user_ids)))
+            await session.execute(delete(User).where(User.tg_user_id.in_(tg_ids)))
+            await session.commit()
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--race", action="store_true", help="запрашивать каждого пользователя дважды одновременно")
+    parser.add_argument("--legacy", action="store_true", help="прежняя реализация get_or_create_user")
+    args = parser.parse_args()
+    asyncio.run(bench(args.users, args.concurrency, args.race, args.legacy))
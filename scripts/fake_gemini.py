@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+Локальная замена Gemini API для нагрузочных тестов без расхода квоты.
+
+Реализует то подмножество API, которым пользуется AIInterface:
+POST /{version}/interactions с полями model, input и stream (ответ JSON или SSE).
+Задержка ответа - логнормальное распределение с заданными медианой и p99;
+можно подмешивать 429, 5xx и зависания. Параметры задаются по умолчанию для всех
+моделей и переопределяются для отдельных моделей через --model.
+GET /stats возвращает счетчики запросов по моделям, ключам и исходам.
+
+Ответ зависит от промпта: для подсказки - текст с ||эталонным ответом||, для пакетной
+оценки - JSON-массив фидбека по id, для остального - короткий фидбек.
+
+Использование:
+    python scripts/fake_gemini.py --port 8765 --median 0.8 --p99 4 --rate-429 0.02 \\
+        --model gemini-2.5-flash-lite:median=0.3,rate_5xx=0.1
+    GEMINI_BASE_URL=http://127.0.0.1:8765 GEMINI_API_KEY=fake python -m bot.main
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import re
+from collections import Counter
+from typing import Dict, Optional
+from aiohttp import web
+
+# Квантиль стандартного нормального распределения для p99
+Z_99 = 2.326
+
+HINT_TEXT = (
+    "Начни с определения и назови ключевые компоненты, затем приведи пример из практики. "
+    "||Эталонный ответ: синтетический ответ локального сервера fake_gemini.||"
+)
+FEEDBACK_TEXT = (
+    "Хорошо, что ты назвал основные понятия. Стоило бы подробнее раскрыть, как это работает "
+    "на практике, и привести пример команды. Ответ от локального сервера fake_gemini."
+)
+
+
+class ModelBehavior:
+    """Задержка и ошибки одной модели."""
+    
+    def __init__(
+        self,
+        median: float = 0.5,
+        p99: float = 2.0,
+        rate_429: float = 0.0,
+        rate_5xx: float = 0.0,
+        rate_timeout: float = 0.0,
+        hang: float = 60.0,
+        ttft: float = 0.2,
+    ):
+        self.median = median
+        self.p99 = p99
+        self.rate_429 = rate_429
+        self.rate_5xx = rate_5xx
+        self.rate_timeout = rate_timeout
+        self.hang = hang
+        self.ttft = ttft
+    
+    def copy(self, **overrides) -> "ModelBehavior":
+        values = dict(vars(self))
+        values.update(overrides)
+        return ModelBehavior(**values)
+    
+    def latency(self) -> float:
+        """Случайная задержка: логнормальное распределение с заданными медианой и p99."""
+        if self.median <= 0:
+            return 0.0
+        sigma = math.log(max(self.p99, self.median) / self.median) / Z_99
+        return random.lognormvariate(math.log(self.median), sigma)
+    
+    def outcome(self) -> str:
+        roll = random.random()
+        for name, rate in (("429", self.rate_429), ("5xx", self.rate_5xx), ("timeout", self.rate_timeout)):
+            if roll < rate:
+                return name
+            roll -= rate
+        return "ok"
+
+
+def parse_model_override(value: str):
+    """Разбирает --model name:key=value,key=value."""
+    name, _, params = value.partition(":")
+    overrides = {}
+    for pair in filter(None, params.split(",")):
+        key, _, raw = pair.partition("=")
+        overrides[key.strip()] = float(raw)
+    return name.strip(), overrides
+
+
+def response_text(prompt: str) -> str:
+    """Правдоподобный ответ по типу промпта."""
+    if "JSON-массив" in prompt:
+        ids = re.findall(r'"id":\s*(\d+)', prompt)
+        return json.dumps([{"id": int(i), "feedback": FEEDBACK_TEXT} for i in ids], ensure_ascii=False)
+    if "эталонный ответ" in prompt:
+        return HINT_TEXT
+    return FEEDBACK_TEXT
+
+
+def error_body(code: int, status: str, message: str) -> Dict:
+    return {"error": {"code": code, "status": status, "message": message}}
+
+
+class FakeGemini:
+    """aiohttp-приложение, отвечающее как Gemini interactions API."""
+    
+    def __init__(
+        self,
+        default: ModelBehavior,
+        models: Optional[Dict[str, ModelBehavior]] = None,
+        invalid_keys: tuple = (),
+        chunk_chars: int = 40,
+    ):
+        self.default = default
+        self.models = models or {}
+        self.invalid_keys = set(invalid_keys)
+        self.chunk_chars = max(1, chunk_chars)
+        self.stats: Counter = Counter()
+        self._ids = 0
+    
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/{version}/interactions", self.create_interaction)
+        app.router.add_get("/stats", self.get_stats)
+        app.router.add_post("/stats/reset", self.reset_stats)
+        return app
+    
+    def behavior(self, model: str) -> ModelBehavior:
+        return self.models.get(model, self.default)
+    
+    async def get_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(dict(self.stats))
+    
+    async def reset_stats(self, request: web.Request) -> web.Response:
+        self.stats.clear()
+        return web.json_response({})
+    
+    async def create_interaction(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        model = body.get("model", "")
+        prompt = body.get("input", "")
+        if not isinstance(prompt, str):
+            prompt = json.dumps(prompt, ensure_ascii=False)
+        api_key = request.headers.get("x-goog-api-key", "")
+        behavior = self.behavior(model)
+        self.stats[f"requests/{model}"] += 1
+        self.stats[f"key/{api_key}"] += 1
+        
+        if api_key in self.invalid_keys:
+            self.stats[f"401/{model}"] += 1
+            return web.json_response(
+                error_body(400, "INVALID_ARGUMENT", "API key not valid. Please pass a valid API key. API_KEY_INVALID"),
+                status=400,
+            )
+        
+        outcome = behavior.outcome()
+        self.stats[f"{outcome}/{model}"] += 1
+        latency = behavior.latency()
+        if outcome == "429":
+            await asyncio.sleep(min(latency, 0.05))
+            return web.json_response(
+                error_body(429, "RESOURCE_EXHAUSTED", "Resource has been exhausted (e.g. check quota)."),
+                status=429,
+            )
+        if outcome == "5xx":
+            await asyncio.sleep(latency)
+            return web.json_response(error_body(503, "UNAVAILABLE", "The model is overloaded."), status=503)
+        if outcome == "timeout":
+            await asyncio.sleep(behavior.hang)
+            return web.json_response(error_body(504, "DEADLINE_EXCEEDED", "Deadline exceeded."), status=504)
+        
+        self._ids += 1
+        interaction_id = f"fake-{self._ids}"
+        text = response_text(prompt)
+        if body.get("stream"):
+            return await self._stream(request, interaction_id, model, text, latency, behavior.ttft)
+        
+        await asyncio.sleep(latency)
+        return web.json_response({
+            "id": interaction_id,
+            "model": model,
+            "status": "completed",
+            "steps": [{"type": "model_output", "content": [{"type": "text", "text": text}]}],
+        })
+    
+    async def _stream(
+        self,
+        request: web.Request,
+        interaction_id: str,
+        model: str,
+        text: str,
+        latency: float,
+        ttft: float,
+    ) -> web.StreamResponse:
+        """SSE-ответ: первый фрагмент через ttft * latency, остальные равномерно до latency."""
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        
+        async def send(event: Dict) -> None:
+            await response.write(f"event: {event['event_type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n".encode())
+        
+        chunks = [text[i:i + self.chunk_chars] for i in range(0, len(text), self.chunk_chars)]
+        await send({"event_type": "interaction.created", "interaction": {"id": interaction_id, "model": model, "status": "in_progress"}})
+        await send({"event_type": "step.start", "index": 0, "step": {"type": "model_output"}})
+        await asyncio.sleep(latency * ttft)
+        step = latency * (1 - ttft) / max(1, len(chunks) - 1)
+        for n, chunk in enumerate(chunks):
+            if n:
+                await asyncio.sleep(step)
+            await send({"event_type": "step.delta", "index": 0, "delta": {"type": "text", "text": chunk}})
+        await send({"event_type": "step.stop", "index": 0})
+        await send({"event_type": "interaction.completed", "interaction": {"id": interaction_id, "model": model, "status": "completed"}})
+        await response.write_eof()
+        return response
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_behavior_arguments(parser)
+    return parser
+
+
+def add_behavior_arguments(parser: argparse.ArgumentParser) -> None:
+    """Параметры поведения сервера (общие с scripts/bench_ai.py)."""
+    parser.add_argument("--median", type=float, default=0.5, help="медианная задержка ответа, сек")
+    parser.add_argument("--p99", type=float, default=2.0, help="p99 задержки ответа, сек")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--rate-5xx", type=float, default=0.0, help="доля ответов 503")
+    parser.add_argument("--rate-timeout", type=float, default=0.0, help="доля зависших запросов")
+    parser.add_argument("--hang", type=float, default=60.0, help="сколько висит зависший запрос, сек")
+    parser.add_argument("--ttft", type=float, default=0.2, help="доля задержки до первого фрагмента при стриминге")
+    parser.add_argument("--chunk-chars", type=int, default=40, help="размер фрагмента при стриминге, символов")
+    parser.add_argument(
+        "--model",
+        action="append",
+        default=[],
+        metavar="NAME:key=value,...",
+        help="переопределение для модели, ключи: median, p99, rate_429, rate_5xx, rate_timeout, hang, ttft",
+    )
+    parser.add_argument("--invalid-key", action="append", default=[], help="API ключ, который отвергается как невалидный")
+
+
+def build_server(args: argparse.Namespace) -> FakeGemini:
+    default = ModelBehavior(
+        median=args.median,
+        p99=args.p99,
+        rate_429=args.rate_429,
+        rate_5xx=args.rate_5xx,
+        rate_timeout=args.rate_timeout,
+        hang=args.hang,
+        ttft=args.ttft,
+    )
+    models = {}
+    for value in args.model:
+        name, overrides = parse_model_override(value)
+        models[name] = default.copy(**overrides)
+    return FakeGemini(default, models, tuple(args.invalid_key), args.chunk_chars)
+
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    print(f"Fake Gemini listening on http://{args.host}:{args.port}")
+    web.run_app(build_server(args).app(), host=args.host, port=args.port, print=None)
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Скрипт пакетной оценки ответов, на которые пользователи не запросили фидбек.
+
+С --check ИИ не вызывается: скрипт раскладывает по пакетам до --max-answers ответов
+из БД (и типичный ответ) так же, как ночная оценка, печатает модели, бюджет пакета
+и число ответов в пакете и завершается с кодом 1, если в пакет помещается один ответ.
+"""
+import argparse
+import asyncio
+import sys
+from pathlib import Path
+
+# Добавляем корневую директорию в путь
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from bot.config import Config
+from bot.db.engine import create_engine, create_sessionmaker, init_db
+from bot.db.dao import get_ungraded_answers
+from bot.services.grading import AnswerGrader, grade_ungraded_answers, pack_batches, sample_batch_size
+from bot.utils.ai_interface import AIInterface
+from bot.logging import logger
+
+
+async def check(grader: AnswerGrader, max_answers: int) -> bool:
+    """Проверяет, что ответы раскладываются больше чем по одному в пакет."""
+    async with grader.sessionmaker() as session:
+        rows = await get_ungraded_answers(session, max_answers, 0)
+        items = await grader._load_items(session, rows)
+    
+    print(f"models: {', '.join(grader.models or grader.ai.models)}, batch budget: {grader.token_budget} tokens")
+    sample_size = sample_batch_size(grader.token_budget, grader.max_items)
+    print(f"typical answers per batch: {sample_size} (max {grader.max_items})")
+    ok = sample_size >= min(2, grader.max_items)
+    if len(items) > 1:
+        batches = pack_batches(items, grader.token_budget, grader.max_items)
+        per_batch = len(items) / len(batches)
+        print(f"ungraded answers: {len(items)} in {len(batches)} batches, {per_batch:.1f} per batch")
+        ok = ok and (per_batch > 1 or grader.max_items == 1)
+    return ok
+
+
+async def main(batch_size: int, max_answers: int, check_only: bool = False) -> bool:
+    """Оценивает ответы без фидбека пакетами."""
+    config = Config.from_env()
+    engine = create_engine(config)
+    await init_db(engine)
+    sessionmaker = create_sessionmaker(engine)
+    
+    ai = AIInterface(
+        retry_attempts=2,
+        retry_delay=1.0,
+        use_async=config.ai_async,
+        executor_workers=config.ai_executor_workers,
+    )
+    try:
+        if check_only:
+            return await check(AnswerGrader(sessionmaker, ai, batch_size, max_answers), max_answers)
+        stats = await grade_ungraded_answers(sessionmaker, ai, batch_size, max_answers)
+        if stats["failed"]:
+            logger.warning("Часть ответов не оценена, запустите скрипт повторно")
+        return True
+    finally:
+        await ai.aclose()
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    config = Config.from_env()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=config.grading_batch_size)
+    parser.add_argument("--max-answers", type=int, default=config.grading_max_answers)
+    parser.add_argument("--check", action="store_true", help="только проверить размер пакетов, без запросов к ИИ")
+    args = parser.parse_args()
+    if not asyncio.run(main(args.batch_size, args.max_answers, args.check)):
+        sys.exit(1)
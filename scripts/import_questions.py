@@ -11,7 +11,8 @@ sys.path.insert(0, str(Path(__file__).parent.parent))
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from bot.config import Config
-from bot.db.engine import create_engine, create_sessionmaker
+from bot.db.engine import create_engine, create_sessionmaker, init_db
+from bot.db.dao import bump_catalog_version
 from bot.db.models import Question
 from bot.utils.hashing import sha256_hash
 from bot.logging import logger
@@ -21,6 +22,7 @@ async def import_questions(csv_path: str):
     """Импортирует вопросы из CSV файла."""
     config = Config.from_env()
     engine = create_engine(config)
+    await init_db(engine)
     sessionmaker = create_sessionmaker(engine)
     
     async with sessionmaker() as session:
@@ -86,8 +88,10 @@ async def import_questions(csv_path: str):
                     logger.warning(f"Ошибка при обработке строки: {e}, строка: {row}")
                     continue
         
+        # Поднимаем версию каталога, чтобы бот перезагрузил кэш вопросов
+        version = await bump_catalog_version(session)
         await session.commit()
-        logger.info(f"Импорт завершен: добавлено {imported}, обновлено {updated}")
+        logger.info(f"Импорт завершен: добавлено {imported}, обновлено {updated}, версия каталога {version}")
     
     await engine.dispose()
 
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный тест: влияние долгих вызовов ИИ на остальные запросы к БД.
+
+Запускает N одновременных нажатий "Получить фидбек" (ИИ эмулируется задержкой)
+и параллельно измеряет задержку /stats. Если handler фидбека держит соединение
+на время генерации, пул (pool_size + max_overflow) исчерпывается и /stats ждет.
+
+Тестовые пользователи создаются с отрицательными tg_user_id и удаляются в конце.
+Telegram не вызывается: сообщения и ответы на callback подменены заглушками.
+
+Использование: python scripts/load_test_feedback.py [--concurrency 100] [--ai-latency 5]
+"""
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+# Добавляем корневую директорию в путь
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from sqlalchemy import delete, insert, select
+from bot.config import Config
+from bot.db.engine import create_engine, create_sessionmaker, init_db
+from bot.db.dao import get_or_create_user, save_answer
+from bot.db.models import FeedbackCache, Question, User, UserQuestion, UserState
+from bot.handlers.answer import callback_feedback
+from bot.handlers.stats import cmd_stats
+from bot.middleware import DatabaseMiddleware
+from bot.services.catalog import question_catalog
+from bot.utils.hashing import sha256_hash
+from bot.utils.metrics import percentile
+
+TG_ID_BASE = -9_000_000
+
+
+class SlowAI:
+    """Заглушка AIInterface: отвечает через заданное время."""
+    
+    def __init__(self, latency: float):
+        self.latency = latency
+    
+    async def agenerate_text_with_model(self, prompt: str, *args):
+        await asyncio.sleep(self.latency)
+        return "Синтетический ответ нагрузочного теста", "fake-model"
+    
+    async def agenerate_text(self, prompt: str, *args) -> str:
+        text, _ = await self.agenerate_text_with_model(prompt, *args)
+        return text
+
+
+async def _noop(*args, **kwargs):
+    return None
+
+
+def fake_callback(tg_user_id: int, question_id: int):
+    return SimpleNamespace(
+        data=f"feedback:{question_id}",
+        from_user=SimpleNamespace(id=tg_user_id),
+        answer=_noop,
+        message=SimpleNamespace(answer=_noop),
+    )
+
+
+def fake_message(tg_user_id: int):
+    return SimpleNamespace(from_user=SimpleNamespace(id=tg_user_id), answer=_noop)
+
+
+async def measure_stats(middleware: DatabaseMiddleware, tg_user_id: int, duration: float) -> list:
+    """Последовательно вызывает /stats в течение duration секунд, возвращает задержки в мс."""
+    async def handler(event, data):
+        return await cmd_stats(event, data["session"])
+    
+    timings = []
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        started = time.perf_counter()
+        await middleware(handler, fake_message(tg_user_id), {})
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+
+def report(name: str, timings: list) -> None:
+    print(
+        f"{name:<24} n={len(timings):<5} p50={percentile(timings, 50):8.2f} ms "
+        f"p99={percentile(timings, 99):8.2f} ms max={max(timings):8.2f} ms "
+        f"mean={statistics.mean(timings):8.2f} ms"
+    )
+
+
+async def run(concurrency: int, ai_latency: float):
+    config = Config.from_env()
+    engine = create_engine(config)
+    await init_db(engine)
+    sessionmaker = create_sessionmaker(engine)
+    
+    bot = SimpleNamespace(send_message=_noop)
+    middleware = DatabaseMiddleware(sessionmaker, bot, config, SlowAI(ai_latency))
+    tg_ids = [TG_ID_BASE - i for i in range(concurrency + 1)]
+    
+    # Подготовка: вопрос и ответ для каждого тестового пользователя
+    question_hash = sha256_hash(f"load test question {time.time()}")
+    async with sessionmaker() as session:
+        question_id = (await session.execute(
+            insert(Question).values(
+                freq_score=5,
+                question="load test question",
+                question_hash=question_hash,
+            ).returning(Question.id)
+        )).scalar_one()
+        for tg_user_id in tg_ids:
+            user = await get_or_create_user(session, tg_user_id)
+            await save_answer(session, user.id, question_id, f"load test answer {tg_user_id}")
+        await session.commit()
+        await question_catalog.refresh(session)
+    
+    try:
+        baseline = await measure_stats(middleware, tg_ids[0], duration=2.0)
+        
+        async def feedback_handler(event, data):
+            return await callback_feedback(event, data["session"], data["bot"], data["ai"], data["config"])
+        
+        started = time.perf_counter()
+        feedback_tasks = [
+            asyncio.create_task(middleware(feedback_handler, fake_callback(tg_user_id, question_id), {}))
+            for tg_user_id in tg_ids[1:]
+        ]
+        # Даем запросам фидбека дойти до ожидания ИИ
+        await asyncio.sleep(0.2)
+        under_load = await measure_stats(middleware, tg_ids[0], duration=max(1.0, ai_latency - 0.5))
+        await asyncio.gather(*feedback_tasks)
+        feedback_duration = time.perf_counter() - started
+        
+        print(f"pool: size={engine.pool.size()} overflow={engine.pool.overflow()}")
+        report("/stats baseline", baseline)
+        report(f"/stats under {concurrency} AI", under_load)
+        print(f"{concurrency} feedback requests finished in {feedback_duration:.2f}s (AI latency {ai_latency}s)")
+    finally:
+        async with sessionmaker() as session:
+            user_ids = select(User.id).where(User.tg_user_id.in_(tg_ids)).scalar_subquery()
+            await session.execute(delete(UserQuestion).where(UserQuestion.user_id.in_(user_ids)))
+            await session.execute(delete(UserState).where(UserState.user_id.in_(user_ids)))
+            await session.execute(delete(User).where(User.tg_user_id.in_(tg_ids)))
+            await session.execute(delete(Question).where(Question.id == question_id))
+            await session.execute(delete(FeedbackCache).where(FeedbackCache.question_hash == question_hash))
+            await session.commit()
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--ai-latency", type=float, default=5.0)
+    args = parser.parse_args()
+    asyncio.run(run(args.concurrency, args.ai_latency))
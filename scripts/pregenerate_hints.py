@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""Скрипт заполнения кэша подсказок ИИ для всего каталога вопросов."""
+import argparse
+import asyncio
+import sys
+from pathlib import Path
+
+# Добавляем корневую директорию в путь
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from bot.config import Config
+from bot.db.engine import create_engine, create_sessionmaker, init_db
+from bot.services.hint_cache import pregenerate_hints
+from bot.utils.ai_interface import AIInterface
+from bot.logging import logger
+
+
+async def main(concurrency: int):
+    """Генерирует подсказки для вопросов, которых еще нет в кэше."""
+    config = Config.from_env()
+    engine = create_engine(config)
+    await init_db(engine)
+    sessionmaker = create_sessionmaker(engine)
+    
+    ai = AIInterface(
+        retry_attempts=2,
+        retry_delay=1.0,
+        use_async=config.ai_async,
+        executor_workers=config.ai_executor_workers,
+    )
+    try:
+        stats = await pregenerate_hints(sessionmaker, ai, concurrency)
+        if stats["failed"]:
+            logger.warning("Часть подсказок не сгенерирована, запустите скрипт повторно")
+    finally:
+        await ai.aclose()
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--concurrency", type=int, default=Config.from_env().hint_pregen_concurrency)
+    args = parser.parse_args()
+    asyncio.run(main(args.concurrency))